@@ -0,0 +1,7 @@
+"""
+性能基准测试。
+
+    uv run python -m benchmarks.run --sizes 10000 100000
+    uv run python -m benchmarks.compare benchmarks/results/a.json benchmarks/results/b.json
+    uv run python -m benchmarks.differential --fee-cases 1000000
+"""
@@ -0,0 +1,49 @@
+"""
+对比两次基准测试结果 (按 name + size 匹配，比较中位数耗时)。
+
+    uv run python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return report.get("meta", {}), {(r["name"], r["size"]): r for r in report.get("results", [])}
+
+
+def compare(old_path, new_path, threshold=0.1):
+    """
+    返回对比行列表 [(name, size, old_s, new_s, ratio, flag)]。
+    ratio = new / old；变化超过 threshold 的标记为 '慢' 或 '快'。
+    """
+    _, old = load_results(old_path)
+    _, new = load_results(new_path)
+    rows = []
+    for key in sorted(set(old) & set(new)):
+        old_s, new_s = old[key]["median_s"], new[key]["median_s"]
+        ratio = new_s / old_s if old_s else float("inf")
+        flag = "慢" if ratio > 1 + threshold else ("快" if ratio < 1 - threshold else "")
+        rows.append((key[0], key[1], old_s, new_s, ratio, flag))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比两次基准测试结果")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="标记变化的相对阈值")
+    args = parser.parse_args(argv)
+
+    old_meta, _ = load_results(args.old)
+    new_meta, _ = load_results(args.new)
+    print(f"old: {old_meta.get('git_commit')} @ {old_meta.get('started_at')}")
+    print(f"new: {new_meta.get('git_commit')} @ {new_meta.get('started_at')}")
+    print(f"{'name':<45} {'size':>9} {'old(ms)':>11} {'new(ms)':>11} {'ratio':>7}")
+    for name, size, old_s, new_s, ratio, flag in compare(args.old, args.new, args.threshold):
+        print(f"{name:<45} {size:>9} {old_s * 1000:>11.2f} {new_s * 1000:>11.2f} {ratio:>7.2f} {flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,682 @@
+"""
+差分等价测试：用随机生成 (偏向边界) 的用例，逐一对比各加速实现与冻结的参考实现
+(benchmarks/reference.py) 的结果，并报告两者的吞吐量。
+
+    uv run python -m benchmarks.differential --fee-cases 1000000 --count-cases 2000
+
+费用引擎: calculate_fee、calculate_fee_matrix、sweep_fees；
+门店数量: calc_auto_counts、cached_calc_auto_counts、StoreIndex.calc_counts、calc_war_zone_counts、
+BatchCountEngine、StandardPriceList (标准通道价目表查表报价)。
+新增加速实现时，在 FEE_ENGINES / COUNT_ENGINES 中注册即可纳入对比。
+存在不一致时打印前若干个反例并以非零状态退出。
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from itertools import product
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import reference, synthetic
+from src.core.batch_counts import BatchCountEngine
+from src.core.calculator import calculate_fee, calculate_fee_matrix
+from src.core.config_loader import load_config
+from src.core.price_list import StandardPriceList, build_price_list, quote_standard, write_price_list
+from src.core.result_cache import ResultCache, cached_calc_auto_counts
+from src.core.snapshot import attach_snapshot, publish_snapshot
+from src.core.store_index import FilterMaskState, StoreIndex
+from src.core.store_manager import ALL_STORE_TYPES, calc_auto_counts, calc_war_zone_counts, compact_store_master
+from src.core.sweep import sweep_fees
+
+# 参与对比的费用结果字段 (breakdown_str 等展示文本不比较)
+FEE_FIELDS = ["final_fee", "theoretical_fee", "discount_factor", "is_floor_triggered", "min_floor", "floor_source_desc"]
+
+# 每个条款组合对应的门店数量行数 (calculate_fee_matrix) / 每维取值数 (sweep_fees)
+MATRIX_ROWS = 16
+SWEEP_AXIS_VALUES = 3
+
+MAX_EXAMPLES = 5
+
+UNKNOWN = "未配置"
+
+
+# ---------------------------------------------------------------------------
+# 用例生成
+# ---------------------------------------------------------------------------
+
+def _range_edges(tables):
+    """区间表的全部 min/max，以及紧邻两侧的浮点数。"""
+    edges = set()
+    for table in tables:
+        for item in table:
+            for bound in (item["min"], item["max"]):
+                bound = float(bound)
+                edges.update([bound, np.nextafter(bound, -np.inf), np.nextafter(bound, np.inf)])
+    return sorted(edges)
+
+
+def fuzz_config(base_config, rng):
+    """
+    在基准配置上随机扰动：系数取易产生舍入差异的小数，基础费用带角分，
+    并随机删除部分条目以覆盖缺失时回退 1.0 / 0 的分支。
+    """
+    config = copy.deepcopy(base_config)
+    tricky = [0.85, 0.875, 0.9, 0.95, 0.995, 1.0, 1.005, 1.015, 1.05, 1.1, 1.125, 1.15, 1.25, 1.3]
+
+    for fees in config["base_fees"].values():
+        for store_type in list(fees):
+            fees[store_type] = round(float(fees[store_type]) * rng.uniform(0.5, 1.5), int(rng.integers(0, 3)))
+    for rules in config["sku_discounts"].values():
+        for item in rules:
+            item["discount"] = float(rng.choice(tricky))
+    for key in ("gross_margin_coeffs", "cost_price_coeffs"):
+        for item in config[key]:
+            item["coeff"] = float(rng.choice(tricky))
+    for rules in config["return_ratio_rules"].values():
+        for item in rules:
+            item["coeff"] = float(rng.choice(tricky))
+    for key in ("payment_coeffs", "return_policy_coeffs", "supplier_type_coeffs"):
+        table = config[key]
+        for name in list(table):
+            if rng.random() < 0.15:
+                del table[name]
+            else:
+                table[name] = float(rng.choice(tricky))
+    if rng.random() < 0.3:
+        config["sku_discounts"].pop(str(rng.choice(list(config["sku_discounts"]))), None)
+    return config
+
+
+class FeeCaseGenerator:
+    """
+    按配置生成 (row_data, store_counts) 用例。数值字段有一半概率取区间边界及其相邻浮点数，
+    枚举字段会混入未配置的取值，所有可选字段都可能缺失。
+    """
+
+    def __init__(self, config, rng):
+        self.config = config
+        self.rng = rng
+        self.categories = list(config["base_fees"]) + [UNKNOWN]
+        self.sku_edges = _range_edges(config["sku_discounts"].values()) + [0, 1, 2]
+        self.margin_edges = _range_edges([config["gross_margin_coeffs"]]) + [65.0, np.nextafter(65.0, -np.inf)]
+        self.cost_edges = _range_edges([config["cost_price_coeffs"]]) + [0.0]
+        self.ratio_edges = _range_edges(config["return_ratio_rules"].values()) + [0.0, 100.0]
+        self.payments = synthetic.PAYMENT_METHODS + [UNKNOWN]
+        self.policies = synthetic.RETURN_POLICIES + [UNKNOWN]
+        self.suppliers = synthetic.SUPPLIER_TYPES + [UNKNOWN]
+
+    def _pick(self, values):
+        return values[int(self.rng.integers(len(values)))]
+
+    def _numeric(self, edges, low, high, integer=False):
+        if self.rng.random() < 0.5:
+            return self._pick(edges)
+        if integer:
+            return int(self.rng.integers(low, high))
+        return round(float(self.rng.uniform(low, high)), int(self.rng.integers(0, 4)))
+
+    def numeric_values(self, field):
+        """某一数值字段的一个随机取值。"""
+        if field == "同一供应商单次引进SKU数":
+            return self._numeric(self.sku_edges, 0, 30, integer=True)
+        if field == "预估毛利率(%)":
+            return self._numeric(self.margin_edges, -5, 105)
+        if field == "底价":
+            return self._numeric(self.cost_edges, 0, 300)
+        return self._numeric(self.ratio_edges, 0, 110)
+
+    def row(self):
+        row = {
+            "新品大类": self._pick(self.categories),
+            "统采or地采": self._pick(["统采", "地采", UNKNOWN]),
+            "同一供应商单次引进SKU数": self.numeric_values("同一供应商单次引进SKU数"),
+            "预估毛利率(%)": self.numeric_values("预估毛利率(%)"),
+            "付款方式": self._pick(self.payments),
+            "底价": self.numeric_values("底价"),
+            "退货条件": self._pick(self.policies),
+            "退货比例(%)": self.numeric_values("退货比例(%)"),
+            "供应商类型": self._pick(self.suppliers),
+        }
+        for key in list(row):
+            if key != "新品大类" and self.rng.random() < 0.05:
+                del row[key]
+            elif not isinstance(row[key], str):
+                continue
+            elif key != "新品大类" and self.rng.random() < 0.03:
+                # 显式为 None 与缺失不同 (如 统采or地采)，不应共用缓存结果
+                row[key] = None
+            elif self.rng.random() < 0.05:
+                # 首尾空格不应与去掉空格后的取值共用缓存结果
+                row[key] = self._pick([f"{row[key]} ", f" {row[key]}"])
+        return row
+
+    def variant(self, row):
+        """
+        row 的近似变体：一个字符串字段改为 None、加首尾空格或删除。与 row 先后计算，
+        检查各引擎是否与参考实现一样区分这些输入。
+        """
+        row = dict(row)
+        keys = [k for k, v in row.items() if k != "新品大类" and (v is None or isinstance(v, str))]
+        if not keys:
+            return row
+        key = self._pick(keys)
+        kind = self._pick(["none", "pad", "drop"])
+        if kind == "none":
+            row[key] = None
+        elif kind == "pad" and isinstance(row[key], str):
+            row[key] = f"{row[key]} "
+        else:
+            del row[key]
+        return row
+
+    def cases(self, n):
+        """n 个 (row_data, store_counts) 用例，约 1/5 为上一个用例的近似变体 (门店数相同)。"""
+        cases = []
+        for _ in range(n):
+            if cases and self.rng.random() < 0.2:
+                row, counts = cases[-1]
+                cases.append((self.variant(row), dict(counts)))
+            else:
+                cases.append((self.row(), self.store_counts()))
+        return cases
+
+    def store_counts(self, ordered=False):
+        """门店数量：全量门店类型或随机子集 (可能乱序)，含 0 和较大的数量。"""
+        if self.rng.random() < 0.3:
+            types = list(ALL_STORE_TYPES)
+        else:
+            k = int(self.rng.integers(1, len(ALL_STORE_TYPES) + 1))
+            types = list(self.rng.choice(ALL_STORE_TYPES, size=k, replace=False))
+            if ordered:
+                types = [t for t in ALL_STORE_TYPES if t in types]
+        scale = self._pick([3, 50, 3000])
+        return {t: int(self.rng.integers(0, scale)) for t in types}
+
+
+def make_store_master_with_edges(n_stores, seed):
+    """合成门店主数据，并注入空值、空白、中英文逗号、未知销售规模等边界数据。"""
+    rng = np.random.default_rng(seed)
+    df = synthetic.make_store_master(n_stores, seed)
+    n_edge = max(1, n_stores // 20)
+
+    def pick_rows():
+        return rng.choice(n_stores, size=n_edge, replace=False)
+
+    codes = df["受限批文分类编码"].to_numpy(dtype=object)
+    codes[pick_rows()] = rng.choice(["", " ", " 13 ", "13，21", "21 , 13", "130", "nan"], size=n_edge)
+    df["受限批文分类编码"] = codes
+    df.loc[pick_rows(), "提报战区"] = None
+    df.loc[pick_rows(), "销售规模"] = "闭店"
+    df.loc[pick_rows(), "客流商圈"] = None
+    df.loc[pick_rows(), "是否医保店"] = rng.choice([" 是", "是 ", None], size=n_edge)
+    sapids = df["门店sapid"].to_numpy(dtype=object)
+    rows = pick_rows()
+    sapids[rows] = [f" {s} " for s in sapids[rows]]
+    df["门店sapid"] = sapids
+    return df
+
+
+class CountCaseGenerator:
+    """生成 calc_auto_counts 的参数组合。"""
+
+    def __init__(self, store_master_df, war_zones, blacklists, rng):
+        self.df = store_master_df
+        self.war_zones = war_zones
+        self.blacklists = blacklists
+        self.rng = rng
+        self.companies = sorted(store_master_df["省公司"].dropna().unique())
+
+    def _pick(self, values):
+        return values[int(self.rng.integers(len(values)))]
+
+    def _subset(self, values, max_size=3):
+        k = int(self.rng.integers(1, min(max_size, len(values)) + 1))
+        return [values[i] for i in self.rng.choice(len(values), size=k, replace=False)]
+
+    def channel(self):
+        kind = self.rng.random()
+        if kind < 0.5:
+            return self._pick(synthetic.CHANNELS)
+        if kind < 0.65:
+            return "自定义"
+        types = self._subset(ALL_STORE_TYPES + ["闭店"], max_size=4)
+        if kind < 0.85:
+            return types
+        return self._pick(["，", ",", " , "]).join(types)
+
+    def filters(self):
+        filters = {}
+        options = {
+            "省公司": lambda: self._subset(self.companies),
+            "客流商圈": lambda: self._subset(synthetic.BUSINESS_DISTRICTS),
+            "店龄店型": lambda: self._subset(["新店", "1年店", "2年店", "2年+店"]),
+            "是否医保店": lambda: self._pick(["是", "否", "全部"]),
+            "是否统筹店": lambda: self._pick(["是", "否"]),
+            "销售规模": lambda: self._subset(ALL_STORE_TYPES, max_size=4),
+            "不存在的列": lambda: ["x"],
+        }
+        for col, make in options.items():
+            if self.rng.random() < 0.35:
+                filters[col] = make()
+        return filters or None
+
+    def kwargs(self):
+        channel = self.channel()
+        kwargs = {
+            "channel": channel,
+            "war_zone": self._pick(["全集团", None] + self.war_zones + [self.war_zones[:2]]),
+            "restricted_xp_code": self._pick([None, "13", "21", " 13 ", "nan", "", 13]),
+            "filters": self.filters() if channel == "自定义" else None,
+        }
+        if self.rng.random() < 0.5:
+            kwargs["blacklist_df"] = self._pick(self.blacklists)
+            kwargs["selected_xp_category"] = self._pick([None, "nan"] + list(synthetic.XP_CATEGORIES))
+            kwargs["category"] = self._pick([None] + synthetic.CATEGORIES)
+        return kwargs
+
+
+# ---------------------------------------------------------------------------
+# 对比
+# ---------------------------------------------------------------------------
+
+class EngineReport:
+    """累计单个引擎的用例数、不一致数、反例及双方耗时。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.cases = 0
+        self.mismatches = 0
+        # 参考实现本身抛异常的用例 (如战区内没有门店时的受限过滤)，不参与比较
+        self.skipped = 0
+        self.examples = []
+        self.reference_s = 0.0
+        self.candidate_s = 0.0
+
+    def check(self, expected, actual, context):
+        self.cases += 1
+        if expected != actual:
+            self.mismatches += 1
+            if len(self.examples) < MAX_EXAMPLES:
+                self.examples.append({"context": context, "expected": expected, "actual": actual})
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "cases": self.cases,
+            "mismatches": self.mismatches,
+            "skipped": self.skipped,
+            "reference_per_s": self.cases / self.reference_s if self.reference_s else None,
+            "candidate_per_s": self.cases / self.candidate_s if self.candidate_s else None,
+            "examples": self.examples,
+        }
+
+
+def _fee_view(result):
+    """把费用结果规整为可直接比较的基本类型。"""
+    view = {}
+    for field in FEE_FIELDS:
+        value = result[field]
+        if isinstance(value, (np.generic,)):
+            value = value.item()
+        if field in ("final_fee", "theoretical_fee", "min_floor", "discount_factor"):
+            value = float(value)
+        view[field] = value
+    return view
+
+
+def _timed_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def check_scalar_fee_engine(report, engine, cases, config):
+    for row, counts in cases:
+        expected, ref_s = _timed_call(reference.calculate_fee, row, counts, config)
+        actual, cand_s = _timed_call(engine, row, counts, config)
+        report.reference_s += ref_s
+        report.candidate_s += cand_s
+        report.check(_fee_view(expected), _fee_view(actual), {"row": row, "store_counts": counts})
+
+
+def check_fee_matrix(report, gen, config, n_rows):
+    for _ in range(max(1, n_rows // MATRIX_ROWS)):
+        row = gen.row()
+        count_rows = [gen.store_counts(ordered=True) for _ in range(MATRIX_ROWS)]
+        counts_df = pd.DataFrame(count_rows, columns=ALL_STORE_TYPES).fillna(0).astype(np.int64)
+
+        result, cand_s = _timed_call(calculate_fee_matrix, row, counts_df, config)
+        report.candidate_s += cand_s
+        for i, counts in enumerate(counts_df.to_dict("records")):
+            expected, ref_s = _timed_call(reference.calculate_fee, row, counts, config)
+            report.reference_s += ref_s
+            out = result.iloc[i]
+            actual = {
+                "final_fee": float(out["折后总新品铺货费 (元)"]),
+                "theoretical_fee": float(out["理论总新品铺货费 (元)"]),
+                "discount_factor": float(out["折扣"]),
+                "is_floor_triggered": bool(out["是否触发兜底"]),
+            }
+            expected = {k: v for k, v in _fee_view(expected).items() if k in actual}
+            report.check(expected, actual, {"row": row, "store_counts": counts})
+
+
+def check_sweep(report, gen, config, n_points):
+    numeric = ["同一供应商单次引进SKU数", "预估毛利率(%)", "底价", "退货比例(%)"]
+    grid_size = SWEEP_AXIS_VALUES ** len(numeric) * 2 * 2 * 2
+    for _ in range(max(1, n_points // grid_size)):
+        row = gen.row()
+        counts = gen.store_counts()
+        spec = {field: [gen.numeric_values(field) for _ in range(SWEEP_AXIS_VALUES)] for field in numeric}
+        spec["付款方式"] = [gen._pick(gen.payments) for _ in range(2)]
+        spec["退货条件"] = [gen._pick(gen.policies) for _ in range(2)]
+        spec["供应商类型"] = [gen._pick(gen.suppliers) for _ in range(2)]
+
+        result, cand_s = _timed_call(sweep_fees, row, counts, config, spec)
+        report.candidate_s += cand_s
+        # 网格按 SWEEP_FIELDS 的顺序展开 (C 顺序)，与 sweep_fees 的结果行一一对应
+        fields = list(result.columns[:7])
+        for i, values in enumerate(product(*(spec.get(f, [row.get(f)]) for f in fields))):
+            point = {**row, **{f: v for f, v in zip(fields, values) if f in spec}}
+            expected, ref_s = _timed_call(reference.calculate_fee, point, counts, config)
+            report.reference_s += ref_s
+            actual = {
+                "final_fee": float(result["折后总新品铺货费 (元)"].iat[i]),
+                "discount_factor": float(result["折扣"].iat[i]),
+                "is_floor_triggered": bool(result["是否触发兜底"].iat[i]),
+            }
+            expected = {k: v for k, v in _fee_view(expected).items() if k in actual}
+            report.check(expected, actual, {"row": point, "store_counts": counts})
+
+
+def _cached_count_engine():
+    cache = ResultCache(max_entries=10_000)
+    return lambda df, channel, **kwargs: cached_calc_auto_counts(df, channel, "diff", "diff", cache=cache, **kwargs)
+
+
+def _compact_count_engine():
+    # 在压缩后的门店表 (category / 整数 sapid / 布尔标签) 上统计，结果应与原表一致
+    compacted = {}
+
+    def engine(df, channel, **kwargs):
+        if id(df) not in compacted:
+            compacted[id(df)] = compact_store_master(df)[0]
+        return calc_auto_counts(compacted[id(df)], channel, **kwargs)
+    return engine
+
+
+def _snapshot_engine():
+    # 发布到临时快照目录后以内存映射方式挂载，验证序列化和零拷贝视图上的统计
+    indexes = {}
+    root = tempfile.mkdtemp(prefix="xp_fee_snapshot_")
+
+    def engine(df, channel, **kwargs):
+        if id(df) not in indexes:
+            version = f"v{len(indexes)}"
+            publish_snapshot(StoreIndex(df), root, version)
+            indexes[id(df)] = attach_snapshot(root, version)
+        return indexes[id(df)].calc_counts(channel, **kwargs)
+    return engine
+
+
+def _store_index_engine():
+    # 每份门店表构建一次索引，并复用同一个 FilterMaskState 以覆盖增量更新路径
+    indexes = {}
+
+    def engine(df, channel, **kwargs):
+        if id(df) not in indexes:
+            index = StoreIndex(df)
+            indexes[id(df)] = (index, FilterMaskState(index))
+        index, state = indexes[id(df)]
+        return index.calc_counts(channel, state=state, **kwargs)
+    return engine
+
+
+# 标量费用引擎：签名与 calculate_fee 相同；工厂函数每次运行返回新实例 (如独立的缓存)
+FEE_ENGINES = {
+    "calculate_fee": lambda: calculate_fee,
+}
+
+# 门店数量引擎：签名与 calc_auto_counts 相同
+COUNT_ENGINES = {
+    "calc_auto_counts": lambda: calc_auto_counts,
+    "cached_calc_auto_counts": _cached_count_engine,
+    "StoreIndex.calc_counts": _store_index_engine,
+    "calc_auto_counts[compact]": _compact_count_engine,
+    "StoreIndex[snapshot]": _snapshot_engine,
+}
+
+
+def _count_view(counts):
+    return {str(k): int(v) for k, v in counts.items()}
+
+
+def check_count_engines(reports, gen, n_cases):
+    engines = {name: factory() for name, factory in COUNT_ENGINES.items()}
+    for _ in range(n_cases):
+        kwargs = gen.kwargs()
+        channel = kwargs.pop("channel")
+        try:
+            expected, ref_s = _timed_call(reference.calc_auto_counts, gen.df, channel, **kwargs)
+        except KeyError:
+            for name in engines:
+                reports[name].skipped += 1
+            continue
+        context = {"channel": channel, **{k: v for k, v in kwargs.items() if k != "blacklist_df"}}
+        for name, engine in engines.items():
+            actual, cand_s = _timed_call(engine, gen.df, channel, **kwargs)
+            reports[name].reference_s += ref_s
+            reports[name].candidate_s += cand_s
+            reports[name].check(_count_view(expected), _count_view(actual), context)
+
+
+def check_war_zone_counts(report, gen, n_cases):
+    zones = ["全集团"] + gen.war_zones
+    for _ in range(n_cases):
+        kwargs = gen.kwargs()
+        channel = kwargs.pop("channel")
+        kwargs.pop("war_zone")
+        matrix, cand_s = _timed_call(calc_war_zone_counts, gen.df, channel, zones, **kwargs)
+        report.candidate_s += cand_s
+        context = {"channel": channel, **{k: v for k, v in kwargs.items() if k != "blacklist_df"}}
+        for zone in zones:
+            try:
+                expected, ref_s = _timed_call(reference.calc_auto_counts, gen.df, channel, war_zone=zone, **kwargs)
+            except KeyError:
+                report.skipped += 1
+                continue
+            report.reference_s += ref_s
+            actual = matrix.loc[zone].to_dict() if len(matrix.columns) else {}
+            report.check(_count_view(expected), _count_view(actual), {**context, "war_zone": zone})
+
+
+def check_batch_counts(report, gen, n_cases):
+    """BatchCountEngine 一次算出整批用例 (无自定义筛选) 的计数，逐行与参考实现比较。"""
+    cases = []
+    while len(cases) < n_cases:
+        kwargs = gen.kwargs()
+        if not kwargs.get("filters"):
+            cases.append(kwargs)
+    zones = ["全集团"] + gen.war_zones
+    engine = None
+    for blacklist in [None] + gen.blacklists:
+        group = [c for c in cases if c.get("blacklist_df") is blacklist]
+        if not group:
+            continue
+        start = time.perf_counter()
+        engine = engine or BatchCountEngine(StoreIndex(gen.df))
+        result = engine.counts(
+            [c["channel"] for c in group],
+            restricted_codes=[c["restricted_xp_code"] for c in group],
+            war_zones=[c["war_zone"] for c in group],
+            blacklist_df=blacklist,
+            xp_categories=[c.get("selected_xp_category") for c in group],
+            categories=[c.get("category") for c in group],
+            by_war_zone=zones,
+        )
+        report.candidate_s += time.perf_counter() - start
+        for i, kwargs in enumerate(group):
+            kwargs = dict(kwargs)
+            channel = kwargs.pop("channel")
+            kwargs.pop("filters")
+            context = {"channel": channel, **{k: v for k, v in kwargs.items() if k != "blacklist_df"}}
+            checks = [(kwargs, result["counts"][i])]
+            checks.append(({"war_zone": kwargs["war_zone"]}, result["raw_counts"][i]))
+            if i < 10:
+                checks += [({**kwargs, "war_zone": zone}, result["zone_counts"][i][zone]) for zone in zones]
+            for ref_kwargs, actual in checks:
+                try:
+                    expected, ref_s = _timed_call(reference.calc_auto_counts, gen.df, channel, **ref_kwargs)
+                except KeyError:
+                    report.skipped += 1
+                    continue
+                report.reference_s += ref_s
+                report.check(_count_view(expected), _count_view(actual), {**context, "war_zone": ref_kwargs["war_zone"]})
+
+
+def check_price_list(report, gen, config, n_cases, rng):
+    """标准通道价目表：预计算一次，随机组合 + 随机条款的查表报价与参考实现逐一比较。"""
+    xp_map = dict(synthetic.XP_CATEGORIES)
+    blacklist = gen.blacklists[0]
+    fee_gen = FeeCaseGenerator(config, rng)
+    war_zones = config.get("war_zones", ["全集团"])
+    with tempfile.TemporaryDirectory(prefix="xp_fee_price_") as root:
+        path = os.path.join(root, "price_list.sqlite")
+        start = time.perf_counter()
+        write_price_list(build_price_list(StoreIndex(gen.df), config, xp_map, blacklist), path, "diff")
+        price_list = StandardPriceList(path)
+        report.candidate_s += time.perf_counter() - start
+        for _ in range(n_cases):
+            row = fee_gen.row()
+            # 价目表只收录配置中的大类；其他大类查不到，由调用方退回实时统计
+            row["新品大类"] = gen._pick(list(config.get("base_fees", {})))
+            row["统采or地采"] = gen._pick(["统采", "地采"])
+            xp_category = gen._pick(list(xp_map))
+            row.update({"处方类别": xp_category, "channel": gen._pick(synthetic.CHANNELS), "提报战区": gen._pick(war_zones)})
+            result, cand_s = _timed_call(quote_standard, row, config, price_list)
+            try:
+                counts, count_s = _timed_call(
+                    reference.calc_auto_counts, gen.df, row["channel"], restricted_xp_code=xp_map[xp_category],
+                    war_zone=row["提报战区"], blacklist_df=blacklist, selected_xp_category=xp_category,
+                    category=row["新品大类"],
+                )
+            except KeyError:
+                report.skipped += 1
+                continue
+            expected, fee_s = _timed_call(reference.calculate_fee, row, counts, config)
+            report.candidate_s += cand_s
+            report.reference_s += count_s + fee_s
+            fields = [f for f in FEE_FIELDS if f != "floor_source_desc"]
+            expected_view = {**{f: v for f, v in _fee_view(expected).items() if f in fields}, "counts": _count_view(counts)}
+            actual_view = ({**{f: float(result[f]) if f != "is_floor_triggered" else result[f] for f in fields},
+                            "counts": _count_view(result["store_details"])} if result is not None else None)
+            report.check(expected_view, actual_view, {k: v for k, v in row.items()})
+
+
+# ---------------------------------------------------------------------------
+# 运行
+# ---------------------------------------------------------------------------
+
+def _load_base_config(seed):
+    with tempfile.TemporaryDirectory(prefix="xp_fee_diff_") as root:
+        path = os.path.join(root, "coefficients.xlsx")
+        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+            for sheet_name, sheet_df in synthetic.make_config_sheets(seed).items():
+                sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        return load_config(path)
+
+
+def run_differential(fee_cases=100_000, count_cases=500, n_stores=5_000, seed=0, config_every=10_000, log=print):
+    """
+    运行全部对比，返回 {引擎名: EngineReport}。
+
+    Args:
+        fee_cases: 每个费用引擎的用例数 (矩阵/模拟引擎按网格点计)。
+        count_cases: 每个门店数量引擎的参数组合数。
+        n_stores: 合成门店主数据规模。
+        config_every: 每隔多少个费用用例更换一次随机扰动的配置。
+    """
+    rng = np.random.default_rng(seed)
+    base_config = _load_base_config(seed)
+    reports = {name: EngineReport(name) for name in
+               list(FEE_ENGINES) + ["calculate_fee_matrix", "sweep_fees"] + list(COUNT_ENGINES) + ["calc_war_zone_counts", "BatchCountEngine", "StandardPriceList"]}
+
+    # 1. 费用：第一块用原始配置，之后每块换一个扰动配置
+    done = 0
+    while done < fee_cases:
+        chunk = min(config_every, fee_cases - done)
+        config = base_config if done == 0 else fuzz_config(base_config, rng)
+        gen = FeeCaseGenerator(config, rng)
+        cases = gen.cases(chunk)
+        for name, factory in FEE_ENGINES.items():
+            check_scalar_fee_engine(reports[name], factory(), cases, config)
+        check_fee_matrix(reports["calculate_fee_matrix"], gen, config, chunk)
+        check_sweep(reports["sweep_fees"], gen, config, chunk)
+        done += chunk
+        log(f"费用用例 {done}/{fee_cases}")
+
+    # 2. 门店数量
+    store_master_df = make_store_master_with_edges(n_stores, seed)
+    blacklists = [
+        synthetic.make_blacklist(store_master_df, ratio=0.02, seed=seed),
+        pd.DataFrame(columns=["门店sapid", "处方类别or新品大类"]),
+    ]
+    gen = CountCaseGenerator(store_master_df, synthetic.WAR_ZONES, blacklists, rng)
+    check_count_engines(reports, gen, count_cases)
+    check_war_zone_counts(reports["calc_war_zone_counts"], gen, max(1, count_cases // len(synthetic.WAR_ZONES)))
+    check_batch_counts(reports["BatchCountEngine"], gen, count_cases)
+    check_price_list(reports["StandardPriceList"], gen, base_config, count_cases, rng)
+    log(f"门店数量用例 {count_cases}")
+
+    return reports
+
+
+def print_report(reports):
+    print(f"{'engine':<26} {'cases':>10} {'mismatch':>9} {'reference/s':>13} {'candidate/s':>13} {'speedup':>8}")
+    for report in reports.values():
+        item = report.as_dict()
+        ref, cand = item["reference_per_s"] or 0, item["candidate_per_s"] or 0
+        speedup = cand / ref if ref else 0
+        print(f"{report.name:<26} {report.cases:>10} {report.mismatches:>9} {ref:>13,.0f} {cand:>13,.0f} {speedup:>7.1f}x")
+    for report in reports.values():
+        if report.skipped:
+            print(f"⚠️ {report.name}: 参考实现抛异常，跳过 {report.skipped} 个用例")
+    for report in reports.values():
+        for example in report.examples:
+            print(f"\n❌ {report.name}: {json.dumps(example, ensure_ascii=False, default=str)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="加速实现与参考实现的差分等价测试")
+    parser.add_argument("--fee-cases", type=int, default=100_000, help="每个费用引擎的用例数")
+    parser.add_argument("--count-cases", type=int, default=500, help="每个门店数量引擎的用例数")
+    parser.add_argument("--stores", type=int, default=5_000, help="合成门店主数据规模")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="(可选) 将报告写为 JSON")
+    args = parser.parse_args(argv)
+
+    reports = run_differential(args.fee_cases, args.count_cases, args.stores, args.seed)
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([r.as_dict() for r in reports.values()], f, ensure_ascii=False, indent=2, default=str)
+
+    failed = sum(r.mismatches for r in reports.values())
+    if failed:
+        print(f"\n❌ 共 {failed} 个不一致")
+        sys.exit(1)
+    print("\n✅ 所有引擎与参考实现一致")
+
+
+if __name__ == "__main__":
+    main()
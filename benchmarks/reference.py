@@ -0,0 +1,341 @@
+"""
+冻结的参考实现 (差分测试的判定基准)。
+
+calculate_fee / calc_auto_counts 逐字复制自重构前的 src/core/calculator.py 和
+src/core/store_manager.py，不随业务代码演进；只有当计费规则本身变更时才同步更新这里。
+"""
+import math
+
+import pandas as pd
+
+
+def get_coefficient(value, ranges, default=1.0):
+    """
+    Helper to find a coefficient from a range list.
+    辅助函数：根据数值在区间列表中查找对应的系数。
+    """
+    for item in ranges:
+        # 使用 safe get 兼容不同的 key 名称 (有的配置叫 discount 有的叫 coeff)
+        coeff_val = item.get('discount') if 'discount' in item else item.get('coeff', 1.0)
+        
+        if item['min'] <= value < item['max']:
+            return coeff_val
+            
+    return default
+
+def calculate_fee(row_data, store_counts, config):
+    """
+    Calculates the total fee and returns a breakdown.
+    计算总费用并返回详细的拆解过程。
+    
+    Args:
+        row_data: dict containing business terms (category, sku_count, procurement_type, etc.)
+        store_counts: dict of {store_type: count}
+        config: loaded configuration dict
+        
+    Returns:
+        dict: detailed calculation result
+    """
+    category = row_data.get("新品大类")
+    sku_count = row_data.get("同一供应商单次引进SKU数", 1)
+    procurement_type = row_data.get("统采or地采", "统采")
+    
+    # 1. Base Fee Calculation (基础费用计算)
+    base_fees_config = config.get("base_fees", {}).get(category, {})
+    total_base_fee = 0
+    breakdown = []
+    
+    breakdown.append(f"--- 基础费用 ---")
+    for store_type, count in store_counts.items():
+        if count > 0:
+            unit_fee = base_fees_config.get(store_type, 0)
+            subtotal = unit_fee * count
+            total_base_fee += subtotal
+            breakdown.append(f"{store_type}: {count}家 * {unit_fee}元 = {subtotal}元")
+            
+    breakdown.append(f"基础费用合计: {total_base_fee}元")
+    
+    # 2. Coefficients (系数获取)
+    coeffs = []
+    
+    # SKU Discount
+    all_sku_config = config.get("sku_discounts", {})
+    sku_rules = all_sku_config.get(category, {})
+    sku_discount = get_coefficient(sku_count, sku_rules, default=1.0)
+    coeffs.append(("SKU数量折扣", sku_discount))
+    
+    # Gross Margin
+    margin = row_data.get("预估毛利率(%)", 0)
+    margin_coeff = get_coefficient(margin, config.get("gross_margin_coeffs", []))
+    coeffs.append(("毛利率系数", margin_coeff))
+    
+    # Payment Terms
+    payment = row_data.get("付款方式")
+    payment_coeff = config.get("payment_coeffs", {}).get(payment, 1.0)
+    coeffs.append(("付款方式系数", payment_coeff))
+    
+    # Cost Price
+    cost = row_data.get("底价", 0)
+    cost_coeff = get_coefficient(cost, config.get("cost_price_coeffs", []))
+    coeffs.append(("底价系数", cost_coeff))
+    
+    # --- [修改点] Return Policy Logic (退货条件系数) ---
+    ret_policy = row_data.get("退货条件")
+    ret_ratio_rules = config.get("return_ratio_rules", {})
+    
+    # 优先判断是否存在复杂的比例规则 (如：效期可退, 效期可退+破损可退)
+    if ret_policy in ret_ratio_rules:
+        # 获取用户输入的退货比例 (默认为0)
+        ret_ratio_val = row_data.get("退货比例(%)", 0.0)
+        # 使用通用辅助函数根据比例查找区间系数
+        ret_coeff = get_coefficient(ret_ratio_val, ret_ratio_rules[ret_policy], default=1.0)
+        coeffs.append((f"退货条件系数({ret_policy} @ {ret_ratio_val}%)", ret_coeff))
+    else:
+        # 否则使用简单的字典查找 (普通退货条件)
+        ret_coeff = config.get("return_policy_coeffs", {}).get(ret_policy, 1.0)
+        coeffs.append((f"退货条件系数({ret_policy})", ret_coeff))
+    
+    # Supplier Type
+    supp_type = row_data.get("供应商类型")
+    supp_coeff = config.get("supplier_type_coeffs", {}).get(supp_type, 1.0)
+    coeffs.append(("供应商类型系数", supp_coeff))
+    
+    # 3. Final Calculation (最终计算)
+    discount_factor = 1.0
+    
+    breakdown.append(f"\n--- 系数调整 ---")
+    for name, val in coeffs:
+        discount_factor *= val
+        breakdown.append(f"{name}: x{val}")
+    
+    # 特殊免单逻辑
+    is_exempt_from_floor = False
+    if category == "养生中药" and margin >= 65:
+        discount_factor = 0
+        is_exempt_from_floor = True
+        breakdown.append("🚀 满足(养生中药 & 毛利率>=65%)：折扣置0，且免收保底费")
+
+    discount_factor = round(discount_factor, 2)
+    raw_final_fee = total_base_fee * discount_factor
+    
+    final_fee = math.ceil(int(raw_final_fee) / 10) * 10
+        
+    # 4. Minimum Floor Logic
+    category_floors = config.get("min_fee_floors", {}).get(category, 0)
+    min_floor = 0
+    floor_source_desc = "未知标准"
+
+    if is_exempt_from_floor:
+        min_floor = 0
+        floor_source_desc = "特殊免单(养生中药>=65%)"
+    elif isinstance(category_floors, dict):
+        min_floor = category_floors.get(procurement_type, 0)
+        floor_source_desc = f"{procurement_type}保底"
+
+    breakdown.append(f"\n--- 最终核算 ---")
+    breakdown.append(f"计算金额: {final_fee:.2f}元")
+    
+    is_floor_triggered = False
+    if final_fee < min_floor:
+        breakdown.append(f"触发最低兜底 ({floor_source_desc}): {min_floor}元")
+        final_fee = min_floor
+        is_floor_triggered = True
+    else:
+        breakdown.append(f"未触发兜底 (当前{floor_source_desc}线: {min_floor}元)")
+        
+    return {
+        "final_fee": final_fee,
+        "theoretical_fee": total_base_fee,
+        "discount_factor": discount_factor,
+        "coefficients": coeffs,
+        "breakdown_str": "\n".join(breakdown),
+        "is_floor_triggered": is_floor_triggered,
+        "min_floor": min_floor,
+        "floor_source_desc": floor_source_desc,
+        "store_details": store_counts,
+        "procurement_type": procurement_type
+    }
+
+def _get_blacklisted_sapids(
+    blacklist_df: pd.DataFrame | None,
+    selected_xp_category: str | None,
+    category: str | None,
+) -> set[str]:
+    """
+    根据前端选择的处方类别和新品大类，从黑名单中提取需要剔除的门店sapid集合。
+
+    匹配规则：模糊包含匹配。
+    黑名单中的类别值（如 '处方药'）只要被包含在前端值（如 '10-处方药'）中，即视为命中。
+
+    Args:
+        blacklist_df: 黑名单 DataFrame
+        selected_xp_category: 前端选择的处方类别 (如 '10-处方药')
+        category: 前端选择的新品大类 (如 '养生中药')
+
+    Returns:
+        需要剔除的门店sapid集合
+    """
+    if blacklist_df is None or blacklist_df.empty:
+        return set()
+
+    # 收集前端有效值
+    front_values: list[str] = []
+    if selected_xp_category and str(selected_xp_category).strip().lower() != "nan":
+        front_values.append(str(selected_xp_category).strip())
+    if category and str(category).strip().lower() != "nan":
+        front_values.append(str(category).strip())
+
+    if not front_values:
+        return set()
+
+    # 获取黑名单中所有不重复的类别
+    blacklist_categories = blacklist_df["处方类别or新品大类"].unique()
+
+    # 模糊匹配：黑名单值 是否被包含在 任一前端值中
+    matched_categories = [
+        bl_cat
+        for bl_cat in blacklist_categories
+        if any(bl_cat in fv for fv in front_values)
+    ]
+
+    if not matched_categories:
+        return set()
+
+    return set(
+        blacklist_df.loc[
+            blacklist_df["处方类别or新品大类"].isin(matched_categories), "门店sapid"
+        ]
+    )
+
+
+def calc_auto_counts(
+    store_master_df,
+    channel,
+    restricted_xp_code=None,
+    war_zone=None,
+    filters=None,
+    blacklist_df: pd.DataFrame | None = None,
+    selected_xp_category: str | None = None,
+    category: str | None = None,
+):
+    """
+    根据选择的通道、处方限制、战区和额外过滤器计算门店数量。
+    
+    Args:
+        store_master_df: 门店主数据 DataFrame。
+        channel: 
+            - 字符串: "超级旗舰店", "旗舰店及以上", "全量门店", "自定义" 等。
+            - 列表: 门店类型列表，例如 ["小店", "成长店"]。
+        restricted_xp_code: (可选) 用于检查门店限制的 xp_code 字符串。
+        war_zone: (可选) 战区名称。
+        filters: (可选) 额外过滤器的字典。
+        blacklist_df: (可选) 门店黑名单 DataFrame。
+        selected_xp_category: (可选) 前端选择的处方类别，用于黑名单匹配。
+        category: (可选) 前端选择的新品大类，用于黑名单匹配。
+    
+    Returns:
+        dict: {门店类型: 数量} 的字典。
+    """
+    
+    # --- 1. 解析需要筛选的门店类型 (valid_types) ---
+    valid_types = []
+    
+    if isinstance(channel, list):
+        valid_types = channel
+    elif isinstance(channel, str):
+        if channel == "自定义":
+            # 如果是自定义且有过滤器，默认全选所有类型，后续通过 filters['销售规模'] 进一步筛选
+            if filters and '销售规模' in filters and filters['销售规模']:
+                valid_types = filters['销售规模']
+            else:
+                valid_types = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+        elif channel == "超级旗舰店":
+            valid_types = ["超级旗舰店"]
+        elif channel == "旗舰店及以上":
+            valid_types = ["超级旗舰店", "旗舰店"]
+        elif channel == "大店及以上":
+            valid_types = ["超级旗舰店", "旗舰店", "大店"]
+        elif channel == "中店及以上":
+            valid_types = ["超级旗舰店", "旗舰店", "大店", "中店"]
+        elif channel == "小店及以上":
+            valid_types = ["超级旗舰店", "旗舰店", "大店", "中店", "小店"]
+        elif channel == "全量门店":
+            valid_types = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+        else:
+            parts = channel.replace("，", ",").split(",")
+            valid_types = [p.strip() for p in parts if p.strip()]
+    
+    if not valid_types:
+        return {}
+
+    # --- 2. 筛选逻辑开始 ---
+    current_df = store_master_df.copy()
+
+    # 通用过滤器逻辑
+    if filters:
+        for col, val in filters.items():
+            if not val or val == "全部" or col == "销售规模": # 销售规模已在 valid_types 处理
+                continue
+            
+            if col not in current_df.columns:
+                continue
+
+            # 特殊处理：客流商圈 (逗号分隔的字符串包含逻辑)
+            if col == "客流商圈":
+                if isinstance(val, list) and val:
+                    def has_intersection(cell_val):
+                        if pd.isna(cell_val): return False
+                        store_districts = set(str(cell_val).replace("，", ",").split(","))
+                        return not set(val).isdisjoint(store_districts)
+                    
+                    current_df = current_df[current_df[col].apply(has_intersection)]
+            
+            # 处理布尔/枚举值 (是/否)
+            elif isinstance(val, str) and val in ["是", "否"]:
+                current_df = current_df[current_df[col].astype(str).str.strip() == val]
+            
+            # 处理列表多选 (isin)
+            elif isinstance(val, list):
+                current_df = current_df[current_df[col].isin(val)]
+
+    # 战区过滤逻辑
+    if war_zone and war_zone != "全集团":
+        if "提报战区" in current_df.columns:
+            if isinstance(war_zone, list):
+                current_df = current_df[current_df["提报战区"].isin(war_zone)]
+            else:
+                current_df = current_df[current_df["提报战区"] == war_zone]
+
+    # --- 3. 受限门店过滤逻辑 ---
+    if restricted_xp_code is not None and "受限批文分类编码" in current_df.columns:
+        target_code = str(restricted_xp_code).strip()
+        if target_code and target_code.lower() != 'nan':
+            def is_store_excluded(cell_value):
+                if pd.isna(cell_value) or str(cell_value).strip() == "":
+                    return False
+                val_str = str(cell_value).replace("，", ",")
+                codes = [c.strip() for c in val_str.split(',')]
+                return target_code in codes
+
+            exclude_mask = current_df["受限批文分类编码"].apply(is_store_excluded)
+            current_df = current_df[~exclude_mask]
+
+    # --- 3.5 门店黑名单过滤逻辑 ---
+    blacklisted_sapids = _get_blacklisted_sapids(
+        blacklist_df, selected_xp_category, category
+    )
+    if blacklisted_sapids and "门店sapid" in current_df.columns:
+        current_df = current_df[
+            ~current_df["门店sapid"].astype(str).str.strip().isin(blacklisted_sapids)
+        ]
+
+    # --- 4. 统计指定类型的门店数量 ---
+    filtered_df = current_df[current_df["销售规模"].isin(valid_types)]
+    counts = filtered_df["销售规模"].value_counts().to_dict()
+    
+    final_counts = {}
+    for t in valid_types:
+        final_counts[t] = counts.get(t, 0)
+            
+    return final_counts
+
@@ -0,0 +1,187 @@
+"""
+运行性能基准测试，并把结果写为 JSON 以便跨版本对比。
+
+    uv run python -m benchmarks.run --sizes 10000 100000 1000000 --batch-rows 200
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+import pandas as pd
+
+from benchmarks import synthetic
+from src.core.batch_calculator import calculate_batch
+from src.core.calculator import calculate_fee
+from src.core.config_loader import load_config
+from src.core.file_utils import read_excel_safe
+from src.core.store_manager import calc_auto_counts, compact_store_master
+
+# Excel 单表上限约 104 万行，写大文件也非常慢；超过该规模只做内存中的基准
+DEFAULT_EXCEL_MAX_ROWS = 100_000
+
+
+def measure(func, repeat=3, number=1):
+    """
+    重复执行 func，返回每次调用的耗时统计 (秒)。number > 1 时取多次调用的平均值作为一次样本。
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.fmean(samples),
+    }
+
+
+def count_scenarios(store_master_df, blacklist_df):
+    """
+    calc_auto_counts 的基准场景：标准通道 × 过滤方式，以及自定义通道的各类标签筛选。
+    """
+    companies = sorted(store_master_df["省公司"].dropna().unique())[:3]
+    scenarios = {}
+    for channel in synthetic.CHANNELS:
+        scenarios[f"{channel}/plain"] = dict(channel=channel, war_zone="全集团")
+        scenarios[f"{channel}/war_zone"] = dict(channel=channel, war_zone="华东战区")
+        scenarios[f"{channel}/restricted"] = dict(channel=channel, war_zone="全集团", restricted_xp_code="13")
+        scenarios[f"{channel}/blacklist"] = dict(
+            channel=channel, war_zone="全集团", blacklist_df=blacklist_df,
+            selected_xp_category="10-处方药", category="中西成药",
+        )
+        scenarios[f"{channel}/full"] = dict(
+            channel=channel, war_zone="华东战区", restricted_xp_code="13", blacklist_df=blacklist_df,
+            selected_xp_category="10-处方药", category="中西成药",
+        )
+    custom_filters = {
+        "region": {"省公司": companies},
+        "district": {"客流商圈": ["社区店", "医院店"]},
+        "flags": {"是否医保店": "是", "是否统筹店": "否"},
+        "scale": {"销售规模": ["大店", "中店"]},
+        "all": {
+            "省公司": companies, "客流商圈": ["社区店", "医院店"], "店龄店型": ["2年+店"],
+            "是否医保店": "是", "销售规模": ["大店", "中店"],
+        },
+    }
+    for name, filters in custom_filters.items():
+        scenarios[f"自定义/{name}"] = dict(
+            channel="自定义", war_zone="全集团", filters=filters, restricted_xp_code="13",
+            blacklist_df=blacklist_df, selected_xp_category="10-处方药", category="中西成药",
+        )
+    return scenarios
+
+
+def run_benchmarks(sizes, repeat=3, batch_rows=200, excel_max_rows=DEFAULT_EXCEL_MAX_ROWS, seed=0, log=print):
+    results = []
+
+    def record(name, size, stats):
+        results.append({"name": name, "size": size, **stats})
+        log(f"{name:<45} size={size:<9} median={stats['median_s'] * 1000:10.2f} ms")
+
+    with tempfile.TemporaryDirectory(prefix="xp_fee_bench_") as root:
+        for size in sizes:
+            write_excel = size <= excel_max_rows
+            if write_excel:
+                paths = synthetic.write_dataset(root, size, n_batch_rows=batch_rows, seed=seed)
+            else:
+                paths = synthetic.write_dataset(root, 1000, n_batch_rows=batch_rows, seed=seed)
+
+            config = load_config(paths["config"])
+            record("load_config", size, measure(lambda: load_config(paths["config"]), repeat))
+
+            store_master_df = synthetic.make_store_master(size, seed)
+            blacklist_df = synthetic.make_blacklist(store_master_df, seed=seed)
+            if write_excel:
+                record("read_excel_safe/store_master", size, measure(
+                    lambda: read_excel_safe(paths["store_master"]), repeat=1))
+
+            record("compact_store_master", size, measure(lambda: compact_store_master(store_master_df), repeat=1))
+            _, memory = compact_store_master(store_master_df)
+            results[-1].update(before_mb=memory["before_mb"], after_mb=memory["after_mb"])
+
+            for name, kwargs in count_scenarios(store_master_df, blacklist_df).items():
+                kwargs = dict(kwargs)
+                channel = kwargs.pop("channel")
+                record(f"calc_auto_counts/{name}", size, measure(
+                    lambda: calc_auto_counts(store_master_df, channel, **kwargs), repeat))
+
+            row_data = {
+                "新品大类": "中西成药", "统采or地采": "统采", "同一供应商单次引进SKU数": 3,
+                "预估毛利率(%)": 40, "付款方式": "票到60天", "底价": 20,
+                "退货条件": "效期可退", "退货比例(%)": 80, "供应商类型": "生产企业",
+            }
+            store_counts = calc_auto_counts(store_master_df, "全量门店")
+            record("calculate_fee", size, measure(
+                lambda: calculate_fee(row_data, store_counts, config), repeat, number=1000))
+
+            batch_df = synthetic.make_batch_rows(batch_rows, seed)
+            xp_map = dict(zip(synthetic.XP_CATEGORIES, synthetic.XP_CATEGORIES.values()))
+            record(f"calculate_batch/{batch_rows}_rows", size, measure(
+                lambda: calculate_batch(batch_df, store_master_df, config, xp_map=xp_map, blacklist_df=blacklist_df),
+                repeat=1))
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=project_root, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="新品铺货费计算器性能基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000], help="门店主数据规模")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数")
+    parser.add_argument("--batch-rows", type=int, default=200, help="批量文件行数")
+    parser.add_argument("--excel-max-rows", type=int, default=DEFAULT_EXCEL_MAX_ROWS,
+                        help="超过该规模时不生成门店 Excel 文件，只做内存基准")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认 benchmarks/results/<时间>.json")
+    args = parser.parse_args(argv)
+
+    started_at = datetime.now()
+    results = run_benchmarks(args.sizes, args.repeat, args.batch_rows, args.excel_max_rows, args.seed)
+
+    report = {
+        "meta": {
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "batch_rows": args.batch_rows,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        project_root, "benchmarks", "results", f"{started_at:%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
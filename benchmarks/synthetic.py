@@ -0,0 +1,217 @@
+"""
+确定性的合成数据生成器：门店主数据、系数配置表、处方映射表、黑名单和批量导入文件。
+
+同一 seed 生成的数据完全一致，便于跨版本对比性能。分布参照生产数据的大致形态：
+销售规模以中小店为主，战区大小不均，客流商圈和受限批文分类编码为逗号分隔的多值字段
+(混用中英文逗号)。
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+STORE_TYPES = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+STORE_TYPE_WEIGHTS = [0.01, 0.04, 0.12, 0.25, 0.33, 0.25]
+
+WAR_ZONES = ["华东战区", "华南战区", "华北战区", "华中战区", "西南战区", "西北战区", "东北战区", "直营战区"]
+WAR_ZONE_WEIGHTS = [0.22, 0.18, 0.14, 0.13, 0.12, 0.08, 0.08, 0.05]
+
+BUSINESS_DISTRICTS = [
+    "社区店", "医院店", "商业区邻街店", "商业区店中店", "商务区店", "园区店", "菜市场店",
+    "大学与职业院校店", "幼小学校店", "旅游景区店", "机场店/火车站店", "其他交通枢纽店",
+]
+DISTRICT_WEIGHTS = [0.35, 0.15, 0.12, 0.06, 0.06, 0.05, 0.08, 0.03, 0.03, 0.02, 0.02, 0.03]
+
+RESTRICTED_CODES = ["13", "21", "33", "41", "52", "60"]
+
+CATEGORIES = ["中西成药", "养生中药", "医疗器械", "保健食品", "个人护理"]
+
+XP_CATEGORIES = {
+    "10-处方药": "13",
+    "20-甲类OTC": "21",
+    "30-乙类OTC": "33",
+    "40-保健食品": "41",
+    "50-医疗器械": "52",
+    "60-消毒用品": "60",
+}
+
+PAYMENT_METHODS = ["预付款", "票到30天", "票到45天", "票到60天", "票到90天", "票到90天以上", "实销月结"]
+RETURN_POLICIES = ["不可退", "破损可退", "效期可退", "效期可退+破损可退"]
+SUPPLIER_TYPES = ["生产企业", "全国总代", "区域代理", "经销商"]
+CHANNELS = ["全量门店", "小店及以上", "中店及以上", "大店及以上", "旗舰店及以上", "超级旗舰店"]
+
+
+def _multi_value(rng, n, choices, weights, empty_ratio, max_values=3):
+    """生成 n 个逗号分隔的多值字段，约 empty_ratio 为空，分隔符随机混用中英文逗号。"""
+    counts = rng.integers(1, max_values + 1, n)
+    empty = rng.random(n) < empty_ratio
+    separators = np.where(rng.random(n) < 0.2, "，", ",")
+    picks = rng.choice(len(choices), size=(n, max_values), p=weights)
+    values = []
+    for i in range(n):
+        if empty[i]:
+            values.append(None)
+        else:
+            unique = dict.fromkeys(choices[j] for j in picks[i, :counts[i]])
+            values.append(separators[i].join(unique))
+    return values
+
+
+def make_region_hierarchy(rng, n_companies=20):
+    """生成 省公司 → 省份 → 城市 的层级列表 [(省公司, 省份, 城市), ...]。"""
+    regions = []
+    province_id = 0
+    for c in range(n_companies):
+        company = f"省公司{c + 1:02d}"
+        for _ in range(int(rng.integers(1, 3))):
+            province_id += 1
+            province = f"省份{province_id:02d}"
+            for k in range(int(rng.integers(5, 16))):
+                regions.append((company, province, f"{province}城市{k + 1:02d}"))
+    return regions
+
+
+def make_store_master(n_stores, seed=0) -> pd.DataFrame:
+    """
+    生成 n_stores 家门店的门店主数据，列与 sync_db_to_exel.SQL_QUERY 一致。
+    """
+    rng = np.random.default_rng(seed)
+    regions = make_region_hierarchy(rng)
+    # 城市规模服从长尾分布
+    region_weights = rng.pareto(1.5, len(regions)) + 1
+    region_weights = region_weights / region_weights.sum()
+    region_idx = rng.choice(len(regions), size=n_stores, p=region_weights)
+    region_arr = np.array(regions, dtype=object)[region_idx]
+
+    zones = rng.choice(WAR_ZONES, size=n_stores, p=WAR_ZONE_WEIGHTS)
+
+    return pd.DataFrame({
+        "门店sapid": [f"{1000000 + i}" for i in range(n_stores)],
+        "DHR战区": zones,
+        "提报战区": zones,
+        "销售规模": rng.choice(STORE_TYPES, size=n_stores, p=STORE_TYPE_WEIGHTS),
+        "受限批文分类编码": _multi_value(rng, n_stores, RESTRICTED_CODES, None, empty_ratio=0.7),
+        "受限批文分类名称": None,
+        "门店表更新时间": "2026-09-30 00:00:00",
+        "省公司": region_arr[:, 0],
+        "城市": region_arr[:, 2],
+        "省份": region_arr[:, 1],
+        "店龄店型": rng.choice(["新店", "1年店", "2年店", "2年+店"], size=n_stores, p=[0.08, 0.1, 0.12, 0.7]),
+        "客流商圈": _multi_value(rng, n_stores, BUSINESS_DISTRICTS, DISTRICT_WEIGHTS, empty_ratio=0.03),
+        "行政区划等级": rng.choice(["直辖市", "省会城市", "地级市", "县城", "乡镇"], size=n_stores, p=[0.08, 0.2, 0.35, 0.27, 0.1]),
+        "公域O2O店型": rng.choice(["S级门店", "A类门店(重点门店)", "B类门店(次重点门店)", "C类门店(常规门店)", "非O2O门店"], size=n_stores),
+        "是否O2O门店": rng.choice(["是", "否"], size=n_stores, p=[0.7, 0.3]),
+        "是否医保店": rng.choice(["是", "否"], size=n_stores, p=[0.8, 0.2]),
+        "是否统筹店": rng.choice(["是", "否"], size=n_stores, p=[0.4, 0.6]),
+    })
+
+
+def make_config_sheets(seed=0) -> dict:
+    """生成 coefficients.xlsx 的全部 sheet，返回 {sheet_name: DataFrame}。"""
+    rng = np.random.default_rng(seed)
+    unit_fees = np.array([400, 260, 160, 100, 60, 30])
+
+    base_fees = pd.DataFrame([
+        {"新品大类": cat, **dict(zip(STORE_TYPES, (unit_fees * rng.uniform(0.6, 1.2)).round()))}
+        for cat in CATEGORIES
+    ])
+    sku_rows = []
+    for cat in CATEGORIES:
+        sku_rows += [
+            {"新品大类": cat, "min": 1, "max": 3, "discount": 1.0},
+            {"新品大类": cat, "min": 3, "max": 6, "discount": 0.95},
+            {"新品大类": cat, "min": 6, "max": 11, "discount": 0.9},
+            {"新品大类": cat, "min": 11, "max": 9999, "discount": 0.85},
+        ]
+    return {
+        "基础费用": base_fees,
+        "单次引入SKU数量折扣": pd.DataFrame(sku_rows),
+        "毛利率系数": pd.DataFrame({
+            "min": [0, 25, 35, 45, 55, 65], "max": [25, 35, 45, 55, 65, 100.01],
+            "coeff": [1.3, 1.15, 1.0, 0.9, 0.8, 0.7],
+        }),
+        "付款方式系数": pd.DataFrame({"付款方式": PAYMENT_METHODS, "系数": [0.8, 1.15, 1.1, 1.0, 0.95, 0.9, 0.9]}),
+        "底价系数": pd.DataFrame({"min": [0, 10, 30, 100], "max": [10, 30, 100, 1e9], "coeff": [1.1, 1.0, 0.95, 0.9]}),
+        "退货条件系数": pd.DataFrame({"退货条件": RETURN_POLICIES, "系数": [0.9, 1.0, 1.1, 1.15]}),
+        "退货比例系数": pd.DataFrame({
+            "退货条件": ["效期可退"] * 3 + ["效期可退+破损可退"] * 3,
+            "min": [0, 50, 100] * 2, "max": [50, 100, 100.01] * 2,
+            "系数": [1.0, 1.1, 1.2, 1.05, 1.15, 1.25],
+        }),
+        "供应商类型系数": pd.DataFrame({"供应商类型": SUPPLIER_TYPES, "系数": [0.95, 1.0, 1.05, 1.1]}),
+        "最低保底费": pd.DataFrame({
+            "新品大类": CATEGORIES,
+            "统采保底费": [3000, 2000, 2000, 1500, 1000],
+            "地采保底费": [1500, 1000, 1000, 800, 500],
+        }),
+        "处方类别": pd.DataFrame({"处方类别": list(XP_CATEGORIES)}),
+        "提报战区": pd.DataFrame({"提报战区": ["全集团"] + WAR_ZONES}),
+    }
+
+
+def make_xp_mapping() -> pd.DataFrame:
+    """生成 处方类别与批文分类表。"""
+    return pd.DataFrame({"处方类别": list(XP_CATEGORIES), "批文分类编码": list(XP_CATEGORIES.values())})
+
+
+def make_blacklist(store_master_df, ratio=0.01, seed=0) -> pd.DataFrame:
+    """从门店中抽取约 ratio 比例生成黑名单，类别为处方类别简称或新品大类。"""
+    rng = np.random.default_rng(seed)
+    n = max(1, int(len(store_master_df) * ratio))
+    sapids = rng.choice(store_master_df["门店sapid"].to_numpy(), size=n, replace=False)
+    labels = ["处方药", "甲类OTC", "保健食品"] + CATEGORIES
+    return pd.DataFrame({"门店sapid": sapids, "处方类别or新品大类": rng.choice(labels, size=n)})
+
+
+def make_batch_rows(n_rows, seed=0, custom_ratio=0.1) -> pd.DataFrame:
+    """生成 n_rows 行批量导入数据，约 custom_ratio 为手动输入门店数的自定义通道。"""
+    rng = np.random.default_rng(seed)
+    channels = np.where(rng.random(n_rows) < custom_ratio, "自定义", rng.choice(CHANNELS, size=n_rows))
+    df = pd.DataFrame({
+        "新品大类": rng.choice(CATEGORIES, size=n_rows),
+        "统采or地采": rng.choice(["统采", "地采", None], size=n_rows, p=[0.6, 0.3, 0.1]),
+        "供应商类型": rng.choice(SUPPLIER_TYPES, size=n_rows),
+        "付款方式": rng.choice(PAYMENT_METHODS, size=n_rows),
+        "退货条件": rng.choice(RETURN_POLICIES, size=n_rows),
+        "退货比例(%)": rng.choice([0, 30, 50, 80, 100, np.nan], size=n_rows),
+        "同一供应商单次引进SKU数": rng.integers(1, 20, size=n_rows),
+        "底价": rng.uniform(1, 200, size=n_rows).round(2),
+        "预估毛利率(%)": rng.uniform(10, 80, size=n_rows).round(1),
+        "处方类别": rng.choice(list(XP_CATEGORIES), size=n_rows),
+        "铺货通道": channels,
+        "提报战区": rng.choice(["全集团", None] + WAR_ZONES, size=n_rows),
+    })
+    for store_type in STORE_TYPES:
+        df[f"(自定义){store_type}数"] = np.where(channels == "自定义", rng.integers(0, 200, size=n_rows), np.nan)
+    return df
+
+
+def write_dataset(root, n_stores, n_batch_rows=200, seed=0) -> dict:
+    """
+    在 root 下按项目目录结构写出一整套数据文件，返回各文件路径。
+
+    目录结构: root/config/coefficients.xlsx, root/data/store_master.xlsx, ...
+    """
+    config_dir = os.path.join(root, "config")
+    data_dir = os.path.join(root, "data")
+    os.makedirs(config_dir, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+
+    paths = {
+        "config": os.path.join(config_dir, "coefficients.xlsx"),
+        "store_master": os.path.join(data_dir, "store_master.xlsx"),
+        "xp_mapping": os.path.join(data_dir, "处方类别与批文分类表.xlsx"),
+        "blacklist": os.path.join(data_dir, "新品费剔除门店黑名单.xlsx"),
+        "batch": os.path.join(data_dir, "batch_input.xlsx"),
+    }
+
+    with pd.ExcelWriter(paths["config"], engine="openpyxl") as writer:
+        for sheet_name, sheet_df in make_config_sheets(seed).items():
+            sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+    store_master_df = make_store_master(n_stores, seed)
+    store_master_df.to_excel(paths["store_master"], index=False, engine="openpyxl")
+    make_xp_mapping().to_excel(paths["xp_mapping"], index=False, engine="openpyxl")
+    make_blacklist(store_master_df, seed=seed).to_excel(paths["blacklist"], index=False, engine="openpyxl")
+    make_batch_rows(n_batch_rows, seed).to_excel(paths["batch"], index=False, engine="openpyxl")
+    return paths
@@ -1,6 +1,10 @@
+import time
+
+# 进程启动时刻，用于统计 "启动 → 首次计算" 耗时
+STARTED_AT = time.perf_counter()
+
 import sys
 import os
-from streamlit.web import cli as stcli
 
 def main():
     """
@@ -12,6 +16,9 @@ def main():
     
     注意: 不要使用 'streamlit run main.py' 来运行此脚本，
     因为它通过代码内部调用启动 streamlit，会导致递归调用。
+
+    启动 Streamlit 服务之前先预热 (src/core/warmup.py)：加载配置、门店索引和参考数据并完成一次报价，
+    第一个用户不必等待。设置 XP_FEE_WARMUP=0 可跳过预热。
     """
     # 1. 获取当前脚本（根目录）的绝对路径
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,13 +30,22 @@ def main():
         print(f"Error: 找不到应用文件: {app_path}")
         sys.exit(1)
 
-    # 3. 构造启动参数
+    print(f"🚀 正在启动新品铺货费计算器...\n入口文件: {app_path}\n")
+
+    # 3. 预热：在服务接受请求之前加载数据 (与 app.py 在同一进程，结果由 app.py 的缓存加载函数取用)
+    if os.environ.get("XP_FEE_WARMUP", "1") != "0":
+        if current_dir not in sys.path:
+            sys.path.append(current_dir)
+        from src.core.warmup import warm_up
+        warm_up(current_dir, started_at=STARTED_AT)
+
+    # 4. 构造启动参数
     # 这里的 sys.argv 模拟了命令行参数：streamlit run src/ui/app.py [user_args...]
     # sys.argv[1:] 保留了用户调用 python main.py 时传入的额外参数
     sys.argv = ["streamlit", "run", app_path] + sys.argv[1:]
-    
-    # 4. 启动 Streamlit
-    print(f"🚀 正在启动新品铺货费计算器...\n入口文件: {app_path}\n")
+
+    # 5. 启动 Streamlit (导入较慢，放在预热之后)
+    from streamlit.web import cli as stcli
     sys.exit(stcli.main())
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+"""
+门店级费用分摊导出。
+
+把每个 SKU 的折后费用 (折扣、取整和保底之后的 final_fee) 按所含门店的 销售规模 单店基础费占比分摊到每个门店，
+输出 SKU × 门店 明细 (一个批量文件可达数千万行)。结果按块流式写入分片文件，不拼接完整的 DataFrame：
+
+    <out_dir>/part-00000.csv (或 .parquet)   每片最多 rows_per_file 行
+    <out_dir>/manifest.json                  分片列表、行数，以及每个 SKU 行的费用与分摊合计 (对账用)
+
+分摊以 分 为单位按最大余数法取整，每个 SKU 的分摊合计与 final_fee 完全相等。
+分片由线程池并行写出，同时在途的分片数有上限，内存占用与批量大小无关。
+
+命令行:
+    python -m src.core.attribution 批量文件.xlsx --out output/attribution --format csv
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.core.batch_validation import RESTRICTED_CODE_COLUMN, error_rows, validate_batch
+from src.core.calculator import calculate_fee
+from src.core.store_index import FilterMaskState, StoreIndex
+from src.core.store_manager import resolve_channel_types
+from src.core.timing import timed
+
+DEFAULT_ROWS_PER_FILE = 1_000_000
+DEFAULT_WORKERS = 4
+
+ATTRIBUTION_COLUMNS = ["行号", "门店sapid", "销售规模", "单店基础费", "分摊费用"]
+FORMATS = ("csv", "parquet")
+
+
+def included_store_mask(store_index: StoreIndex, channel, restricted_xp_code=None, war_zone=None, filters=None,
+                        blacklist_df: pd.DataFrame | None = None, selected_xp_category=None, category=None,
+                        state=None) -> np.ndarray:
+    """
+    报价所含门店的布尔掩码，参数同 calc_auto_counts；
+    store_index.count_types(掩码, 通道类型) 与 calc_auto_counts 的结果一致。
+    """
+    valid_types = resolve_channel_types(channel, filters)
+    positions = [store_index._scale_position[t] for t in valid_types if t in store_index._scale_position]
+    selected = np.isin(store_index.scale_codes, positions)
+    if not positions:
+        return selected
+    state = state or FilterMaskState(store_index)
+    state.update(store_index.dimension_values(
+        filters, war_zone, restricted_xp_code, blacklist_df, selected_xp_category, category
+    ))
+    if state.mask is not None:
+        selected &= state.mask
+    return selected
+
+
+def allocate_fee(final_fee, weights) -> np.ndarray:
+    """
+    按权重把 final_fee 分摊到各门店，返回以 分 为单位的整数数组，合计等于 final_fee。
+    权重全为 0 (如基础费用未配置) 时平均分摊；没有门店时返回空数组。
+    """
+    weights = np.asarray(weights, dtype=float)
+    if len(weights) == 0:
+        return np.array([], dtype=np.int64)
+    if weights.sum() <= 0:
+        weights = np.ones(len(weights))
+    target = int(round(float(final_fee) * 100))
+    exact = target * (weights / weights.sum())
+    cents = np.floor(exact).astype(np.int64)
+    remainder = target - int(cents.sum())
+    if remainder > 0:
+        # 最大余数法：余下的分给小数部分最大的门店 (相同时按门店顺序)
+        order = np.argsort(-(exact - cents), kind="stable")[:remainder]
+        cents[order] += 1
+    return cents
+
+
+class _ShardWriter:
+    """按块累积明细并提交给线程池写出分片；在途分片数超过上限时等待最早的分片完成。"""
+
+    def __init__(self, out_dir, fmt, rows_per_file, workers):
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}，可选 {FORMATS}")
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise ValueError("输出 Parquet 需要安装 pyarrow") from e
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.rows_per_file = rows_per_file
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = workers * 2
+        self.pending = []
+        self.buffer = []
+        self.buffered_rows = 0
+        self.files = []
+
+    def add(self, frame: pd.DataFrame):
+        start = 0
+        while start < len(frame):
+            take = min(len(frame) - start, self.rows_per_file - self.buffered_rows)
+            self.buffer.append(frame.iloc[start:start + take])
+            self.buffered_rows += take
+            start += take
+            if self.buffered_rows >= self.rows_per_file:
+                self.flush()
+
+    def _write(self, chunk: pd.DataFrame, path):
+        if self.fmt == "csv":
+            chunk.to_csv(path, index=False, encoding="utf-8-sig")
+        else:
+            chunk.to_parquet(path, index=False)
+        return len(chunk)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        chunk = pd.concat(self.buffer, ignore_index=True)
+        self.buffer, self.buffered_rows = [], 0
+        name = f"part-{len(self.files):05d}.{self.fmt}"
+        self.files.append({"file": name, "rows": len(chunk)})
+        while len(self.pending) >= self.max_pending:
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(self._write, chunk, os.path.join(self.out_dir, name)))
+
+    def close(self):
+        self.flush()
+        try:
+            for future in self.pending:
+                future.result()
+        finally:
+            self.executor.shutdown(wait=True)
+        return self.files
+
+
+@timed()
+def export_batch_attribution(
+    df,
+    store_index: StoreIndex,
+    config,
+    out_dir,
+    xp_map=None,
+    blacklist_df: pd.DataFrame | None = None,
+    id_columns=None,
+    fmt="csv",
+    rows_per_file=DEFAULT_ROWS_PER_FILE,
+    workers=DEFAULT_WORKERS,
+    progress_callback=None,
+) -> dict:
+    """
+    批量文件的门店级费用分摊，流式写出到 out_dir。
+
+    每行先经 validate_batch 规整 (与 calculate_batch 相同)，按该行的通道、战区、受限编码和黑名单确定所含门店，
+    用这些门店的数量计算 calculate_fee，再把 final_fee 按 单店基础费 分摊到各门店。
+    自定义通道 (手动输入门店数) 和校验出错的行没有门店明细，只记录在 manifest 中。
+
+    Args:
+        id_columns: (可选) 从批量文件复制到每条明细的列 (如商品编码)，默认复制 新品大类 和 铺货通道。
+        fmt: "csv" 或 "parquet" (需要 pyarrow)。
+        rows_per_file: 每个分片的最大行数。
+        workers: 并行写出分片的线程数。
+        progress_callback: (可选) 每行完成后以 (已完成行数, 总行数) 调用。
+
+    Returns:
+        dict: manifest (同时写入 <out_dir>/manifest.json)。
+    """
+    clean, report = validate_batch(df, config, xp_map)
+    invalid_rows = error_rows(report)
+    id_columns = [col for col in (id_columns or ["新品大类", "铺货通道"]) if col in clean.columns]
+
+    # 门店级的 sapid / 销售规模 文本只取一次，每行按门店编号取值
+    if "门店sapid" in store_index.columns:
+        sapid_codes, sapid_values = store_index._encoding("stripped", "门店sapid")
+        sapids = np.append(np.asarray(sapid_values, dtype=object), "")[sapid_codes]
+    else:
+        print("Warning: 门店表缺少 门店sapid 列，分摊明细中门店sapid为空")
+        sapids = np.full(store_index.n_stores, "", dtype=object)
+    scale_names = np.append(np.asarray(store_index.scale_values, dtype=object), "")[store_index.scale_codes]
+
+    writer = _ShardWriter(out_dir, fmt, rows_per_file, workers)
+    # 相邻行的战区 / 受限编码 / 黑名单大多相同，复用同一个增量掩码状态
+    state = FilterMaskState(store_index)
+    rows = []
+    try:
+        for i, row_dict in enumerate(clean.to_dict("records")):
+            row_no = i + 2
+            entry = {"行号": row_no, "final_fee": None, "allocated": 0.0, "stores": 0, "note": ""}
+            channel = row_dict.get("铺货通道")
+            if row_no in invalid_rows:
+                entry["note"] = f"Error: {invalid_rows[row_no]}"
+            elif channel == "自定义":
+                entry["note"] = "自定义通道没有门店明细"
+            else:
+                # 单行出错 (如配置缺少系数) 只记入该行的 note，不中断整体导出 (与 calculate_batch 一致)
+                frame = None
+                try:
+                    valid_types = resolve_channel_types(channel)
+                    selected = included_store_mask(
+                        store_index, channel,
+                        restricted_xp_code=row_dict.get(RESTRICTED_CODE_COLUMN),
+                        war_zone=row_dict.get("提报战区"),
+                        blacklist_df=blacklist_df,
+                        selected_xp_category=row_dict.get("处方类别"),
+                        category=row_dict.get("新品大类"),
+                        state=state,
+                    )
+                    ids = np.flatnonzero(selected)
+                    row_dict.pop(RESTRICTED_CODE_COLUMN, None)
+                    result = calculate_fee(row_dict, store_index.count_types(selected, valid_types), config)
+                    base_fees = config.get("base_fees", {}).get(row_dict.get("新品大类"), {})
+                    unit_by_scale = np.array([base_fees.get(s, 0) for s in store_index.scale_values] + [0], dtype=float)
+                    unit_fees = unit_by_scale[store_index.scale_codes[ids]]
+                    cents = allocate_fee(result["final_fee"], unit_fees)
+                    if len(ids):
+                        frame = pd.DataFrame({
+                            "行号": row_no,
+                            **{col: row_dict.get(col) for col in id_columns},
+                            "门店sapid": sapids[ids],
+                            "销售规模": scale_names[ids],
+                            "单店基础费": unit_fees,
+                            "分摊费用": cents / 100,
+                        })
+                except Exception as e:
+                    entry["note"] = f"Error: {e}"
+                else:
+                    entry.update(final_fee=result["final_fee"], allocated=int(cents.sum()) / 100, stores=len(ids))
+                    if len(ids) == 0 and result["final_fee"] > 0:
+                        entry["note"] = "没有门店，费用未分摊"
+                    if frame is not None:
+                        writer.add(frame)
+            rows.append(entry)
+            if progress_callback:
+                progress_callback(i + 1, len(clean))
+    finally:
+        files = writer.close()
+
+    manifest = {
+        "format": fmt,
+        "columns": ["行号"] + id_columns + ATTRIBUTION_COLUMNS[1:],
+        "total_rows": sum(f["rows"] for f in files),
+        "files": files,
+        "skus": rows,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, default=str)
+    return manifest
+
+
+def main(argv=None):
+    from src.core.config_loader import load_config
+    from src.core.price_list import DEFAULT_PATHS
+    from src.core.file_utils import read_excel_safe
+    from src.core.store_manager import load_store_blacklist, load_store_master_compact, load_xp_mapping
+
+    parser = argparse.ArgumentParser(description="批量文件的门店级费用分摊导出")
+    parser.add_argument("batch_file", help="批量文件 (Excel)")
+    parser.add_argument("--out", required=True, help="输出目录")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--rows-per-file", type=int, default=DEFAULT_ROWS_PER_FILE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--id-columns", nargs="*", default=None, help="复制到每条明细的批量文件列")
+    args = parser.parse_args(argv)
+
+    paths = DEFAULT_PATHS
+    xp_map = load_xp_mapping(paths["xp_mapping"]) if os.path.exists(paths["xp_mapping"]) else {}
+    blacklist_df = load_store_blacklist(paths["blacklist"]) if os.path.exists(paths["blacklist"]) else None
+    manifest = export_batch_attribution(
+        read_excel_safe(args.batch_file),
+        StoreIndex(load_store_master_compact(paths["store_master"])),
+        load_config(paths["config"]),
+        args.out,
+        xp_map=xp_map,
+        blacklist_df=blacklist_df,
+        id_columns=args.id_columns,
+        fmt=args.format,
+        rows_per_file=args.rows_per_file,
+        workers=args.workers,
+    )
+    print(f"✅ {manifest['total_rows']:,} 行 → {len(manifest['files'])} 个分片: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from src.core.batch_counts import BatchCountEngine
+from src.core.batch_validation import RESTRICTED_CODE_COLUMN, error_rows, validate_batch
+from src.core.calculator import calculate_fee, calculate_fee_matrix
+from src.core.store_index import StoreIndex
+from src.core.store_manager import extract_manual_counts
+from src.core.timing import timed
+
+
+def _calculate_batch_row(row_dict, config, counts):
+    """
+    计算批量文件中的一行，结果列直接写回 row_dict。
+
+    Args:
+        counts: 该行预先算好的门店数量 {"counts", "raw_counts", "zone_counts"} (BatchCountEngine)，自定义通道为 None。
+    """
+    # 统采or地采 / 提报战区 / 退货比例(%) / 处方类别 已在 validate_batch 中按列规整
+    row_dict.pop(RESTRICTED_CODE_COLUMN, None)
+
+    excluded_count = 0
+    if counts is None:
+        store_counts = extract_manual_counts(row_dict)
+    else:
+        store_counts = counts["counts"]
+        excluded_count = sum(counts["raw_counts"].values()) - sum(store_counts.values())
+
+    result = calculate_fee(row_dict, store_counts, config)
+
+    row_dict['理论总新品铺货费 (元)'] = int(result['theoretical_fee'])
+    row_dict['折扣'] = result['discount_factor']
+    row_dict['折后总新品铺货费 (元)'] = int(result['final_fee'])
+    active_stores = {k: v for k, v in result['store_details'].items() if v > 0}
+    row_dict['[详情]门店分布'] = str(active_stores)
+    if counts is not None and "zone_counts" in counts:
+        zone_counts = counts["zone_counts"]
+        zone_counts_df = pd.DataFrame(list(zone_counts.values()), index=pd.Index(list(zone_counts), name="提报战区"))
+        zone_fee_df = calculate_fee_matrix(row_dict, zone_counts_df, config)
+        for zone_name, zone_fee in zone_fee_df["折后总新品铺货费 (元)"].items():
+            row_dict[f"[战区]{zone_name}"] = int(zone_fee)
+    if excluded_count > 0:
+        row_dict['备注'] = f"已剔除门店数(受限)：{excluded_count}"
+    else:
+        row_dict['备注'] = ""
+
+
+@timed()
+def calculate_batch(
+    df,
+    store_master_df,
+    config,
+    xp_map=None,
+    blacklist_df: pd.DataFrame | None = None,
+    by_war_zone=False,
+    progress_callback=None,
+    store_index: StoreIndex | None = None,
+    validated=None,
+) -> pd.DataFrame:
+    """
+    批量计算：先按列校验与规整 (validate_batch)，再用 BatchCountEngine 一次算出所有标准通道行的门店数量，
+    最后逐行计算费用，返回追加了结果列的 DataFrame。
+    校验错误的行不参与计算；单行出错不会中断整体计算，错误信息写入该行的 '备注'。
+
+    Args:
+        df: 上传的批量文件 DataFrame。
+        store_master_df: 门店主数据 DataFrame。
+        config: loaded configuration dict
+        xp_map: 处方类别 → 受限批文分类编码 映射。
+        blacklist_df: (可选) 门店黑名单 DataFrame。
+        by_war_zone: 是否为每行追加各战区的折后费用列。
+        progress_callback: (可选) 每行完成后以 (已完成行数, 总行数) 调用。
+        store_index: (可选) 门店主数据索引 (StoreIndex)，未提供时按 store_master_df 构建。
+        validated: (可选) 调用方已对 df 执行 validate_batch 的结果 (规整后的数据, 问题报告)，提供时不再重复校验。
+    """
+    df, report = validated if validated is not None else validate_batch(df, config, xp_map)
+    invalid_rows = error_rows(report)
+
+    # 标准通道行的门店数量一次性按矩阵计算
+    standard = (df["铺货通道"] != "自定义").to_numpy()
+    engine = BatchCountEngine(store_index if store_index is not None else StoreIndex(store_master_df))
+    standard_counts = engine.counts(
+        df.loc[standard, "铺货通道"].tolist(),
+        restricted_codes=df.loc[standard, RESTRICTED_CODE_COLUMN].tolist(),
+        war_zones=df.loc[standard, "提报战区"].tolist(),
+        blacklist_df=blacklist_df,
+        xp_categories=df.loc[standard, "处方类别"].tolist(),
+        categories=df.loc[standard, "新品大类"].tolist(),
+        by_war_zone=config.get("war_zones", ["全集团"]) if by_war_zone else None,
+    )
+    row_counts = [None] * len(df)
+    for j, i in enumerate(np.flatnonzero(standard)):
+        row_counts[i] = {key: values[j] for key, values in standard_counts.items()}
+
+    results = []
+    total = len(df)
+    for i, row_dict in enumerate(df.to_dict("records")):
+        if i + 2 in invalid_rows:
+            row_dict.pop(RESTRICTED_CODE_COLUMN, None)
+            row_dict['备注'] = f"Error: {invalid_rows[i + 2]}"
+        else:
+            try:
+                _calculate_batch_row(row_dict, config, row_counts[i])
+            except Exception as e:
+                row_dict['备注'] = f"Error: {e}"
+        results.append(row_dict)
+        if progress_callback:
+            progress_callback(i + 1, total)
+
+    return pd.DataFrame(results)
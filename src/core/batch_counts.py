@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from src.core.store_index import StoreIndex
+from src.core.store_manager import _get_blacklisted_sapids, resolve_channel_types
+
+# 剔除矩阵单次 bincount 的最大非零元素数
+MAX_CHUNK_NNZ = 4_000_000
+
+
+class BatchCountEngine:
+    """
+    整份批量文件的门店数量矩阵计算。
+
+    批量文件各行只在 剔除哪些门店 (受限批文编码、黑名单) 、按哪个战区统计、统计哪些销售规模 上不同。
+    先把各行归并为不重复的剔除键 (受限编码, 黑名单 sapid 集合)，每个键的被剔除门店构成一个稀疏的
+    键 × 门店 矩阵 (COO：键编号 + 门店编号)；再与 门店 × (提报战区, 销售规模) 的 one-hot 矩阵相乘
+    (即对 (键, 战区, 销售规模) 做一次 bincount)，得到每个键在各战区、各销售规模被剔除的门店数。
+    各行的门店数 = 战区 × 销售规模 全量数量 − 该行剔除键的剔除数量，不再逐行调用 calc_auto_counts。
+
+    结果与 calc_auto_counts 一致 (含 全集团、战区为空的门店只计入全集团 等规则)。
+    """
+
+    def __init__(self, store_index: StoreIndex):
+        self.index = store_index
+        n_scales = len(store_index.scale_values)
+        # 没有 提报战区 列时 calc_auto_counts 不按战区过滤
+        self._has_zone = "提报战区" in store_index.columns
+        if self._has_zone:
+            zone_codes, zones = store_index._encoding("raw", "提报战区")
+            self.zones = list(zones)
+        else:
+            zone_codes, self.zones = np.full(store_index.n_stores, -1), []
+        # 战区槽位 0 留给 提报战区 为空的门店 (只计入全集团)
+        self._zone_slot = {zone: i + 1 for i, zone in enumerate(self.zones)}
+        self._n_slots = len(self.zones) + 1
+        self._n_scales = n_scales
+
+        scale_codes = np.asarray(store_index.scale_codes)
+        valid = scale_codes >= 0
+        # 每个门店在 (战区槽位, 销售规模) 展平后的列号；销售规模为空的门店不计入任何统计
+        self._cell = np.where(valid, (np.asarray(zone_codes).astype(np.int64) + 1) * n_scales + scale_codes, -1)
+        self._base = np.bincount(self._cell[valid], minlength=self._n_slots * n_scales).reshape(self._n_slots, n_scales)
+
+    def _exclusion_keys(self, restricted_codes, xp_categories, categories, blacklist_df):
+        """各行的剔除键编号，以及每个键的 (受限编码, 黑名单 sapid 集合)。"""
+        blacklist_cache = {}
+        keys = {}
+        row_keys = []
+        for code, xp_category, category in zip(restricted_codes, xp_categories, categories):
+            pair = (xp_category, category)
+            if pair not in blacklist_cache:
+                blacklist_cache[pair] = frozenset(_get_blacklisted_sapids(blacklist_df, xp_category, category))
+            key = (code, blacklist_cache[pair])
+            row_keys.append(keys.setdefault(key, len(keys)))
+        return np.asarray(row_keys, dtype=np.int64), list(keys)
+
+    def _excluded_counts(self, keys):
+        """
+        剔除矩阵 (键 × 门店，COO) 与 one-hot 矩阵的乘积：键 × 战区槽位 × 销售规模 的剔除数量。
+        非零元素超过 MAX_CHUNK_NNZ 时分块累加，避免受限门店较多时一次拼接过大的数组。
+        """
+        n_cells = self._n_slots * self._n_scales
+        product = np.zeros(len(keys) * n_cells, dtype=np.int64)
+        key_ids, store_ids, nnz = [], [], 0
+
+        def flush():
+            if not key_ids:
+                return
+            cells = self._cell[np.concatenate(store_ids)]
+            rows = np.concatenate(key_ids)
+            counted = cells >= 0
+            product[:] += np.bincount(rows[counted] * n_cells + cells[counted], minlength=len(product))
+            key_ids.clear()
+            store_ids.clear()
+
+        for key_id, (code, sapids) in enumerate(keys):
+            masks = [m for m in (self.index.dimension_mask("受限", code), self.index.dimension_mask("黑名单", sapids))
+                     if m is not None]
+            if not masks:
+                continue
+            excluded = np.flatnonzero(~np.logical_and.reduce(masks))
+            key_ids.append(np.full(len(excluded), key_id, dtype=np.int64))
+            store_ids.append(excluded)
+            nnz += len(excluded)
+            if nnz > MAX_CHUNK_NNZ:
+                flush()
+                nnz = 0
+        flush()
+        return product.reshape(len(keys), self._n_slots, self._n_scales)
+
+    def _zone_rows(self, net, war_zone):
+        """按战区取 销售规模 数量向量；全集团 (或为空) 为所有槽位之和，未知战区为 0。"""
+        if not war_zone or war_zone == "全集团":
+            return net.sum(axis=0)
+        zones = war_zone if isinstance(war_zone, list) else [war_zone]
+        slots = [self._zone_slot[zone] for zone in set(zones) if zone in self._zone_slot]
+        return net[slots].sum(axis=0) if slots else np.zeros(self._n_scales, dtype=np.int64)
+
+    def _as_counts(self, vector, valid_types):
+        position = self.index._scale_position
+        return {t: int(vector[position[t]]) if t in position else 0 for t in valid_types}
+
+    def counts(self, channels, restricted_codes=None, war_zones=None, blacklist_df: pd.DataFrame | None = None,
+               xp_categories=None, categories=None, by_war_zone=None):
+        """
+        计算每一行的门店数量。
+
+        Args:
+            channels: 各行的铺货通道 (含义同 calc_auto_counts 的 channel)。
+            restricted_codes / war_zones / xp_categories / categories: 各行的受限批文编码、战区、
+                处方类别和新品大类，缺省时视为不过滤。
+            blacklist_df: (可选) 门店黑名单 DataFrame。
+            by_war_zone: (可选) 战区列表；提供时额外返回各行在这些战区下的数量 (不按该行战区过滤)。
+
+        Returns:
+            dict: {"counts": 各行计数, "raw_counts": 不做受限/黑名单剔除的计数,
+                   "zone_counts": 各行 {战区: 计数} (仅 by_war_zone 时)}，计数与 calc_auto_counts 返回格式相同。
+        """
+        n_rows = len(channels)
+        restricted_codes = list(restricted_codes) if restricted_codes is not None else [None] * n_rows
+        war_zones = list(war_zones) if war_zones is not None else [None] * n_rows
+        xp_categories = list(xp_categories) if xp_categories is not None else [None] * n_rows
+        categories = list(categories) if categories is not None else [None] * n_rows
+
+        row_keys, keys = self._exclusion_keys(restricted_codes, xp_categories, categories, blacklist_df)
+        excluded = self._excluded_counts(keys)
+
+        result = {"counts": [], "raw_counts": []}
+        if by_war_zone is not None:
+            result["zone_counts"] = []
+        for i, channel in enumerate(channels):
+            valid_types = resolve_channel_types(channel)
+            net = self._base - excluded[row_keys[i]]
+            if not valid_types:
+                result["counts"].append({})
+                result["raw_counts"].append({})
+                if by_war_zone is not None:
+                    result["zone_counts"].append({zone: {} for zone in by_war_zone})
+                continue
+            war_zone = war_zones[i] if self._has_zone else None
+            result["counts"].append(self._as_counts(self._zone_rows(net, war_zone), valid_types))
+            result["raw_counts"].append(self._as_counts(self._zone_rows(self._base, war_zone), valid_types))
+            if by_war_zone is not None:
+                result["zone_counts"].append(
+                    {zone: self._as_counts(self._zone_rows(net, zone), valid_types) for zone in by_war_zone}
+                )
+        return result
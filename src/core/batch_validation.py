@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+from src.core.channel_rules import DEFAULT_CHANNEL_OPTIONS, default_channels
+from src.core.store_manager import ALL_STORE_TYPES
+from src.core.timing import timed
+
+# 缺少任一列时整份文件无法计算 (铺货通道缺失时按推荐规则填充，不是必需列)
+REQUIRED_COLUMNS = ["新品大类"]
+
+NUMERIC_COLUMNS = ["同一供应商单次引进SKU数", "预估毛利率(%)", "底价", "退货比例(%)"]
+
+ERROR = "错误"
+WARNING = "警告"
+
+# 受限批文分类编码列 (由 处方类别 映射得到)，仅在计算时使用，不写入结果
+RESTRICTED_CODE_COLUMN = "_受限批文分类编码"
+
+ISSUE_COLUMNS = ["行号", "列", "取值", "级别", "问题"]
+
+
+def _blank(series: pd.Series) -> pd.Series:
+    """空值或仅含空白的单元格。"""
+    return series.isna() | (series.astype(str).str.strip() == "")
+
+
+def _stripped_or_none(series: pd.Series) -> pd.Series:
+    """去除首尾空白，空单元格统一为 None。"""
+    text = series.astype(str).str.strip().astype(object)
+    return text.where(series.notna() & (text != ""), None)
+
+
+def _issues(df, mask, column, level, message) -> pd.DataFrame:
+    """把 mask 命中的行转换为问题记录；行号为 Excel 中的行号 (表头占第 1 行)。"""
+    if not mask.any():
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    hit = mask.to_numpy()
+    return pd.DataFrame({
+        "行号": np.flatnonzero(hit) + 2,
+        "列": column,
+        "取值": df[column][hit].astype(object).tolist(),
+        "级别": level,
+        "问题": message,
+    })
+
+
+def _channel_known(channel: pd.Series) -> pd.Series:
+    """标准通道、'自定义' 或逗号分隔的销售规模列表。"""
+    def known(value):
+        if value is None:
+            return False
+        if value in DEFAULT_CHANNEL_OPTIONS or value == "自定义":
+            return True
+        parts = [p.strip() for p in value.replace("，", ",").split(",") if p.strip()]
+        return bool(parts) and all(p in ALL_STORE_TYPES for p in parts)
+    # 通道种类很少，对去重后的取值判断一次再映射回各行
+    return channel.map({v: known(v) for v in channel.unique()}).astype(bool)
+
+
+@timed()
+def validate_batch(df: pd.DataFrame, config, xp_map=None):
+    """
+    批量文件的前置校验与规整，在任何门店统计和费用计算之前按列完成。
+
+    - 检查必需列，数值列按列转换，无法转换的单元格记为错误；
+    - 规整 统采or地采 (空 → 统采)、提报战区 (空 → 全集团)、退货比例(%) (空 → 100)、处方类别 (去空白)；
+    - 处方类别 通过 xp_map 一次映射为受限批文分类编码 (RESTRICTED_CODE_COLUMN 列)；
+    - 铺货通道 缺失或为空时按 channel_rules.default_channels 填入推荐的标准通道；
+    - 新品大类 / 付款方式 / 退货条件 / 供应商类型 / 提报战区 / 铺货通道 不在配置中时记为警告
+      (计算照常进行，未知条款按默认系数计算)。
+
+    Returns:
+        (pd.DataFrame, pd.DataFrame): 规整后的数据 (索引与输入一致) 和问题报告 (列见 ISSUE_COLUMNS)。
+    """
+    clean = df.copy()
+    reports = []
+
+    missing = [col for col in REQUIRED_COLUMNS if col not in clean.columns]
+    if missing:
+        reports.append(pd.DataFrame({
+            "行号": [None] * len(missing), "列": missing, "取值": [None] * len(missing),
+            "级别": ERROR, "问题": "缺少必需列",
+        }))
+    has_channel = "铺货通道" in clean.columns
+    for col in REQUIRED_COLUMNS + ["铺货通道", "统采or地采", "提报战区", "处方类别", "付款方式", "退货条件", "供应商类型"]:
+        if col not in clean.columns:
+            clean[col] = None
+
+    # --- 数值列 ---
+    for col in NUMERIC_COLUMNS:
+        if col not in clean.columns:
+            continue
+        numeric = pd.to_numeric(clean[col], errors="coerce")
+        invalid = numeric.isna() & ~_blank(clean[col])
+        reports.append(_issues(clean, invalid, col, ERROR, "不是有效数字"))
+        clean[col] = numeric.where(~invalid, clean[col]) if invalid.any() else numeric
+    if "退货比例(%)" in clean.columns:
+        clean["退货比例(%)"] = clean["退货比例(%)"].where(~_blank(clean["退货比例(%)"]), 100.0)
+    else:
+        clean["退货比例(%)"] = 100.0
+
+    # --- 文本列 ---
+    for col in ["新品大类", "铺货通道", "处方类别", "付款方式", "退货条件", "供应商类型"]:
+        clean[col] = _stripped_or_none(clean[col])
+    procurement = _stripped_or_none(clean["统采or地采"])
+    clean["统采or地采"] = procurement.where(procurement.notna(), "统采")
+    war_zone = _stripped_or_none(clean["提报战区"])
+    clean["提报战区"] = war_zone.where(war_zone.notna(), "全集团")
+
+    # 铺货通道 缺失或为空时，按 退货条件 / 退货比例 / 付款方式 / 新品大类 推荐默认标准通道
+    no_channel = clean["铺货通道"].isna()
+    if no_channel.any():
+        recommended = default_channels(
+            clean.loc[no_channel, "退货条件"], clean.loc[no_channel, "退货比例(%)"],
+            clean.loc[no_channel, "付款方式"], clean.loc[no_channel, "新品大类"],
+        )
+        if has_channel:
+            reports.append(_issues(clean, no_channel, "铺货通道", WARNING, "为空，已按推荐规则填入默认通道"))
+        clean["铺货通道"] = clean["铺货通道"].astype(object)
+        clean.loc[no_channel, "铺货通道"] = recommended
+
+    codes = clean["处方类别"].map(xp_map) if xp_map else pd.Series(None, index=clean.index, dtype=object)
+    clean[RESTRICTED_CODE_COLUMN] = codes.astype(object).where(codes.notna(), None)
+
+    # --- 配置词表 ---
+    if not missing:
+        reports.append(_issues(clean, clean["新品大类"].isna(), "新品大类", WARNING, "为空，费用为 0"))
+    vocab_checks = [
+        ("新品大类", config.get("base_fees", {}), "不在基础费用配置中"),
+        ("付款方式", config.get("payment_coeffs", {}), "不在配置中，按默认系数计算"),
+        ("退货条件", set(config.get("return_policy_coeffs", {})) | set(config.get("return_ratio_rules", {})),
+         "不在配置中，按默认系数计算"),
+        ("供应商类型", config.get("supplier_type_coeffs", {}), "不在配置中，按默认系数计算"),
+        ("提报战区", config.get("war_zones", ["全集团"]), "不在配置中，门店数将为 0"),
+    ]
+    for col, vocab, message in vocab_checks:
+        if not vocab:
+            continue
+        unknown = clean[col].notna() & ~clean[col].isin(list(vocab))
+        reports.append(_issues(clean, unknown, col, WARNING, message))
+    unknown = ~clean["统采or地采"].isin(["统采", "地采"])
+    reports.append(_issues(clean, unknown, "统采or地采", WARNING, "应为 统采 或 地采"))
+    channel = clean["铺货通道"]
+    reports.append(_issues(clean, channel.notna() & ~_channel_known(channel), "铺货通道", WARNING,
+                           "无法识别，门店数将为 0"))
+    if xp_map:
+        unmapped = clean["处方类别"].notna() & clean[RESTRICTED_CODE_COLUMN].isna()
+        reports.append(_issues(clean, unmapped, "处方类别", WARNING, "不在映射表中，不剔除受限门店"))
+
+    reports = [r for r in reports if not r.empty]
+    report = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=ISSUE_COLUMNS)
+    return clean, report
+
+
+def error_rows(report: pd.DataFrame) -> dict:
+    """{Excel 行号: 错误信息}，仅包含 '错误' 级别的行级问题。"""
+    errors = report[(report["级别"] == ERROR) & report["行号"].notna()]
+    messages = {}
+    for row_no, col, message in zip(errors["行号"], errors["列"], errors["问题"]):
+        messages.setdefault(int(row_no), []).append(f"{col}: {message}")
+    return {row_no: "；".join(items) for row_no, items in messages.items()}
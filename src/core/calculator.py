@@ -1,5 +1,10 @@
 import math
 
+import numpy as np
+import pandas as pd
+
+from src.core.timing import timed
+
 def get_coefficient(value, ranges, default=1.0):
     """
     Helper to find a coefficient from a range list.
@@ -14,6 +19,7 @@ def get_coefficient(value, ranges, default=1.0):
             
     return default
 
+@timed()
 def calculate_fee(row_data, store_counts, config):
     """
     Calculates the total fee and returns a breakdown.
@@ -145,4 +151,53 @@ def calculate_fee(row_data, store_counts, config):
         "floor_source_desc": floor_source_desc,
         "store_details": store_counts,
         "procurement_type": procurement_type
-    }
\ No newline at end of file
+    }
+
+
+def ceil_to_ten(raw_fees):
+    """
+    向量化的取整规则：先截断为整数，再向上取整到 10 元 (与 calculate_fee 一致)。
+    """
+    truncated = np.trunc(np.asarray(raw_fees, dtype=float)).astype(np.int64)
+    return -(-truncated // 10) * 10
+
+
+@timed()
+def calculate_fee_matrix(row_data, counts_df, config):
+    """
+    对一组门店数量 (每行一组，如每个战区一行) 向量化计算费用。
+
+    各项系数只与商品条款有关，与门店数量无关，因此只通过 calculate_fee
+    计算一次折扣系数和保底线，再对所有行统一做 基础费用 × 折扣 → 取整 → 兜底。
+
+    Args:
+        row_data: 同 calculate_fee。
+        counts_df: DataFrame，columns 为门店类型，每行一组门店数量。
+        config: loaded configuration dict
+
+    Returns:
+        DataFrame: 在 counts_df 基础上追加 门店数合计、理论费用、折扣、折后费用、是否触发兜底 列。
+    """
+    terms = calculate_fee(row_data, {}, config)
+    base_fees_config = config.get("base_fees", {}).get(row_data.get("新品大类"), {})
+
+    counts = counts_df.to_numpy(dtype=np.int64)
+    theoretical = np.zeros(len(counts_df))
+    # 按列顺序累加，与 calculate_fee 中逐类型累加的顺序保持一致
+    for j, store_type in enumerate(counts_df.columns):
+        unit_fee = base_fees_config.get(store_type, 0)
+        theoretical = theoretical + np.where(counts[:, j] > 0, counts[:, j] * unit_fee, 0)
+
+    discount_factor = terms["discount_factor"]
+    min_floor = terms["min_floor"]
+    final_fees = ceil_to_ten(theoretical * discount_factor)
+    is_floor_triggered = final_fees < min_floor
+    final_fees = np.where(is_floor_triggered, min_floor, final_fees)
+
+    result = counts_df.copy()
+    result["门店数合计"] = counts.sum(axis=1)
+    result["理论总新品铺货费 (元)"] = theoretical
+    result["折扣"] = discount_factor
+    result["折后总新品铺货费 (元)"] = final_fees
+    result["是否触发兜底"] = is_floor_triggered
+    return result
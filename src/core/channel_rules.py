@@ -0,0 +1,145 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# 付款方式中的 "票到N天"
+PAYMENT_DAYS_PATTERN = re.compile(r'票到(\d+)天')
+
+DEFAULT_CHANNEL_OPTIONS = ["全量门店", "小店及以上", "中店及以上", "大店及以上", "旗舰店及以上", "超级旗舰店"]
+
+
+def _on_uniques(values, func) -> np.ndarray:
+    """
+    对去重后的取值计算 func 再映射回各行。批量文件中这些列的取值种类很少，
+    字符串匹配只需在少量唯一值上进行。
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(np.asarray(values, dtype=object))
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.asarray(func(pd.Series(np.asarray(uniques, dtype=object), dtype=object)))[codes]
+
+
+def _text(values) -> pd.Series:
+    """转换为去除首尾空白的文本列，空值保持为缺失。"""
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    return series.astype(object).where(series.notna()).astype("string").str.strip()
+
+
+def payment_term_gte_60(payment_method) -> pd.Series:
+    """
+    按列判断付款方式的账期是否>=60天 (实销月结视为>=60天)。
+
+    Returns:
+        pd.Series[bool]
+    """
+    payment = _text(payment_method)
+    days = payment.str.extract(PAYMENT_DAYS_PATTERN, expand=False).astype("Float64")
+    matched = days.notna()
+    long_term = (
+        payment.str.contains('实销月结', regex=False)
+        | (matched & (days >= 60))
+        # 特殊处理"票到90天以上"
+        | (~matched & (payment.str.contains('票到90天以上', regex=False)
+                       | payment.str.contains('账期天数>=60天', regex=False)))
+    )
+    return long_term.fillna(False).astype(bool)
+
+
+def classify_return_policies(return_policy, return_ratio) -> pd.Series:
+    """
+    按列对退货条件进行分类。
+
+    Returns:
+        pd.Series: 'full_return_100' | 'partial_return' | 'other'
+    """
+    policy = _text(return_policy)
+    ratio = pd.to_numeric(pd.Series(np.asarray(return_ratio, dtype=object), index=policy.index), errors="coerce")
+    is_expiry_return = policy.str.contains('效期可退', regex=False).fillna(False).astype(bool)
+    return pd.Series(
+        np.select(
+            [is_expiry_return & (ratio == 100), is_expiry_return],
+            ['full_return_100', 'partial_return'],
+            default='other',
+        ),
+        index=policy.index,
+    )
+
+
+def medicine_category(category) -> pd.Series:
+    """按列判断是否为中西成药。"""
+    return _text(category).str.contains('中西成药', regex=False).fillna(False).astype(bool)
+
+
+def default_channels(return_policy, return_ratio, payment_method, category) -> pd.Series:
+    """
+    根据业务规则按列计算默认标准通道 (批量文件缺少铺货通道时使用)。
+
+    Args:
+        return_policy: 退货条件列
+        return_ratio: 退货比例列（纯数字 0-100）
+        payment_method: 付款方式列
+        category: 新品大类列
+
+    Returns:
+        pd.Series: 标准通道选项 (DEFAULT_CHANNEL_OPTIONS 之一)，索引与 return_policy 一致。
+    """
+    index = return_policy.index if isinstance(return_policy, pd.Series) else None
+    is_expiry_return = _on_uniques(
+        return_policy, lambda u: _text(u).str.contains('效期可退', regex=False).fillna(False).astype(bool)
+    )
+    if not isinstance(return_ratio, pd.Series):
+        return_ratio = pd.Series(np.asarray(return_ratio, dtype=object))
+    ratio = pd.to_numeric(return_ratio, errors="coerce").to_numpy()
+    full = is_expiry_return & (ratio == 100)
+    partial = is_expiry_return & ~full
+    is_long_term = _on_uniques(payment_method, payment_term_gte_60)
+    is_medicine = _on_uniques(category, medicine_category)
+    is_prepaid = _on_uniques(
+        payment_method, lambda u: u.astype("string").str.contains('预付款', regex=False).fillna(False).astype(bool)
+    )
+
+    conditions = [
+        # 规则1: 效期可退100%
+        full & is_long_term,
+        full,
+        # 规则2: 效期可退[0%,100)
+        partial & is_prepaid,
+        partial & is_long_term & is_medicine,
+        partial & is_long_term,
+        partial & is_medicine,
+        partial,
+        # 规则3: 其他退货条件
+        is_long_term & is_medicine,
+    ]
+    choices = ["全量门店", "小店及以上", "大店及以上", "全量门店", "小店及以上", "小店及以上", "大店及以上", "小店及以上"]
+    channels = np.select(conditions, choices, default="大店及以上")
+    return pd.Series(channels, index=index) if index is not None else pd.Series(channels)
+
+
+def is_payment_term_gte_60(payment_method: str) -> bool:
+    """判断付款方式的账期是否>=60天 (单值版本)。"""
+    return bool(payment_term_gte_60([payment_method]).iloc[0])
+
+
+def classify_return_policy(return_policy: str, return_ratio: float) -> str:
+    """对退货条件进行分类 (单值版本)。"""
+    return classify_return_policies([return_policy], [return_ratio]).iloc[0]
+
+
+def is_medicine_category(category: str) -> bool:
+    """判断是否为中西成药 (单值版本)。"""
+    return bool(medicine_category([category]).iloc[0])
+
+
+def get_default_channel(return_policy: str,
+                        return_ratio: float,
+                        payment_method: str,
+                        category: str) -> str:
+    """
+    根据业务规则获取默认标准通道 (单值版本，规则见 default_channels)。
+
+    Returns:
+        标准通道选项: 全量门店 | 小店及以上 | 中店及以上 | 大店及以上 | 旗舰店及以上 | 超级旗舰店
+    """
+    return default_channels([return_policy], [return_ratio], [payment_method], [category]).iloc[0]
@@ -1,45 +1,120 @@
 import pandas as pd
 import os
+from concurrent.futures import ThreadPoolExecutor
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
 from src.core.file_utils import read_excel_safe
+from src.core.timing import timed
 
-def load_config(config_path="config/coefficients.xlsx"):
+# 并行解析工作表的线程数 (可用 XP_FEE_CONFIG_WORKERS 覆盖)
+DEFAULT_SHEET_WORKERS = 4
+
+
+def _convert_cell(cell):
+    """与 pandas 的 openpyxl 读取器相同的单元格转换：空为 ""，错误为 NaN，整数值的数字转为 int。"""
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return float("nan")
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def _parse_sheet(worksheet) -> pd.DataFrame:
+    """读取一个工作表并按 read_excel 的规则 (首行表头、去掉末尾空行空列、类型推断) 转为 DataFrame。"""
+    worksheet.reset_dimensions()
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(worksheet.rows):
+        converted = [_convert_cell(cell) for cell in row]
+        while converted and converted[-1] == "":
+            converted.pop()
+        if converted:
+            last_row_with_data = row_number
+        data.append(converted)
+    data = data[:last_row_with_data + 1]
+    if not data:
+        return pd.DataFrame()
+    width = max(len(row) for row in data)
+    data = [row + [""] * (width - len(row)) for row in data]
+    try:
+        return TextParser(data, header=0, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def read_workbook_sheets(path, workers=None) -> dict:
+    """
+    读取工作簿的全部工作表 {表名: DataFrame}，结果与 read_excel(sheet_name=None) 一致。
+
+    工作簿以只读模式只打开一次，各工作表由线程池并行解析 (只读工作表各自从 zip 中流式读取，互不共享解析状态)。
+    """
+    from openpyxl import load_workbook
+
+    workers = workers or int(os.environ.get("XP_FEE_CONFIG_WORKERS", DEFAULT_SHEET_WORKERS))
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheets = workbook.worksheets
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(worksheets)))) as executor:
+            frames = list(executor.map(_parse_sheet, worksheets))
+        return {ws.title: frame for ws, frame in zip(worksheets, frames)}
+    finally:
+        workbook.close()
+
+
+def _group_records(df, key, columns) -> dict:
+    """
+    {key 取值: 该组各行 columns 的 list of dict}，与 groupby(key) 逐组 to_dict('records') 的结果相同
+    (组按 key 排序、组内保持原顺序、key 为空的行丢弃)，但只做一次 to_dict。
+    """
+    keys = df[key]
+    valid = keys.notna().to_numpy()
+    records = df.loc[valid, columns].to_dict('records')
+    grouped = {}
+    for value, record in zip(keys[valid].tolist(), records):
+        grouped.setdefault(value, []).append(record)
+    return {value: grouped[value] for value in sorted(grouped)}
+
+
+@timed()
+def load_config(config_path="config/coefficients.xlsx", workers=None):
     """
     Loads the configuration from an Excel file.
     Parses multiple sheets into the expected dictionary structure.
+
+    工作表由 read_workbook_sheets 并行解析；openpyxl 无法打开时 (如 .xls、加密文件) 退回 read_excel_safe。
     """
     if not os.path.exists(config_path):
         raise FileNotFoundError(f"Config file not found at {config_path}")
     
     # Read all sheets
     try:
-        # read_excel_safe returns a dict of DataFrames when sheet_name=None is passed
-        xls_dict = read_excel_safe(config_path, sheet_name=None)
-    except Exception as e:
-        raise ValueError(f"Failed to read config file: {e}")
+        xls_dict = read_workbook_sheets(config_path, workers)
+    except Exception:
+        try:
+            # read_excel_safe returns a dict of DataFrames when sheet_name=None is passed
+            xls_dict = read_excel_safe(config_path, sheet_name=None)
+        except Exception as e:
+            raise ValueError(f"Failed to read config file: {e}")
 
     config = {}
 
     # 1. Base Fees
     if '基础费用' in xls_dict:
         df = xls_dict['基础费用']
-        base_fees = {}
-        for _, row in df.iterrows():
-            category = row['新品大类']
-            # Convert row to dict and remove '新品大类'
-            fees = row.to_dict()
-            del fees['新品大类']
-            base_fees[category] = fees
-        config['base_fees'] = base_fees
+        # 每个新品大类一行 {销售规模: 单店基础费}；同一大类出现多行时以最后一行为准
+        fees = df.drop(columns='新品大类').to_dict('records')
+        config['base_fees'] = dict(zip(df['新品大类'].tolist(), fees))
 
     # 2. SKU Discounts
     if '单次引入SKU数量折扣' in xls_dict:
         df_sku = xls_dict['单次引入SKU数量折扣']
-        sku_discounts_map = {}
-        # 按大类分组构建字典
-        for category_name, group in df_sku.groupby('新品大类'):
-            # 将该大类的所有规则转为 list of dict，并只保留 min, max, discount
-            sku_discounts_map[category_name] = group[['min', 'max', 'discount']].to_dict('records')
-        config['sku_discounts'] = sku_discounts_map
+        # 按大类分组构建字典：该大类的所有规则转为 list of dict，并只保留 min, max, discount
+        config['sku_discounts'] = _group_records(df_sku, '新品大类', ['min', 'max', 'discount'])
 
     # 3. Gross Margin Coeffs
     if '毛利率系数' in xls_dict:
@@ -69,8 +144,9 @@ def load_config(config_path="config/coefficients.xlsx"):
         # 确保必要的列存在
         required_cols = ['退货条件', 'min', 'max', '系数']
         if all(col in df_ratio.columns for col in required_cols):
-             for policy_name, group in df_ratio.groupby('退货条件'):
-                 config['return_ratio_rules'][policy_name] = group[['min', 'max', '系数']].rename(columns={'系数': 'coeff'}).to_dict('records')
+             config['return_ratio_rules'] = _group_records(
+                 df_ratio.rename(columns={'系数': 'coeff'}), '退货条件', ['min', 'max', 'coeff']
+             )
     
     # 8. Supplier Type Coeffs
     if '供应商类型系数' in xls_dict:
@@ -82,13 +158,14 @@ def load_config(config_path="config/coefficients.xlsx"):
         df = xls_dict['最低保底费']
         min_fee_floors = {}
         if not df.empty:
-            for _, row in df.iterrows():
-                cat = row.get('新品大类')
-                if cat:
-                    min_fee_floors[cat] = {
-                        '统采': row.get('统采保底费', 0),
-                        '地采': row.get('地采保底费', 0)
-                    }
+            def column(name):
+                return df[name].tolist() if name in df.columns else [None if name == '新品大类' else 0] * len(df)
+
+            min_fee_floors = {
+                cat: {'统采': central, '地采': local}
+                for cat, central, local in zip(column('新品大类'), column('统采保底费'), column('地采保底费'))
+                if cat
+            }
         config['min_fee_floors'] = min_fee_floors
 
     # 10. Prescription Categories
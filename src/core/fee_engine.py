@@ -0,0 +1,107 @@
+import numpy as np
+
+from src.core.calculator import ceil_to_ten
+
+# 折扣系数连乘顺序，与 calculate_fee 中 coeffs 的追加顺序一致。
+# 浮点乘法不满足结合律，向量化计算必须按同一顺序连乘才能得到逐位相同的结果。
+COEFF_ORDER = ["sku", "margin", "payment", "cost", "return", "supplier"]
+
+
+def compile_ranges(ranges):
+    """
+    将区间规则列表 [{min, max, discount|coeff}, ...] 编译为三个 numpy 数组。
+    系数取值规则与 get_coefficient 一致：有 'discount' 键取 discount，否则取 coeff (默认 1.0)。
+    """
+    ranges = list(ranges or [])
+    mins = np.array([item['min'] for item in ranges], dtype=float)
+    maxs = np.array([item['max'] for item in ranges], dtype=float)
+    coeffs = np.array(
+        [item.get('discount') if 'discount' in item else item.get('coeff', 1.0) for item in ranges],
+        dtype=float,
+    )
+    return {"min": mins, "max": maxs, "coeff": coeffs}
+
+
+def compile_config(config):
+    """
+    将 load_config 返回的配置编译为便于向量化查表的结构。
+
+    区间类系数 (SKU / 毛利率 / 底价 / 退货比例) 编译为 numpy 数组，
+    字典类系数 (付款方式 / 退货条件 / 供应商类型) 保持原字典。
+    """
+    return {
+        "sku": {cat: compile_ranges(rules) for cat, rules in config.get("sku_discounts", {}).items()},
+        "margin": compile_ranges(config.get("gross_margin_coeffs", [])),
+        "cost": compile_ranges(config.get("cost_price_coeffs", [])),
+        "return_ratio": {
+            policy: compile_ranges(rules)
+            for policy, rules in config.get("return_ratio_rules", {}).items()
+        },
+        "payment": config.get("payment_coeffs", {}),
+        "return_policy": config.get("return_policy_coeffs", {}),
+        "supplier": config.get("supplier_type_coeffs", {}),
+        "base_fees": config.get("base_fees", {}),
+        "min_fee_floors": config.get("min_fee_floors", {}),
+    }
+
+
+def lookup_range_coeffs(values, table, default=1.0):
+    """
+    向量化的 get_coefficient：对 values 中每个值查找第一个满足 min <= value < max 的区间系数。
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.full(values.shape, default, dtype=float)
+    # 倒序覆盖，保证列表中靠前的区间优先命中 (与 get_coefficient 的遍历顺序一致)
+    for lo, hi, coeff in zip(table["min"][::-1], table["max"][::-1], table["coeff"][::-1]):
+        result = np.where((lo <= values) & (values < hi), coeff, result)
+    return result
+
+
+def return_coeff_matrix(policies, ratios, compiled):
+    """
+    计算 退货条件 × 退货比例 的系数矩阵 (shape: len(policies) × len(ratios))。
+    存在比例规则的退货条件按比例分档，否则按名称直接查表。
+    """
+    ratios = np.asarray(ratios, dtype=float)
+    rows = []
+    for policy in policies:
+        if policy in compiled["return_ratio"]:
+            rows.append(lookup_range_coeffs(ratios, compiled["return_ratio"][policy]))
+        else:
+            rows.append(np.full(ratios.shape, compiled["return_policy"].get(policy, 1.0), dtype=float))
+    return np.array(rows, dtype=float).reshape(len(policies), len(ratios))
+
+
+def round_discount(discount_factors):
+    """
+    向量化的 round(x, 2)。
+
+    np.round 与 Python round 在 .xx5 附近的取舍可能不同；折扣系数的不同取值很少，
+    因此对去重后的值逐个调用 Python round，再映射回原数组，结果与 calculate_fee 完全一致。
+    """
+    discount_factors = np.asarray(discount_factors, dtype=float)
+    uniques, inverse = np.unique(discount_factors, return_inverse=True)
+    rounded = np.array([round(float(x), 2) for x in uniques], dtype=float)
+    return rounded[inverse].reshape(discount_factors.shape)
+
+
+def get_min_floor(category, procurement_type, compiled):
+    """
+    获取 (大类, 统采/地采) 对应的最低保底费，规则同 calculate_fee (不含免单豁免)。
+    """
+    category_floors = compiled["min_fee_floors"].get(category, 0)
+    if isinstance(category_floors, dict):
+        return category_floors.get(procurement_type, 0)
+    return 0
+
+
+def finalize_fees(theoretical_fee, discount_factor, min_floor):
+    """
+    向量化的 折后金额 → 取整到 10 元 → 保底兜底。
+
+    Returns:
+        (final_fee, is_floor_triggered) 两个数组
+    """
+    final_fee = ceil_to_ten(np.asarray(theoretical_fee, dtype=float) * discount_factor)
+    is_floor_triggered = final_fee < min_floor
+    return np.where(is_floor_triggered, min_floor, final_fee), is_floor_triggered
@@ -3,6 +3,9 @@ import io
 import tempfile
 import os
 
+from src.core.timing import timed
+
+@timed()
 def read_excel_safe(file_path_or_buffer, dtype_spec=None, **kwargs) -> pd.DataFrame:
     """
     安全的Excel读取方法 (移植自 xp-analysis-map)。
@@ -48,3 +51,15 @@ def read_excel_safe(file_path_or_buffer, dtype_spec=None, **kwargs) -> pd.DataFr
                 os.unlink(temp_file_path)
         except Exception as cleanup_e:
             print(f"Warning: 清理临时文件 '{temp_file_path}' 失败: {cleanup_e}")
+
+
+def get_file_version(path) -> str:
+    """
+    获取文件版本标识 (修改时间 + 文件大小)，用于缓存失效判断。
+    文件不存在时返回 'missing'。
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
@@ -0,0 +1,330 @@
+"""
+标准通道价目表。
+
+大多数报价使用标准通道且不加自定义筛选：对每个 (新品大类, 处方类别, 标准通道, 提报战区, 统采or地采)，
+门店数量和理论费用 (基础费用合计) 在下次同步门店数据之前都是固定的。这里把整张表预先算好写入
+带主键索引的 SQLite 文件，报价时只需查表，再乘以商品条款的折扣系数，不再做任何门店筛选：
+
+    price_list   每个组合一行：各销售规模门店数、剔除门店数、理论费用、保底费
+    meta         数据版本 (门店主数据 / 系数配置 / 处方映射 / 黑名单 的文件版本) 和生成时间
+
+数据版本变化 (重新同步门店表或修改 coefficients.xlsx 等) 后由 ensure_price_list 自动重建。
+
+命令行:
+    python -m src.core.price_list build
+    python -m src.core.price_list quote --category 中西成药 --xp-category 10-处方药 --channel 全量门店
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+from src.core.batch_counts import BatchCountEngine
+from src.core.calculator import calculate_fee, ceil_to_ten
+from src.core.channel_rules import DEFAULT_CHANNEL_OPTIONS
+from src.core.config_loader import load_config
+from src.core.file_utils import get_file_version
+from src.core.store_index import StoreIndex
+from src.core.store_manager import (
+    ALL_STORE_TYPES, load_store_blacklist, load_store_master_compact, load_xp_mapping, resolve_channel_types,
+)
+from src.core.timing import timed
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_PATHS = {
+    "config": os.path.join(PROJECT_ROOT, "config", "coefficients.xlsx"),
+    "store_master": os.path.join(PROJECT_ROOT, "data", "store_master.xlsx"),
+    "xp_mapping": os.path.join(PROJECT_ROOT, "data", "处方类别与批文分类表.xlsx"),
+    "blacklist": os.path.join(PROJECT_ROOT, "data", "新品费剔除门店黑名单.xlsx"),
+    "price_list": os.path.join(PROJECT_ROOT, "data", "standard_price_list.sqlite"),
+}
+
+KEY_COLUMNS = ["新品大类", "处方类别", "铺货通道", "提报战区", "统采or地采"]
+PROCUREMENT_TYPES = ["统采", "地采"]
+PRICE_TABLE = "price_list"
+# 不选处方类别 (没有映射表) 时的键值；SQLite 中 NULL 不能参与等值查找
+NO_XP_CATEGORY = ""
+
+
+def price_list_version(paths=None) -> str:
+    """价目表的数据版本：所有输入文件版本的组合，任一文件变化即需要重建。"""
+    paths = {**DEFAULT_PATHS, **(paths or {})}
+    return "|".join(get_file_version(paths[name]) for name in ("store_master", "config", "xp_mapping", "blacklist"))
+
+
+def _theoretical_fee(counts, base_fees_config):
+    """与 calculate_fee 相同的顺序累加基础费用，保证逐位一致。"""
+    total = 0
+    for store_type, count in counts.items():
+        if count > 0:
+            total += base_fees_config.get(store_type, 0) * count
+    return total
+
+
+@timed()
+def build_price_list(store_index: StoreIndex, config, xp_map=None, blacklist_df: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    计算 新品大类 × 处方类别 × 标准通道 × 提报战区 × 统采or地采 的完整价目表。
+
+    门店数量只与 (新品大类, 处方类别, 标准通道) 决定的剔除规则和战区有关，
+    每个 (新品大类, 处方类别, 标准通道) 作为 BatchCountEngine 的一行，按战区展开一次算出。
+
+    Returns:
+        pd.DataFrame: KEY_COLUMNS + 各销售规模门店数 + 剔除门店数、理论费用、保底费。
+    """
+    categories = list(config.get("base_fees", {}))
+    xp_categories = sorted(xp_map) if xp_map else [NO_XP_CATEGORY]
+    war_zones = config.get("war_zones", ["全集团"])
+
+    combos = [(category, xp_category, channel)
+              for category in categories for xp_category in xp_categories for channel in DEFAULT_CHANNEL_OPTIONS]
+    engine = BatchCountEngine(store_index)
+    result = engine.counts(
+        [channel for _, _, channel in combos],
+        restricted_codes=[xp_map.get(xp) if xp_map else None for _, xp, _ in combos],
+        blacklist_df=blacklist_df,
+        xp_categories=[xp or None for _, xp, _ in combos],
+        categories=[category for category, _, _ in combos],
+        by_war_zone=war_zones,
+    )
+    raw_by_zone = {
+        channel: engine.counts([channel] * len(war_zones), war_zones=war_zones)["counts"]
+        for channel in DEFAULT_CHANNEL_OPTIONS
+    }
+
+    records = []
+    for (category, xp_category, channel), zone_counts in zip(combos, result["zone_counts"]):
+        base_fees_config = config.get("base_fees", {}).get(category, {})
+        floors = config.get("min_fee_floors", {}).get(category, 0)
+        for zone, raw_counts in zip(war_zones, raw_by_zone[channel]):
+            counts = zone_counts[zone]
+            theoretical = _theoretical_fee(counts, base_fees_config)
+            for procurement_type in PROCUREMENT_TYPES:
+                records.append({
+                    "新品大类": category,
+                    "处方类别": xp_category,
+                    "铺货通道": channel,
+                    "提报战区": zone,
+                    "统采or地采": procurement_type,
+                    **{t: counts.get(t, 0) for t in ALL_STORE_TYPES},
+                    "剔除门店数": sum(raw_counts.values()) - sum(counts.values()),
+                    "理论费用": theoretical,
+                    "保底费": floors.get(procurement_type, 0) if isinstance(floors, dict) else 0,
+                })
+    columns = KEY_COLUMNS + ALL_STORE_TYPES + ["剔除门店数", "理论费用", "保底费"]
+    return pd.DataFrame(records, columns=columns)
+
+
+def write_price_list(price_df: pd.DataFrame, path, version):
+    """写入临时文件后整体替换，读取方不会看到写了一半的价目表。"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        key = ", ".join(f'"{col}"' for col in KEY_COLUMNS)
+        columns = ", ".join(
+            f'"{col}" TEXT NOT NULL' if col in KEY_COLUMNS else f'"{col}" {"REAL" if col in ("理论费用", "保底费") else "INTEGER"}'
+            for col in price_df.columns
+        )
+        conn.execute(f"CREATE TABLE {PRICE_TABLE} ({columns}, PRIMARY KEY ({key}))")
+        conn.executemany(
+            f"INSERT INTO {PRICE_TABLE} VALUES ({', '.join('?' * len(price_df.columns))})",
+            price_df.astype(object).itertuples(index=False, name=None),
+        )
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("version", version),
+            ("built_at", datetime.now().isoformat(timespec="seconds")),
+            ("n_rows", str(len(price_df))),
+        ])
+        conn.commit()
+    os.replace(tmp_path, path)
+
+
+class StandardPriceList:
+    """只读打开的价目表，按主键查找。"""
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            self.meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        self.version = self.meta.get("version")
+
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _rows(self, where, params):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            return conn.execute(f"SELECT * FROM {PRICE_TABLE} WHERE {where}", params).fetchall()
+
+    @staticmethod
+    def _entry(row, channel_types):
+        return {
+            "counts": {t: row[t] for t in channel_types},
+            "excluded_count": row["剔除门店数"],
+            "theoretical_fee": row["理论费用"],
+            "min_floor": row["保底费"],
+        }
+
+    def lookup(self, category, xp_category, channel, war_zone="全集团", procurement_type="统采"):
+        """
+        查找一个标准报价组合。
+
+        Returns:
+            dict | None: {counts (与 calc_auto_counts 格式相同), excluded_count, theoretical_fee, min_floor}；
+            组合不在表中 (非标准通道、未知战区等) 时返回 None，由调用方按原方式实时计算。
+        """
+        if channel not in DEFAULT_CHANNEL_OPTIONS:
+            return None
+        rows = self._rows(
+            " AND ".join(f'"{col}" = ?' for col in KEY_COLUMNS),
+            (category, xp_category or NO_XP_CATEGORY, channel, war_zone or "全集团", procurement_type),
+        )
+        return self._entry(rows[0], resolve_channel_types(channel)) if rows else None
+
+    def zone_counts(self, category, xp_category, channel, war_zones, procurement_type="统采"):
+        """
+        某个组合在 war_zones 各战区下的门店数，格式同 calc_war_zone_counts (可直接用于 calculate_fee_matrix)；
+        有战区不在表中时返回 None。
+        """
+        if channel not in DEFAULT_CHANNEL_OPTIONS:
+            return None
+        rows = self._rows(
+            '"新品大类" = ? AND "处方类别" = ? AND "铺货通道" = ? AND "统采or地采" = ?',
+            (category, xp_category or NO_XP_CATEGORY, channel, procurement_type),
+        )
+        by_zone = {row["提报战区"]: row for row in rows}
+        zones = list(war_zones)
+        if any(zone not in by_zone for zone in zones):
+            return None
+        types = resolve_channel_types(channel)
+        return pd.DataFrame([[by_zone[zone][t] for t in types] for zone in zones],
+                            index=pd.Index(zones, name="提报战区"), columns=types)
+
+
+def quote_standard(row_data, config, price_list: StandardPriceList):
+    """
+    按价目表报价：查出理论费用后乘以折扣系数、取整并兜底，结果与 calculate_fee 一致。
+    row_data 需包含 新品大类、处方类别、channel、提报战区 (可选，默认全集团) 及各项条款。
+
+    Returns:
+        dict | None: calculate_fee 结果中的金额字段和 store_details；组合不在表中时返回 None。
+    """
+    entry = price_list.lookup(
+        row_data.get("新品大类"), row_data.get("处方类别"), row_data.get("channel"),
+        row_data.get("提报战区"), row_data.get("统采or地采", "统采"),
+    )
+    if entry is None:
+        return None
+    # 折扣系数与保底线只与条款有关 (含养生中药免单规则)，与门店数无关
+    terms = calculate_fee(row_data, {}, config)
+    final_fee = int(ceil_to_ten(entry["theoretical_fee"] * terms["discount_factor"]))
+    is_floor_triggered = final_fee < terms["min_floor"]
+    return {
+        "final_fee": terms["min_floor"] if is_floor_triggered else final_fee,
+        "theoretical_fee": entry["theoretical_fee"],
+        "discount_factor": terms["discount_factor"],
+        "is_floor_triggered": is_floor_triggered,
+        "min_floor": terms["min_floor"],
+        "store_details": entry["counts"],
+        "excluded_count": entry["excluded_count"],
+        "procurement_type": terms["procurement_type"],
+    }
+
+
+def open_price_list(path):
+    """打开价目表；文件不存在或已损坏时返回 None。"""
+    try:
+        return StandardPriceList(path)
+    except sqlite3.Error:
+        return None
+
+
+def ensure_price_list(path, version, loader):
+    """
+    确保 path 处的价目表是 version 版本，否则重建。
+
+    Args:
+        loader: 无参函数，返回 (store_index, config, xp_map, blacklist_df)，只在需要重建时调用。
+
+    Returns:
+        StandardPriceList
+    """
+    price_list = open_price_list(path) if os.path.exists(path) else None
+    if price_list is not None and price_list.version == version:
+        return price_list
+    store_index, config, xp_map, blacklist_df = loader()
+    write_price_list(build_price_list(store_index, config, xp_map, blacklist_df), path, version)
+    return StandardPriceList(path)
+
+
+def _load_inputs(paths):
+    store_master_df = load_store_master_compact(paths["store_master"])
+    xp_map = load_xp_mapping(paths["xp_mapping"]) if os.path.exists(paths["xp_mapping"]) else {}
+    blacklist_df = load_store_blacklist(paths["blacklist"]) if os.path.exists(paths["blacklist"]) else None
+    return StoreIndex(store_master_df), load_config(paths["config"]), xp_map, blacklist_df
+
+
+def refresh_price_list(paths=None):
+    """按默认路径 (或 paths 覆盖) 检查并重建价目表，供同步脚本和命令行调用。"""
+    paths = {**DEFAULT_PATHS, **(paths or {})}
+    return ensure_price_list(paths["price_list"], price_list_version(paths), lambda: _load_inputs(paths))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="标准通道价目表")
+    parser.add_argument("--path", default=DEFAULT_PATHS["price_list"], help="价目表文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="数据版本变化时重建价目表")
+    quote = sub.add_parser("quote", help="按价目表报价 (输出 JSON)")
+    quote.add_argument("--category", required=True, help="新品大类")
+    quote.add_argument("--xp-category", default=NO_XP_CATEGORY, help="处方类别")
+    quote.add_argument("--channel", required=True, help="标准通道")
+    quote.add_argument("--war-zone", default="全集团", help="提报战区")
+    quote.add_argument("--procurement", default="统采", help="统采or地采")
+    quote.add_argument("--sku-count", type=float, default=1, help="同一供应商单次引进SKU数")
+    quote.add_argument("--margin", type=float, default=0, help="预估毛利率(%%)")
+    quote.add_argument("--payment", help="付款方式")
+    quote.add_argument("--cost", type=float, default=0, help="底价")
+    quote.add_argument("--return-policy", help="退货条件")
+    quote.add_argument("--return-ratio", type=float, default=100.0, help="退货比例(%%)")
+    quote.add_argument("--supplier-type", help="供应商类型")
+    args = parser.parse_args(argv)
+
+    price_list = refresh_price_list({"price_list": args.path})
+    if args.command == "build":
+        print(f"✅ 价目表 {args.path}: {price_list.meta.get('n_rows')} 行, 版本 {price_list.version}")
+        return 0
+
+    row_data = {
+        "新品大类": args.category,
+        "处方类别": args.xp_category,
+        "channel": args.channel,
+        "提报战区": args.war_zone,
+        "统采or地采": args.procurement,
+        "同一供应商单次引进SKU数": args.sku_count,
+        "预估毛利率(%)": args.margin,
+        "付款方式": args.payment,
+        "底价": args.cost,
+        "退货条件": args.return_policy,
+        "退货比例(%)": args.return_ratio,
+        "供应商类型": args.supplier_type,
+    }
+    result = quote_standard(row_data, load_config(DEFAULT_PATHS["config"]), price_list)
+    if result is None:
+        print("❌ 价目表中没有该组合 (仅支持标准通道和配置中的战区)", file=sys.stderr)
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
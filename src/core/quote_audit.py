@@ -0,0 +1,270 @@
+"""
+报价审计日志：记录每一次单品报价 (输入条款、门店数、系数、折后费用、配置版本和门店数据版本)。
+
+界面线程只把记录放入内存队列 (不做序列化和磁盘 IO)，后台写线程取出一批后在一个事务内写入
+本地 SQLite (WAL 模式)；队列满时丢弃新记录并计数，不阻塞报价。按 用户+时间、新品大类+日期、
+供应商类型+日期、日期 建索引，recent_quotes 查询某用户最近的报价只走索引，通常在毫秒级。
+"""
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_AUDIT_PATH = os.path.join(PROJECT_ROOT, "data", "quote_audit.sqlite")
+
+# 每个事务最多写入的记录数
+DEFAULT_BATCH_SIZE = 500
+# 取到第一条记录后再等待的时长 (秒)，把连续的报价合并到一个事务
+DEFAULT_LINGER_SECONDS = 0.05
+# 队列上限，超出时丢弃新记录
+DEFAULT_MAX_QUEUE = 10000
+
+AUDIT_TABLE = "quotes"
+# (列名, 类型)；inputs / counts / coefficients 为 JSON 文本
+AUDIT_COLUMNS = [
+    ("created_at", "REAL"),
+    ("quote_date", "TEXT"),
+    ("user", "TEXT"),
+    ("category", "TEXT"),
+    ("supplier_type", "TEXT"),
+    ("procurement_type", "TEXT"),
+    ("channel", "TEXT"),
+    ("war_zone", "TEXT"),
+    ("xp_category", "TEXT"),
+    ("store_count", "INTEGER"),
+    ("theoretical_fee", "REAL"),
+    ("discount_factor", "REAL"),
+    ("final_fee", "REAL"),
+    ("is_floor_triggered", "INTEGER"),
+    ("config_version", "TEXT"),
+    ("store_version", "TEXT"),
+    ("inputs", "TEXT"),
+    ("counts", "TEXT"),
+    ("coefficients", "TEXT"),
+]
+AUDIT_INDEXES = {
+    "idx_quotes_user_time": "user, created_at",
+    "idx_quotes_category_date": "category, quote_date",
+    "idx_quotes_supplier_date": "supplier_type, quote_date",
+    "idx_quotes_date": "quote_date",
+}
+# recent_quotes / query_quotes 返回的列 (不含 JSON 明细)
+SUMMARY_COLUMNS = [
+    "id", "created_at", "user", "category", "supplier_type", "procurement_type", "channel",
+    "war_zone", "xp_category", "store_count", "final_fee", "config_version", "store_version",
+]
+
+
+def _to_json(value):
+    # numpy 数值等不能直接序列化的值转为 float / 字符串
+    def default(obj):
+        try:
+            return float(obj)
+        except (TypeError, ValueError):
+            return str(obj)
+
+    return json.dumps(value, ensure_ascii=False, default=default)
+
+
+def _to_row(entry):
+    """把队列中的原始记录转为一行 (在写线程中执行)。"""
+    row_data, counts, result = entry["row_data"], entry["counts"], entry["result"]
+    created_at = entry["created_at"]
+    return (
+        created_at,
+        datetime.fromtimestamp(created_at).strftime("%Y-%m-%d"),
+        entry["user"],
+        row_data.get("新品大类"),
+        row_data.get("供应商类型"),
+        row_data.get("统采or地采"),
+        row_data.get("channel"),
+        entry["war_zone"],
+        row_data.get("处方类别"),
+        int(sum(counts.values())),
+        float(result.get("theoretical_fee", 0)),
+        float(result.get("discount_factor", 0)),
+        float(result.get("final_fee", 0)),
+        int(bool(result.get("is_floor_triggered"))),
+        entry["config_version"],
+        entry["store_version"],
+        _to_json(row_data),
+        _to_json(counts),
+        _to_json(result.get("coefficients", [])),
+    )
+
+
+class QuoteAuditLog:
+    """
+    异步缓冲的报价审计日志。record() 只入队；后台写线程批量写入，flush() 等待已入队的记录写完，
+    close() 写完剩余记录后停止写线程 (进程退出时自动调用)。
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, linger_seconds=DEFAULT_LINGER_SECONDS,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self.path = path
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            columns = ", ".join(f"{name} {kind}" for name, kind in AUDIT_COLUMNS)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {AUDIT_TABLE} (id INTEGER PRIMARY KEY, {columns})")
+            for name, columns in AUDIT_INDEXES.items():
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {AUDIT_TABLE} ({columns})")
+        self._writer = threading.Thread(target=self._run, name="quote-audit-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record(self, user, row_data, counts, result, config_version, store_version, war_zone=None) -> bool:
+        """
+        记录一次报价 (非阻塞)。row_data / counts / result 同 calculate_fee 的输入输出。
+
+        Returns:
+            bool: 是否已入队 (队列满或日志已关闭时为 False)。
+        """
+        if not self._writer.is_alive():
+            self.dropped += 1
+            return False
+        entry = {
+            "created_at": time.time(),
+            "user": str(user),
+            "row_data": dict(row_data),
+            "counts": dict(counts),
+            "result": result,
+            "config_version": config_version,
+            "store_version": store_version,
+            "war_zone": war_zone,
+        }
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _write(self, conn, entries):
+        if not entries:
+            return
+        placeholders = ", ".join("?" * len(AUDIT_COLUMNS))
+        columns = ", ".join(name for name, _ in AUDIT_COLUMNS)
+        try:
+            rows = [_to_row(entry) for entry in entries]
+            with conn:
+                conn.executemany(f"INSERT INTO {AUDIT_TABLE} ({columns}) VALUES ({placeholders})", rows)
+            self.written += len(rows)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.dropped += len(entries)
+            print(f"Warning: 报价审计日志写入失败 ({len(entries)} 条): {e}")
+
+    def _run(self):
+        """写线程：阻塞等待第一条记录，再在 linger 时间内凑满一批，一个事务写入。"""
+        with closing(self._connect()) as conn:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                entries, waiters = [], []
+                deadline = time.perf_counter() + self.linger_seconds
+                while True:
+                    if item is None:
+                        stopping = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        entries.append(item)
+                    if stopping or waiters or len(entries) >= self.batch_size:
+                        break
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self._write(conn, entries)
+                for waiter in waiters:
+                    waiter.set()
+
+    def flush(self, timeout=10) -> bool:
+        """等待此前入队的记录全部写入，返回是否在 timeout 内完成。"""
+        if not self._writer.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        if self._writer.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                print("Warning: 报价审计日志队列已满，关闭时未写入的记录将丢失")
+                return
+            self._writer.join(timeout)
+
+    def _query(self, where, params, limit):
+        sql = (f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM {AUDIT_TABLE}"
+               + (f" WHERE {' AND '.join(where)}" if where else "")
+               + " ORDER BY created_at DESC LIMIT ?")
+        with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)) as conn:
+            df = pd.read_sql_query(sql, conn, params=[*params, int(limit)])
+        df["created_at"] = df["created_at"].map(datetime.fromtimestamp)
+        return df
+
+    def recent_quotes(self, user, limit=20) -> pd.DataFrame:
+        """某用户最近的报价 (新的在前)，只含已写入的记录。"""
+        return self._query(["user = ?"], [str(user)], limit)
+
+    def query_quotes(self, category=None, supplier_type=None, start_date=None, end_date=None, limit=1000) -> pd.DataFrame:
+        """按 新品大类 / 供应商类型 / 日期范围 (YYYY-MM-DD，含两端) 查询报价 (新的在前)。"""
+        where, params = [], []
+        for column, op, value in [("category", "=", category), ("supplier_type", "=", supplier_type),
+                                  ("quote_date", ">=", start_date), ("quote_date", "<=", end_date)]:
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                params.append(str(value))
+        return self._query(where, params, limit)
+
+    def quote_detail(self, quote_id) -> dict | None:
+        """单条报价的完整记录 (inputs / counts / coefficients 解析为对象)。"""
+        with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(f"SELECT * FROM {AUDIT_TABLE} WHERE id = ?", (int(quote_id),)).fetchone()
+        if row is None:
+            return None
+        detail = dict(row)
+        for key in ("inputs", "counts", "coefficients"):
+            detail[key] = json.loads(detail[key]) if detail[key] else None
+        return detail
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+
+_LOGS = {}
+_LOGS_LOCK = threading.Lock()
+
+
+def get_quote_audit_log(path=None) -> QuoteAuditLog:
+    """返回进程级共享的审计日志 (每个文件一个实例和一个写线程)；路径可用 XP_FEE_AUDIT_DB 覆盖。"""
+    path = path or os.environ.get("XP_FEE_AUDIT_DB", DEFAULT_AUDIT_PATH)
+    with _LOGS_LOCK:
+        if path not in _LOGS:
+            _LOGS[path] = QuoteAuditLog(path)
+        return _LOGS[path]
@@ -0,0 +1,170 @@
+"""
+参考数据包：处方映射、门店黑名单、区域层级和筛选维度词表编译为一个带版本的二进制文件。
+
+界面原先分别解析四个文件 (两个 Excel 各走一遍 read_excel_safe)，错误处理也各不相同。
+这里把它们编译后一次性写入 data/reference_bundle.pkl：
+
+    {"format": BUNDLE_FORMAT, "built_at": ...,
+     "sources": {名称: {"path", "version" (mtime_ns-size), "sha256"}},
+     "data": {"xp_mapping": dict, "blacklist": DataFrame | None,
+              "region_hierarchy": RegionHierarchy | None, "dim_metadata": dict | None}}
+
+加载时只读一次文件，再逐个比较源文件版本 (只 stat)：版本一致即为最新；版本变化时才计算 sha256，
+内容未变 (如只改了修改时间) 只更新记录，内容变化的部分单独重新编译，其余部分沿用。
+"""
+import hashlib
+import json
+import os
+import pickle
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from src.core.file_utils import get_file_version
+from src.core.store_index import RegionHierarchy
+from src.core.store_manager import load_store_blacklist, load_xp_mapping
+from src.core.timing import timed
+
+# 数据包结构变化时递增，旧文件整体重建
+BUNDLE_FORMAT = 1
+
+# 源文件 (相对项目根目录)
+REFERENCE_SOURCES = {
+    "xp_mapping": os.path.join("data", "处方类别与批文分类表.xlsx"),
+    "blacklist": os.path.join("data", "新品费剔除门店黑名单.xlsx"),
+    "region_map": os.path.join("data", "region_map.xlsx"),
+    "dim_metadata": os.path.join("data", "dim_metadata.json"),
+}
+DEFAULT_BUNDLE = os.path.join("data", "reference_bundle.pkl")
+
+# 源文件 → 数据包中的编译结果
+_DATA_KEYS = {
+    "xp_mapping": "xp_mapping",
+    "blacklist": "blacklist",
+    "region_map": "region_hierarchy",
+    "dim_metadata": "dim_metadata",
+}
+
+
+def source_paths(project_root) -> dict:
+    return {name: os.path.join(project_root, rel) for name, rel in REFERENCE_SOURCES.items()}
+
+
+def reference_version(sources) -> str:
+    """所有源文件版本的组合 (只 stat)，任一文件变化即变化；用作界面缓存键。"""
+    return "|".join(get_file_version(sources[name]) for name in REFERENCE_SOURCES)
+
+
+def _sha256(path):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compile_source(name, path):
+    """编译单个源文件；文件不存在或无法解析时打印 Warning 并返回空结果 (映射为 {}，其余为 None)。"""
+    if name == "xp_mapping":
+        return load_xp_mapping(path)
+    if name == "blacklist":
+        return load_store_blacklist(path)
+    if not os.path.exists(path):
+        print(f"Warning: {name} file not found at {path}")
+        return None
+    try:
+        if name == "region_map":
+            return RegionHierarchy(pd.read_excel(path, engine="openpyxl"))
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: 无法加载 {name} ({path}): {e}")
+        return None
+
+
+def _read_bundle(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            bundle = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: 参考数据包无法读取，将重建: {e}")
+        return None
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        return None
+    return bundle
+
+
+def _write_bundle(bundle, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+@timed()
+def load_reference_bundle(sources, path, write=True) -> dict:
+    """
+    读取参考数据包，并按源文件检查是否过期，只重新编译过期的部分。
+
+    Args:
+        sources: {名称: 源文件路径} (见 source_paths)。
+        write: 有部分重建或记录更新时是否写回数据包 (只读目录下可关闭)。
+
+    Returns:
+        dict: 数据包 (见模块说明)，另附 "rebuilt": 本次重新编译的源文件名称列表。
+    """
+    bundle = _read_bundle(path) or {"format": BUNDLE_FORMAT, "sources": {}, "data": {}}
+    rebuilt, touched = [], False
+    for name in REFERENCE_SOURCES:
+        source_path = sources[name]
+        recorded = bundle["sources"].get(name)
+        version = get_file_version(source_path)
+        if recorded and recorded["path"] == source_path and recorded["version"] == version:
+            continue
+        digest = _sha256(source_path)
+        if recorded and recorded["path"] == source_path and recorded["sha256"] == digest:
+            # 内容未变，只更新记录的版本
+            recorded["version"] = version
+            touched = True
+            continue
+        bundle["data"][_DATA_KEYS[name]] = _compile_source(name, source_path)
+        bundle["sources"][name] = {"path": source_path, "version": version, "sha256": digest}
+        rebuilt.append(name)
+
+    if rebuilt or touched:
+        bundle["built_at"] = datetime.now().isoformat(timespec="seconds")
+        if write:
+            try:
+                _write_bundle({k: v for k, v in bundle.items() if k != "rebuilt"}, path)
+            except OSError as e:
+                print(f"Warning: 参考数据包写入失败: {e}")
+    bundle["rebuilt"] = rebuilt
+    if bundle["data"].get("xp_mapping") is None:
+        bundle["data"]["xp_mapping"] = {}
+    return bundle
+
+
+def refresh_reference_bundle(project_root, path=None) -> dict:
+    """按项目目录下的默认路径检查并更新参考数据包，供同步脚本和命令行调用。"""
+    path = path or os.environ.get("XP_FEE_REFERENCE_BUNDLE", os.path.join(project_root, DEFAULT_BUNDLE))
+    return load_reference_bundle(source_paths(project_root), path)
+
+
+def main(argv=None):
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    bundle = refresh_reference_bundle(project_root)
+    rebuilt = ", ".join(bundle["rebuilt"]) or "无"
+    print(f"✅ 参考数据包已是最新 (本次重新编译: {rebuilt})")
+    for name, info in bundle["sources"].items():
+        print(f"  {name}: {info['version']} sha256={str(info['sha256'])[:12]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+按区域 (省公司 → 省份 → 城市) 拆分报价费用。
+
+对报价所含门店 (与 calc_auto_counts 相同的筛选结果) 在 StoreIndex 上按 (省公司, 省份, 城市) × 销售规模 做一次分组 bincount，
+各城市的权重为其门店的理论费用 (门店数 × 单店基础费)，把折后费用 (折扣、取整和保底之后) 按权重以 分 为单位分摊到城市，
+省份和省公司由城市汇总，各层级的合计都与折后费用相等。10 万门店单次约数毫秒，单品计算时默认执行。
+"""
+import numpy as np
+import pandas as pd
+
+from src.core.attribution import allocate_fee, included_store_mask
+from src.core.store_index import REGION_LEVELS, StoreIndex
+from src.core.store_manager import ALL_STORE_TYPES
+
+EMPTY_REGION = "(空)"
+
+COUNT_TOTAL_COLUMN = "门店数合计"
+THEORETICAL_COLUMN = "理论费用 (元)"
+ALLOCATED_COLUMN = "分摊费用 (元)"
+SHARE_COLUMN = "费用占比"
+
+
+def region_fee_breakdown(store_index: StoreIndex, mask, final_fee, base_fees_config) -> pd.DataFrame:
+    """
+    城市级的费用拆分。
+
+    Args:
+        mask: 报价所含门店的布尔掩码 (见 included_store_mask)。
+        final_fee: 折后总费用。
+        base_fees_config: 该新品大类的 {销售规模: 单店基础费}。
+
+    Returns:
+        pd.DataFrame: 省公司、省份、城市、各销售规模门店数、门店数合计、理论费用、分摊费用、费用占比，
+        只含有门店的城市，按分摊费用从高到低排列。
+    """
+    groups, matrix = store_index.region_counts(mask)
+    present = matrix.sum(axis=1) > 0
+    groups = [g for g, keep in zip(groups, present) if keep]
+    matrix = matrix[present]
+
+    unit_fees = np.array([base_fees_config.get(t, 0) for t in store_index.scale_values], dtype=float)
+    theoretical = matrix @ unit_fees
+    # 基础费用全未配置时按门店数分摊
+    weights = theoretical if theoretical.sum() > 0 else matrix.sum(axis=1)
+    allocated = allocate_fee(final_fee, weights) / 100
+
+    # 先排序再一次性构建 DataFrame (逐列赋值的开销大于计算本身)
+    order = np.argsort(-allocated, kind="stable")
+    labels = np.array([[EMPTY_REGION if v is None else v for v in g] for g in groups], dtype=object).reshape(-1, 3)
+    data = {level: labels[order, i] for i, level in enumerate(REGION_LEVELS)}
+    scale_position = {t: i for i, t in enumerate(store_index.scale_values)}
+    store_types = [t for t in ALL_STORE_TYPES if t in scale_position] + \
+        [t for t in store_index.scale_values if t not in ALL_STORE_TYPES]
+    for store_type in store_types:
+        data[store_type] = matrix[order, scale_position[store_type]]
+    data[COUNT_TOTAL_COLUMN] = matrix.sum(axis=1)[order]
+    data[THEORETICAL_COLUMN] = theoretical[order]
+    data[ALLOCATED_COLUMN] = allocated[order]
+    data[SHARE_COLUMN] = allocated[order] / final_fee if final_fee else np.zeros(len(order))
+    return pd.DataFrame(data)
+
+
+def rollup_breakdown(breakdown: pd.DataFrame, level) -> pd.DataFrame:
+    """把城市级拆分汇总到 省公司 或 省份 (城市直接返回)。"""
+    if level == REGION_LEVELS[-1]:
+        return breakdown
+    keys = REGION_LEVELS[:REGION_LEVELS.index(level) + 1]
+    summed = breakdown.drop(columns=[c for c in REGION_LEVELS if c not in keys]).groupby(keys, sort=False).sum()
+    return summed.sort_values(ALLOCATED_COLUMN, ascending=False, kind="stable").reset_index()
+
+
+def quote_region_breakdown(store_index: StoreIndex, result, config, category, channel, **count_kwargs) -> pd.DataFrame:
+    """
+    单次报价的城市级费用拆分：按 channel 和 count_kwargs (同 calc_auto_counts) 确定所含门店，
+    按 calculate_fee 的结果 result 分摊 final_fee。
+    """
+    mask = included_store_mask(store_index, channel, category=category, **count_kwargs)
+    return region_fee_breakdown(
+        store_index, mask, result["final_fee"], config.get("base_fees", {}).get(category, {})
+    )
@@ -0,0 +1,147 @@
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from src.core.store_manager import calc_auto_counts
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def _exact(value):
+    """
+    按原样序列化计算输入 (保留 None、首尾空格和数值类型)，用于缓存键：calc_auto_counts 直接使用原始参数
+    (如 restricted_xp_code 的 13 与 13.0 经 str() 后筛选结果不同)，任何会影响结果的差异都必须体现在键中。
+    numpy 标量转为 Python 标量。
+    """
+    if isinstance(value, dict):
+        return sorted([str(k), _exact(v)] for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_exact(v) for v in value]
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):  # numpy 标量
+        value = value.item()
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    return [type(value).__name__, repr(value)]
+
+
+def _normalize_filters(filters):
+    """
+    规整筛选条件：忽略空值与 '全部' (filter_stores 同样跳过)，多选列表按原值排序去重
+    (isin 是集合语义，与选择顺序无关；不改变取值本身)。'销售规模' 除外，其顺序决定结果字典的顺序。
+    """
+    if not filters:
+        return None
+    normalized = {}
+    for col, val in filters.items():
+        if not isinstance(val, list) and (not val or val == "全部"):
+            continue
+        if isinstance(val, list) and col != "销售规模":
+            if not val:
+                continue
+            val = ["multiselect", sorted({(type(v).__name__, repr(v)) for v in val})]
+        normalized[str(col)] = val
+    return normalized or None
+
+
+def make_cache_key(namespace, versions, **inputs) -> str:
+    """
+    根据输入 (按原样序列化，见 _exact) 和数据版本生成哈希键。
+    """
+    payload = {"ns": namespace, "versions": list(versions), "inputs": _exact(inputs)}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    进程级 LRU 缓存，保存门店数量统计结果，供所有会话共享。
+    (费用计算本身只需微秒级，缓存键和拷贝的开销高于直接计算，不缓存。)
+
+    配置版本和门店数据版本是键的一部分，版本变化后旧条目不再命中，由 LRU 自然淘汰
+(不整体清空：按历史日期报价与按当前数据报价交替进行时，不会互相清空对方的条目)。
+所有操作加锁，可在 Streamlit 的多个会话线程中使用。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def versions(config_version, store_version):
+        """参与键计算的数据版本 (配置版本, 门店数据版本)。"""
+        return str(config_version), str(store_version)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._entries[key])
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = copy.deepcopy(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+_RESULT_CACHE = ResultCache()
+
+
+def get_result_cache() -> ResultCache:
+    """返回进程级共享的结果缓存。"""
+    return _RESULT_CACHE
+
+
+def cached_calc_auto_counts(
+    store_master_df,
+    channel,
+    config_version,
+    store_version,
+    cache: ResultCache | None = None,
+    **kwargs,
+):
+    """
+    带缓存的 calc_auto_counts。store_version 需覆盖门店主数据和黑名单两个文件。
+    kwargs 同 calc_auto_counts (blacklist_df 不参与键计算，由 store_version 代表)。
+    """
+    cache = cache or get_result_cache()
+    versions = cache.versions(config_version, store_version)
+    key_inputs = {k: v for k, v in kwargs.items() if k != "blacklist_df"}
+    if "filters" in key_inputs:
+        key_inputs["filters"] = _normalize_filters(key_inputs["filters"])
+    key_inputs["has_blacklist"] = kwargs.get("blacklist_df") is not None
+    key = make_cache_key("counts", versions, channel=channel, **key_inputs)
+
+    counts = cache.get(key)
+    if counts is None:
+        counts = calc_auto_counts(store_master_df, channel, **kwargs)
+        cache.put(key, counts)
+    return counts
+
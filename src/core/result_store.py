@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+import pandas as pd
+
+# 所有任务结果的磁盘总量上限，超出时按最近访问时间淘汰
+DEFAULT_MAX_TOTAL_MB = 512
+# 超过该时长未访问的结果会被清理
+DEFAULT_MAX_AGE_SECONDS = 24 * 3600
+# 每个用户最多保留的任务数
+DEFAULT_MAX_JOBS_PER_USER = 3
+# 读取时触发淘汰的最小间隔 (秒)
+EVICT_INTERVAL_SECONDS = 60
+
+INDEX_FILE = "index.sqlite"
+RESULT_TABLE = "results"
+
+
+class BatchResultStore:
+    """
+    批量计算结果的磁盘存储：每个任务一个 SQLite 文件 (结果表) 和一份预先生成的 Excel，
+    会话中只保存任务句柄。index.sqlite 记录各任务的归属、大小和最近访问时间，
+    用于按总量 (LRU)、存活时长和每用户任务数淘汰，内存占用不随用户数和批量大小增长。
+    淘汰在打开存储、保存任务以及读取时 (间隔不小于 EVICT_INTERVAL_SECONDS) 执行，
+    没有新任务写入时过期结果也会被清理。
+    """
+
+    def __init__(self, root, max_total_mb=DEFAULT_MAX_TOTAL_MB, max_age_seconds=DEFAULT_MAX_AGE_SECONDS,
+                 max_jobs_per_user=DEFAULT_MAX_JOBS_PER_USER):
+        self.root = root
+        self.max_total_bytes = int(max_total_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_seconds
+        self.max_jobs_per_user = max_jobs_per_user
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, owner TEXT, name TEXT, n_rows INTEGER, size_bytes INTEGER,"
+                " created_at REAL, last_access REAL)"
+            )
+        self.evict()
+
+    @contextmanager
+    def _connect(self):
+        """index.sqlite 连接：退出时提交并关闭；多个会话线程可能同时写入，设置等待超时。"""
+        conn = sqlite3.connect(os.path.join(self.root, INDEX_FILE), timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _paths(self, job_id):
+        return os.path.join(self.root, f"{job_id}.sqlite"), os.path.join(self.root, f"{job_id}.xlsx")
+
+    def put(self, owner, result_df: pd.DataFrame, name="") -> dict:
+        """
+        保存一次批量结果并返回句柄 {job_id, name, n_rows, columns}，随后执行淘汰。
+        owner 为用户标识 (每用户任务数按它统计)。
+        Excel 在保存时生成一次，下载时直接读取文件。
+        """
+        job_id = uuid.uuid4().hex
+        db_path, xlsx_path = self._paths(job_id)
+        with closing(sqlite3.connect(db_path)) as conn:
+            result_df.to_sql(RESULT_TABLE, conn, index=False)
+        with pd.ExcelWriter(xlsx_path, engine="openpyxl") as writer:
+            result_df.to_excel(writer, index=False)
+        size = os.path.getsize(db_path) + os.path.getsize(xlsx_path)
+
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, str(owner), name, len(result_df), size, now, now),
+            )
+        self.evict(protect=job_id)
+        return {"job_id": job_id, "name": name, "n_rows": len(result_df), "columns": list(result_df.columns)}
+
+    def _touch(self, job_id):
+        # 已超过存活时长的任务视为不存在 (即使尚未被淘汰)，不再续期
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            found = conn.execute(
+                "UPDATE jobs SET last_access = ? WHERE job_id = ? AND last_access >= ?",
+                (now, job_id, now - self.max_age_seconds),
+            ).rowcount
+        return found > 0
+
+    def _evict_if_due(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_evict < EVICT_INTERVAL_SECONDS:
+                return
+            self._last_evict = now
+        self.evict()
+
+    def exists(self, handle) -> bool:
+        self._evict_if_due()
+        if not handle:
+            return False
+        db_path, _ = self._paths(handle["job_id"])
+        return os.path.exists(db_path) and self._touch(handle["job_id"])
+
+    def read(self, handle, limit=None) -> pd.DataFrame | None:
+        """读取结果 (limit 为预览行数)；已被淘汰时返回 None。"""
+        if not self.exists(handle):
+            return None
+        db_path, _ = self._paths(handle["job_id"])
+        query = f"SELECT * FROM {RESULT_TABLE}" + (f" LIMIT {int(limit)}" if limit is not None else "")
+        try:
+            with closing(sqlite3.connect(db_path)) as conn:
+                return pd.read_sql_query(query, conn)
+        except (sqlite3.Error, pd.errors.DatabaseError):
+            return None
+
+    def excel_bytes(self, handle) -> bytes | None:
+        """预先生成的 Excel 内容；已被淘汰时返回 None。"""
+        if not self.exists(handle):
+            return None
+        _, xlsx_path = self._paths(handle["job_id"])
+        try:
+            with open(xlsx_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def delete(self, job_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        for path in self._paths(job_id):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def evict(self, protect=None) -> int:
+        """
+        按 存活时长 → 每用户任务数 → 磁盘总量 (最久未访问优先) 的顺序淘汰，返回淘汰的任务数。
+        protect 为刚保存的任务，即使单个超出总量上限也保留。
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            self._last_evict = time.monotonic()
+            jobs = conn.execute(
+                "SELECT job_id, owner, size_bytes, last_access FROM jobs ORDER BY last_access DESC"
+            ).fetchall()
+
+        evicted = set()
+        per_owner = {}
+        for job_id, owner, _, last_access in jobs:
+            per_owner[owner] = per_owner.get(owner, 0) + 1
+            if now - last_access > self.max_age_seconds or per_owner[owner] > self.max_jobs_per_user:
+                evicted.add(job_id)
+        total = 0
+        for job_id, _, size, _ in jobs:
+            if job_id in evicted:
+                continue
+            total += size
+            if total > self.max_total_bytes and job_id != protect:
+                evicted.add(job_id)
+
+        for job_id in evicted:
+            self.delete(job_id)
+        return len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock, self._connect() as conn:
+            jobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM jobs").fetchone()
+        return {"jobs": jobs, "size_mb": round(size / 1024 / 1024, 2), "max_total_mb": self.max_total_bytes / 1024 / 1024}
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_batch_result_store(root) -> BatchResultStore:
+    """返回进程级共享的结果存储 (每个目录一个实例)。"""
+    with _STORES_LOCK:
+        if root not in _STORES:
+            _STORES[root] = BatchResultStore(
+                root,
+                max_total_mb=float(os.environ.get("XP_FEE_RESULT_MAX_MB", DEFAULT_MAX_TOTAL_MB)),
+                max_age_seconds=float(os.environ.get("XP_FEE_RESULT_MAX_AGE", DEFAULT_MAX_AGE_SECONDS)),
+                max_jobs_per_user=int(os.environ.get("XP_FEE_RESULT_MAX_JOBS", DEFAULT_MAX_JOBS_PER_USER)),
+            )
+        return _STORES[root]
@@ -0,0 +1,229 @@
+"""
+门店索引共享快照。
+
+多个 Streamlit worker 进程各自构建 StoreIndex 会重复 factorize 并各占一份内存。
+这里由一个进程把索引 (列编码、多值列倒排索引、战区 × 销售规模数量矩阵) 发布到快照目录：
+
+    <root>/<version>/manifest.json   版本、门店数、创建时间
+    <root>/<version>/meta.pkl        去重取值、倒排索引等小对象
+    <root>/<version>/*.npy           门店级编码数组 (大对象)
+    <root>/ACTIVE                    最近发布的版本号 (只在发布时写入)
+
+其余进程以 np.load(mmap_mode="r") 只读映射 .npy 文件，得到零拷贝的数组视图，
+操作系统页缓存中只保留一份。各进程按自己的门店主数据版本挂载对应的快照 (每个版本挂载一次)，
+同步期间不同进程看到不同版本时互不影响，索引始终与该进程的门店主数据一致。
+"""
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.core.store_index import StoreIndex
+
+ACTIVE_FILE = "ACTIVE"
+LOCK_FILE = ".publish.lock"
+# 发布锁超过该时长视为发布进程已退出，可被抢占
+LOCK_STALE_SECONDS = 600
+# 保留的历史版本个数 (含当前版本)，旧版本可能仍被其他进程映射，不立即删除
+DEFAULT_KEEP_VERSIONS = 3
+
+# {(root, version): StoreIndex}，按挂载顺序保留最近的 DEFAULT_KEEP_VERSIONS 个版本
+_attached = {}
+_attach_lock = threading.Lock()
+
+
+def _safe_version(version) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(version))
+
+
+def _compact_codes(codes):
+    """按取值个数选择最小的有符号整数类型 (保留 -1 表示空值)。"""
+    codes = np.asarray(codes)
+    high = int(codes.max()) if codes.size else 0
+    for dtype in (np.int8, np.int16, np.int32):
+        if high < np.iinfo(dtype).max:
+            return codes.astype(dtype)
+    return codes.astype(np.int64)
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def publish_snapshot(store_index: StoreIndex, root, version, keep=DEFAULT_KEEP_VERSIONS) -> str:
+    """
+    把索引写入 <root>/<version> 并设为当前版本。先写临时目录再整体改名，读取方不会看到写了一半的快照。
+
+    Returns:
+        str: 快照目录。
+    """
+    version = _safe_version(version)
+    os.makedirs(root, exist_ok=True)
+    target = os.path.join(root, version)
+    if not os.path.exists(os.path.join(target, "manifest.json")):
+        exported = store_index.export()
+        tmp_dir = os.path.join(root, f".tmp-{version}-{os.getpid()}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        arrays = {"scale_codes": exported["scale_codes"]}
+        encoding_files = {}
+        for i, (key, (codes, _)) in enumerate(sorted(exported["encodings"].items())):
+            encoding_files[key] = f"enc_{i}"
+            arrays[f"enc_{i}"] = codes
+        for name, codes in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), _compact_codes(codes))
+
+        meta = {
+            "columns": exported["columns"],
+            "scale_values": exported["scale_values"],
+            "encodings": {key: (encoding_files[key], list(uniques))
+                          for key, (_, uniques) in exported["encodings"].items()},
+            "tokens": exported["tokens"],
+            "count_cube": exported["count_cube"],
+        }
+        with open(os.path.join(tmp_dir, "meta.pkl"), "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest = {
+            "version": version,
+            "n_stores": exported["n_stores"],
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        _write_atomic(os.path.join(tmp_dir, "manifest.json"), json.dumps(manifest, ensure_ascii=False, indent=2))
+
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            # 其他进程已发布同一版本
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _write_atomic(os.path.join(root, ACTIVE_FILE), version)
+    _prune_versions(root, version, keep)
+    return target
+
+
+def _prune_versions(root, active, keep):
+    versions = []
+    for name in os.listdir(root):
+        manifest = os.path.join(root, name, "manifest.json")
+        if name != active and os.path.exists(manifest):
+            versions.append((os.path.getmtime(manifest), name))
+    for _, name in sorted(versions, reverse=True)[max(keep - 1, 0):]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def active_version(root):
+    """当前生效的快照版本；尚未发布时返回 None。"""
+    try:
+        with open(os.path.join(root, ACTIVE_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def attach_snapshot(root, version) -> StoreIndex:
+    """只读挂载指定版本的快照，数组为内存映射视图 (零拷贝)。"""
+    snapshot_dir = os.path.join(root, _safe_version(version))
+    with open(os.path.join(snapshot_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(os.path.join(snapshot_dir, "meta.pkl"), "rb") as f:
+        meta = pickle.load(f)
+
+    def load(name):
+        return np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r")
+
+    prebuilt = {
+        "n_stores": manifest["n_stores"],
+        "columns": meta["columns"],
+        "scale_codes": load("scale_codes"),
+        "scale_values": meta["scale_values"],
+        "encodings": {key: (load(name), pd.Index(uniques, dtype=object))
+                      for key, (name, uniques) in meta["encodings"].items()},
+        "tokens": meta["tokens"],
+        "count_cube": meta["count_cube"],
+    }
+    index = StoreIndex(prebuilt=prebuilt)
+    index.snapshot_version = manifest["version"]
+    return index
+
+
+def get_store_snapshot(root, version) -> StoreIndex:
+    """返回指定版本的快照索引 (进程内按版本缓存，每个版本只挂载一次)。"""
+    key = (root, _safe_version(version))
+    with _attach_lock:
+        cached = _attached.get(key)
+    if cached is not None:
+        return cached
+    index = attach_snapshot(root, version)
+    with _attach_lock:
+        index = _attached.setdefault(key, index)
+        while len(_attached) > DEFAULT_KEEP_VERSIONS:
+            _attached.pop(next(iter(_attached)))
+    return index
+
+
+def get_active_store_index(root):
+    """返回最近发布版本 (ACTIVE) 的快照索引；尚未发布时返回 None。"""
+    version = active_version(root)
+    return get_store_snapshot(root, version) if version is not None else None
+
+
+def _acquire_lock(path):
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(path) > LOCK_STALE_SECONDS:
+                os.unlink(path)
+                return _acquire_lock(path)
+        except OSError:
+            pass
+        return False
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    return True
+
+
+def ensure_store_snapshot(root, version, loader, wait_seconds=30.0):
+    """
+    确保 version 已发布，返回该版本 (而非 ACTIVE 指向的版本) 的挂载索引。同一时刻只有一个进程负责发布，
+    其余进程等待发布完成；等待超时则返回 None，由调用方退回进程内索引。只在发布时写入 ACTIVE。
+
+    Args:
+        loader: 无参函数，返回门店主数据 DataFrame (只在需要发布时调用)。
+    """
+    safe = _safe_version(version)
+    with _attach_lock:
+        cached = _attached.get((root, safe))
+    if cached is not None:
+        return cached
+    os.makedirs(root, exist_ok=True)
+    if os.path.exists(os.path.join(root, safe, "manifest.json")):
+        return get_store_snapshot(root, safe)
+
+    lock_path = os.path.join(root, LOCK_FILE)
+    deadline = time.monotonic() + wait_seconds
+    while not _acquire_lock(lock_path):
+        if os.path.exists(os.path.join(root, safe, "manifest.json")):
+            return ensure_store_snapshot(root, version, loader, wait_seconds)
+        if time.monotonic() > deadline:
+            print(f"Warning: 等待门店索引快照 {safe} 发布超时，使用进程内索引")
+            return None
+        time.sleep(0.2)
+    try:
+        publish_snapshot(StoreIndex(loader()), root, safe)
+    finally:
+        try:
+            os.unlink(lock_path)
+        except OSError:
+            pass
+    return get_store_snapshot(root, safe)
@@ -0,0 +1,184 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from src.core.fee_engine import compile_config
+from src.core.sweep import sweep_fees
+
+# 可反推的数值条款及其取值范围 (下限, 上限)，与界面输入框的范围一致
+SOLVABLE_FIELDS = {
+    "预估毛利率(%)": (0.0, 100.0),
+    "同一供应商单次引进SKU数": (1.0, math.inf),
+    "底价": (0.0, math.inf),
+    "退货比例(%)": (0.0, 100.0),
+}
+
+# 只能取整数的条款
+_INTEGER_FIELDS = {"同一供应商单次引进SKU数"}
+
+
+def get_breakpoints(field, row_data, compiled):
+    """
+    从编译后的配置中取出某个条款的全部区间端点 (含免单阈值)。
+    系数是分段常数，费用只可能在这些端点处发生变化。
+    """
+    category = row_data.get("新品大类")
+    tables = []
+    points = []
+    if field == "预估毛利率(%)":
+        tables.append(compiled["margin"])
+        if category == "养生中药":
+            points.append(65.0)  # 养生中药 & 毛利率>=65% 免单
+    elif field == "同一供应商单次引进SKU数":
+        if category in compiled["sku"]:
+            tables.append(compiled["sku"][category])
+    elif field == "底价":
+        tables.append(compiled["cost"])
+    elif field == "退货比例(%)":
+        policy = row_data.get("退货条件")
+        if policy in compiled["return_ratio"]:
+            tables.append(compiled["return_ratio"][policy])
+    else:
+        raise ValueError(f"不支持反推的字段: {field}")
+
+    for table in tables:
+        points.extend(table["min"].tolist())
+        points.extend(table["max"].tolist())
+    return sorted({p for p in points if np.isfinite(p)})
+
+
+def get_segments(field, row_data, compiled):
+    """
+    将条款取值范围按区间端点切分为若干段 [下限, 上限)，段内费用恒定。
+    整数条款 (SKU数) 的下限向上取整，不含整数的段会被跳过。
+    """
+    lower, upper = SOLVABLE_FIELDS[field]
+    cuts = [lower] + [p for p in get_breakpoints(field, row_data, compiled) if lower < p < upper] + [upper]
+
+    segments = []
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        if field in _INTEGER_FIELDS:
+            start = float(math.ceil(start))
+            if start >= end:
+                continue
+        segments.append((start, end))
+    if math.isfinite(upper):
+        # 上限本身可取 (如毛利率 100%)，可能落在所有区间之外而取默认系数，单独作为一段
+        segments.append((upper, upper))
+    return segments
+
+
+def _adjacent(end, start, field):
+    """上一段的上限 end 与下一段的下限 start 是否相接 (整数条款的下限已向上取整)。"""
+    if field in _INTEGER_FIELDS and math.isfinite(end):
+        return math.ceil(end) == start
+    return end == start
+
+
+def feasible_ranges(segments_df, field):
+    """
+    把相邻的达标段合并为取值区间，返回 list of {"start", "end", "end_inclusive", "min_fee", "max_fee"}。
+    费用不一定随条款单调变化 (如退货比例越高系数越高)，达标的取值可能是一段或几段不相连的区间。
+    """
+    ranges = []
+    for start, end, fee, ok in zip(segments_df["区间下限"], segments_df["区间上限"],
+                                   segments_df["折后总新品铺货费 (元)"], segments_df["是否达标"]):
+        if not ok:
+            continue
+        start, end, fee = float(start), float(end), float(fee)
+        end_inclusive = start == end  # 上限本身单独成段
+        if ranges and not ranges[-1]["end_inclusive"] and _adjacent(ranges[-1]["end"], start, field):
+            last = ranges[-1]
+            last["end"], last["end_inclusive"] = end, end_inclusive
+            last["min_fee"], last["max_fee"] = min(last["min_fee"], fee), max(last["max_fee"], fee)
+        else:
+            ranges.append({"start": start, "end": end, "end_inclusive": end_inclusive, "min_fee": fee, "max_fee": fee})
+    if field in _INTEGER_FIELDS:
+        for r in ranges:
+            r["start"] = int(r["start"])
+            if math.isfinite(r["end"]) and not r["end_inclusive"]:
+                # 整数条款的开区间上限转为可取的最大整数
+                r["end"], r["end_inclusive"] = int(math.ceil(r["end"]) - 1), True
+    return ranges
+
+
+def describe_ranges(ranges) -> str:
+    """把 feasible_ranges 的结果格式化为如 "[0, 30)、[40, 100]" 或 "≥ 5" 的文字。"""
+    def fmt(value):
+        return int(value) if float(value).is_integer() else value
+
+    parts = []
+    for r in ranges:
+        start, end = fmt(r["start"]), r["end"]
+        if not math.isfinite(end):
+            parts.append(f"≥ {start}")
+        elif r["start"] == end:
+            parts.append(f"{start}")
+        else:
+            parts.append(f"[{start}, {fmt(end)}{']' if r['end_inclusive'] else ')'}")
+    return "、".join(parts)
+
+
+def solve_threshold(row_data, store_counts, config, field, target_fee, compiled=None):
+    """
+    反推：其他条款不变时，某个数值条款在哪些取值区间内最终费用不超过目标费用。
+
+    只在区间端点处取值计算 (通过 sweep_fees 一次向量化完成)，
+    因此取整到 10 元、保底兜底、养生中药免单等规则都与 calculate_fee 完全一致。
+
+    Args:
+        row_data: 基准条款 (同 calculate_fee)。
+        store_counts: dict of {store_type: count}
+        config: loaded configuration dict
+        field: 需要反推的条款，见 SOLVABLE_FIELDS。
+        target_fee: 目标费用 (元)，要求 最终费用 <= 目标费用。
+        compiled: (可选) compile_config 的结果。
+
+    Returns:
+        dict: {
+            "field": 条款名, "target_fee": 目标费用,
+            "feasible": 是否存在满足目标的取值,
+            "threshold": 满足目标的最小取值 (不存在时为 None)；更大的取值不一定达标，见 ranges,
+            "fee_at_threshold": 该取值下的最终费用,
+            "ranges": 满足目标的取值区间 (见 feasible_ranges),
+            "segments": DataFrame，每段的 [区间下限, 区间上限, 折扣, 折后费用, 是否达标],
+        }
+    """
+    if field not in SOLVABLE_FIELDS:
+        raise ValueError(f"不支持反推的字段: {field}")
+
+    if compiled is None:
+        compiled = compile_config(config)
+
+    segments = get_segments(field, row_data, compiled)
+    starts = [start for start, _ in segments]
+    sweep_df = sweep_fees(row_data, store_counts, config, {field: starts}, compiled=compiled)
+
+    segments_df = pd.DataFrame({
+        "区间下限": starts,
+        "区间上限": [end for _, end in segments],
+        "折扣": sweep_df["折扣"].to_numpy(),
+        "折后总新品铺货费 (元)": sweep_df["折后总新品铺货费 (元)"].to_numpy(),
+    })
+    segments_df["是否达标"] = segments_df["折后总新品铺货费 (元)"] <= target_fee
+
+    feasible = segments_df[segments_df["是否达标"]]
+    if feasible.empty:
+        threshold, fee_at_threshold = None, None
+    else:
+        first = feasible.iloc[0]
+        threshold = first["区间下限"]
+        if field in _INTEGER_FIELDS:
+            threshold = int(threshold)
+        fee_at_threshold = first["折后总新品铺货费 (元)"]
+
+    return {
+        "field": field,
+        "target_fee": target_fee,
+        "feasible": threshold is not None,
+        "threshold": threshold,
+        "fee_at_threshold": fee_at_threshold,
+        "ranges": feasible_ranges(segments_df, field),
+        "segments": segments_df,
+    }
@@ -0,0 +1,277 @@
+"""
+同步时的门店快照差异报告。
+
+新旧两期门店表按 门店sapid 做哈希连接 (sapid 与每行内容各算一个 64 位哈希)，
+找出新增、移除、销售规模变化、战区变化、新增受限编码和其他属性变化的门店，
+并统计各标准通道 × 提报战区、提报战区 × 销售规模 的门店数变化。
+
+所有按行的计算都在整数编码 / 哈希数组上完成：文本只在各列的去重取值上处理一次，
+不对 object 列做 pandas merge，15 万门店约 0.4 秒。
+"""
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.core.channel_rules import DEFAULT_CHANNEL_OPTIONS
+from src.core.store_history import _normalize_dt, list_snapshot_dates, load_store_snapshot
+from src.core.store_manager import resolve_channel_types
+
+# 每次同步都会变化、不参与比较的列
+DIFF_IGNORE_COLUMNS = ["门店表更新时间"]
+
+ADDED = "新增"
+REMOVED = "移除"
+RETIERED = "销售规模变化"
+ZONE_CHANGED = "战区变化"
+RESTRICTED_GAINED = "新增受限编码"
+OTHER_CHANGED = "其他属性变化"
+
+EMPTY_LABEL = "(空)"
+SUMMARY_FILE = "diff_summary.json"
+DETAIL_FILE = "diff_detail.csv"
+
+# 组合各列哈希的乘数 (64 位溢出回绕)
+_HASH_MULTIPLIER = np.uint64(1_000_003)
+_NA_HASH = pd.util.hash_array(np.array(["\0NA"], dtype=object))[0]
+
+
+def _encode_text(series: pd.Series):
+    """
+    列的 (编码, 去重取值的规整文本)。布尔 / 是否 列统一为 是/否，其余取值转文本去空白，
+    两期快照列类型不同 (如 category 与 object) 时比较结果不受影响。空值编码为 -1。
+    """
+    codes, uniques = pd.factorize(series)
+    if pd.api.types.is_bool_dtype(series):
+        texts = np.where(np.asarray(uniques, dtype=bool), "是", "否").astype(object)
+    else:
+        texts = pd.Index(uniques).astype(str).str.strip().to_numpy(dtype=object)
+    return np.asarray(codes, dtype=np.int64), texts
+
+
+def _column_hashes(codes, texts):
+    """按行的列哈希：去重取值哈希一次，再按编码取值；空值取固定哈希。"""
+    unique_hashes = pd.util.hash_array(texts) if len(texts) else np.array([], dtype=np.uint64)
+    return np.append(unique_hashes, _NA_HASH)[codes]
+
+
+def _row_hashes(column_hashes: dict, columns) -> np.ndarray:
+    """各行内容哈希：按 columns 顺序组合各列哈希。"""
+    n = len(next(iter(column_hashes.values()))) if column_hashes else 0
+    row_hash = np.zeros(n, dtype=np.uint64)
+    for col in columns:
+        row_hash = row_hash * _HASH_MULTIPLIER ^ column_hashes[col]
+    return row_hash
+
+
+class _Side:
+    """一期门店表的编码视图。"""
+
+    def __init__(self, df: pd.DataFrame, columns):
+        self.n = len(df)
+        self.encoded = {col: _encode_text(df[col]) if col in df.columns
+                        else (np.full(len(df), -1, dtype=np.int64), np.array([], dtype=object))
+                        for col in set(columns) | {"门店sapid", "提报战区", "销售规模"}}
+        self.hashes = {col: _column_hashes(*self.encoded[col]) for col in columns}
+        self.row_hash = _row_hashes(self.hashes, columns)
+        key_codes, _ = self.encoded["门店sapid"]
+        self.key = _column_hashes(*self.encoded["门店sapid"])
+        duplicated = pd.Index(self.key).duplicated() | (key_codes < 0)
+        if duplicated.any():
+            print(f"Warning: 门店表中有 {int(duplicated.sum())} 行 门店sapid 为空或重复，差异比较时忽略")
+        self.valid = ~duplicated
+
+    def texts(self, col, rows):
+        """指定行的规整文本 (只用于输出明细)，空值为空字符串。"""
+        codes, texts = self.encoded[col]
+        return np.append(texts, "")[codes[rows]]
+
+
+def _union_codes(old: _Side, new: _Side, col):
+    """两期同一列的去重取值合并为统一编号，返回 (旧编号, 新编号, 取值列表)；空值编号为最后一个。"""
+    _, old_texts = old.encoded[col]
+    _, new_texts = new.encoded[col]
+    labels = sorted(set(old_texts) | set(new_texts))
+    position = {label: i for i, label in enumerate(labels)}
+    na = len(labels)
+
+    def remap(side, texts):
+        codes, _ = side.encoded[col]
+        lookup = np.append(np.array([position[t] for t in texts], dtype=np.int64), na)
+        return lookup[codes]
+
+    return remap(old, old_texts), remap(new, new_texts), labels + [EMPTY_LABEL]
+
+
+def _zone_scale_matrix(zone_codes, scale_codes, n_zones, n_scales, rows):
+    flat = zone_codes[rows] * n_scales + scale_codes[rows]
+    return np.bincount(flat, minlength=n_zones * n_scales).reshape(n_zones, n_scales)
+
+
+def _count_movements(old: _Side, new: _Side):
+    """提报战区 × 销售规模、标准通道 × 提报战区 的上期 / 本期门店数。"""
+    old_zone, new_zone, zones = _union_codes(old, new, "提报战区")
+    old_scale, new_scale, scales = _union_codes(old, new, "销售规模")
+    before = _zone_scale_matrix(old_zone, old_scale, len(zones), len(scales), old.valid)
+    after = _zone_scale_matrix(new_zone, new_scale, len(zones), len(scales), new.valid)
+
+    zone_scale = pd.DataFrame({
+        "提报战区": np.repeat(zones, len(scales)),
+        "销售规模": np.tile(scales, len(zones)),
+        "上期门店数": before.ravel(),
+        "本期门店数": after.ravel(),
+    })
+    zone_scale = zone_scale[(zone_scale["上期门店数"] > 0) | (zone_scale["本期门店数"] > 0)]
+
+    records = []
+    for channel in DEFAULT_CHANNEL_OPTIONS:
+        valid_types = resolve_channel_types(channel)
+        columns = [i for i, scale in enumerate(scales) if scale in valid_types]
+        channel_before = before[:, columns].sum(axis=1)
+        channel_after = after[:, columns].sum(axis=1)
+        records.append({"铺货通道": channel, "提报战区": "全集团",
+                        "上期门店数": int(channel_before.sum()), "本期门店数": int(channel_after.sum())})
+        for zone, b, a in zip(zones, channel_before, channel_after):
+            if b or a:
+                records.append({"铺货通道": channel, "提报战区": zone, "上期门店数": int(b), "本期门店数": int(a)})
+    channels = pd.DataFrame(records)
+
+    for table in (zone_scale, channels):
+        table["变化"] = table["本期门店数"] - table["上期门店数"]
+    return zone_scale.reset_index(drop=True), channels
+
+
+def _tokens(text):
+    if not text or text.lower() == "nan":
+        return set()
+    return {token.strip() for token in text.replace("，", ",").split(",") if token.strip()}
+
+
+def diff_store_snapshots(old_df: pd.DataFrame, new_df: pd.DataFrame):
+    """
+    比较两期门店表。
+
+    Returns:
+        (dict, pd.DataFrame): 汇总 (各类变化门店数、通道 / 战区 / 销售规模门店数变化) 和
+        按门店的变化明细 (门店sapid、变化类型、上期/本期 战区和销售规模、新增受限编码、变化列)。
+    """
+    columns = sorted((set(old_df.columns) | set(new_df.columns)) - set(DIFF_IGNORE_COLUMNS) - {"门店sapid"})
+    old, new = _Side(old_df, columns), _Side(new_df, columns)
+
+    # 哈希连接：旧表 sapid 哈希建索引，新表逐行查找
+    old_rows = np.flatnonzero(old.valid)
+    new_rows = np.flatnonzero(new.valid)
+    matched = pd.Index(old.key[old_rows]).get_indexer(new.key[new_rows])
+    has_old = matched >= 0
+    added_rows = new_rows[~has_old]
+    pair_new = new_rows[has_old]
+    pair_old = old_rows[matched[has_old]]
+    removed_rows = np.setdiff1d(old_rows, pair_old, assume_unique=True)
+
+    changed = old.row_hash[pair_old] != new.row_hash[pair_new]
+    ch_old, ch_new = pair_old[changed], pair_new[changed]
+    column_changed = {col: old.hashes[col][ch_old] != new.hashes[col][ch_new] for col in columns}
+    retiered = column_changed.get("销售规模", np.zeros(len(ch_old), dtype=bool))
+    zone_changed = column_changed.get("提报战区", np.zeros(len(ch_old), dtype=bool))
+
+    # 新增受限编码：只对该列变化的门店，按去重取值拆分一次
+    gained = np.full(len(ch_old), "", dtype=object)
+    if "受限批文分类编码" in column_changed:
+        restricted_rows = np.flatnonzero(column_changed["受限批文分类编码"])
+        old_codes = old.texts("受限批文分类编码", ch_old[restricted_rows])
+        new_codes = new.texts("受限批文分类编码", ch_new[restricted_rows])
+        token_cache = {}
+        for i, before, after in zip(restricted_rows, old_codes, new_codes):
+            for text in (before, after):
+                if text not in token_cache:
+                    token_cache[text] = _tokens(text)
+            extra = token_cache[after] - token_cache[before]
+            if extra:
+                gained[i] = ",".join(sorted(extra))
+    restricted_gained = gained != ""
+
+    other_columns = [col for col in columns if col not in ("销售规模", "提报战区", "受限批文分类编码")]
+    changed_columns = np.full(len(ch_old), "", dtype=object)
+    for col in columns:
+        hit = column_changed[col]
+        changed_columns[hit] = changed_columns[hit] + np.where(changed_columns[hit] == "", "", ",") + col
+    other_changed = np.zeros(len(ch_old), dtype=bool)
+    for col in other_columns:
+        other_changed |= column_changed[col]
+    # 只有受限编码减少 (或规整后才相同) 的门店也归入其他属性变化，明细和汇总计数一致
+    other_changed |= ~(retiered | zone_changed | restricted_gained)
+
+    change_types = np.full(len(ch_old), "", dtype=object)
+    for label, mask in ((RETIERED, retiered), (ZONE_CHANGED, zone_changed),
+                        (RESTRICTED_GAINED, restricted_gained), (OTHER_CHANGED, other_changed)):
+        change_types[mask] = change_types[mask] + np.where(change_types[mask] == "", "", ",") + label
+
+    def side_columns(side, rows, suffix):
+        if rows is None:
+            return {f"提报战区({suffix})": "", f"销售规模({suffix})": ""}
+        return {f"提报战区({suffix})": side.texts("提报战区", rows), f"销售规模({suffix})": side.texts("销售规模", rows)}
+
+    parts = [
+        pd.DataFrame({"门店sapid": new.texts("门店sapid", added_rows), "变化类型": ADDED,
+                      **side_columns(old, None, "上期"), **side_columns(new, added_rows, "本期"),
+                      "新增受限编码": "", "变化列": ""}),
+        pd.DataFrame({"门店sapid": old.texts("门店sapid", removed_rows), "变化类型": REMOVED,
+                      **side_columns(old, removed_rows, "上期"), **side_columns(new, None, "本期"),
+                      "新增受限编码": "", "变化列": ""}),
+        pd.DataFrame({"门店sapid": new.texts("门店sapid", ch_new), "变化类型": change_types,
+                      **side_columns(old, ch_old, "上期"), **side_columns(new, ch_new, "本期"),
+                      "新增受限编码": gained, "变化列": changed_columns}),
+    ]
+    non_empty = [part for part in parts if not part.empty]
+    detail = pd.concat(non_empty, ignore_index=True) if non_empty else parts[0]
+
+    zone_scale, channels = _count_movements(old, new)
+    summary = {
+        "上期门店数": int(old.valid.sum()),
+        "本期门店数": int(new.valid.sum()),
+        ADDED: int(len(added_rows)),
+        REMOVED: int(len(removed_rows)),
+        RETIERED: int(retiered.sum()),
+        ZONE_CHANGED: int(zone_changed.sum()),
+        RESTRICTED_GAINED: int(restricted_gained.sum()),
+        OTHER_CHANGED: int(other_changed.sum()),
+        "未变化": int(len(pair_old) - changed.sum()),
+        "通道战区门店数": channels.to_dict(orient="records"),
+        "战区销售规模门店数": zone_scale.to_dict(orient="records"),
+    }
+    return summary, detail
+
+
+def write_snapshot_diff(history_root, dt, previous_dt=None):
+    """
+    比较 dt 与上一期 (默认为 dt 之前最近的快照) 并写入 <history_root>/<dt>/ 下的
+    diff_summary.json (汇总) 和 diff_detail.csv (明细)。没有上一期快照时返回 None。
+
+    Returns:
+        dict | None: 汇总 (含 上期日期、本期日期、耗时秒)。
+    """
+    # 与 save_store_snapshot 相同，dt 可为 YYYYMMDD，统一为快照目录名 YYYY-MM-DD
+    dt = _normalize_dt(dt)
+    dates = list_snapshot_dates(history_root)
+    if previous_dt is not None:
+        previous_dt = _normalize_dt(previous_dt)
+    else:
+        earlier = [d for d in dates if d < dt]
+        if not earlier:
+            return None
+        previous_dt = earlier[-1]
+
+    start = time.perf_counter()
+    summary, detail = diff_store_snapshots(
+        load_store_snapshot(history_root, previous_dt), load_store_snapshot(history_root, dt)
+    )
+    summary = {"上期日期": previous_dt, "本期日期": dt, **summary,
+               "耗时秒": round(time.perf_counter() - start, 3)}
+
+    target = os.path.join(history_root, dt)
+    detail.to_csv(os.path.join(target, DETAIL_FILE), index=False, encoding="utf-8-sig")
+    with open(os.path.join(target, SUMMARY_FILE), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
+    return summary
@@ -0,0 +1,231 @@
+"""
+门店主数据历史快照 (按 dt 保留)。
+
+每次同步只拉取上月最后一天的门店表并覆盖 store_master.xlsx，无法回答 "为什么我的费用变了"。
+这里在同步时把门店表 (压缩后的列) 按 dt 以列式文件保存一份：
+
+    <root>/<dt>/manifest.json   dt、门店数、列信息、写入时间
+    <root>/<dt>/columns.pkl     每列的类型与去重取值
+    <root>/<dt>/col_<i>.npy     每列一个数组 (文本列为整数编码，布尔列为 int8，数值列为原值)
+
+StoreHistory 按需 (惰性) 加载某个 dt 的门店表并构建 StoreIndex，内存中以 LRU 只保留最近使用的几个，
+历史日期的门店统计 / 报价与当前门店表的代价相同。
+"""
+import json
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from src.core.calculator import calculate_fee
+from src.core.snapshot import _compact_codes
+from src.core.store_index import StoreIndex
+from src.core.store_manager import compact_store_master
+
+# 默认保留的历史快照个数 (按 dt 从新到旧)，约两年的月度快照
+DEFAULT_KEEP_SNAPSHOTS = 24
+# 内存中同时保留的历史门店表个数
+DEFAULT_MAX_LOADED = 4
+
+MANIFEST_FILE = "manifest.json"
+
+
+def previous_month_end(today: date | None = None) -> str:
+    """上月最后一天 (与同步 SQL 中的 LAST_DAY(DATE_SUB(CURDATE(), INTERVAL 1 MONTH)) 相同)，格式 YYYY-MM-DD。"""
+    today = today or date.today()
+    return (today.replace(day=1) - timedelta(days=1)).isoformat()
+
+
+def _normalize_dt(dt) -> str:
+    """接受 'YYYY-MM-DD' / 'YYYYMMDD' / date，统一为 YYYY-MM-DD。"""
+    if isinstance(dt, (date, datetime)):
+        return dt.strftime("%Y-%m-%d")
+    text = str(dt).strip()
+    for fmt in ("%Y-%m-%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"无法识别的快照日期: {dt}")
+
+
+def _encode_column(series: pd.Series):
+    """把一列编码为 (类型, 数组, 附加信息)。"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return "category", _compact_codes(series.cat.codes.to_numpy()), list(series.cat.categories)
+    if pd.api.types.is_bool_dtype(series):
+        values = np.where(series.isna().to_numpy(), -1, series.fillna(False).astype(bool).to_numpy()).astype(np.int8)
+        return "boolean", values, None
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return "numeric", series.to_numpy(), str(series.dtype)
+    codes, uniques = pd.factorize(series)
+    return "text", _compact_codes(codes), (list(uniques), str(series.dtype))
+
+
+def _decode_column(kind, values, extra) -> pd.Series:
+    if kind == "category":
+        return pd.Series(pd.Categorical.from_codes(np.asarray(values, dtype=np.int64), categories=extra))
+    if kind == "boolean":
+        values = np.asarray(values)
+        return pd.Series(pd.array(np.where(values < 0, None, values == 1).tolist(), dtype="boolean"))
+    if kind == "numeric":
+        return pd.Series(np.asarray(values), dtype=extra)
+    uniques, dtype = extra
+    codes = np.asarray(values, dtype=np.int64)
+    decoded = np.asarray(uniques + [np.nan], dtype=object)[codes]
+    return pd.Series(decoded, dtype=dtype)
+
+
+def save_store_snapshot(store_master_df: pd.DataFrame, root, dt, keep=DEFAULT_KEEP_SNAPSHOTS, compact=True) -> str:
+    """
+    把门店表保存为 dt 的历史快照 (同一 dt 重复同步时覆盖)，并按 keep 清理最旧的快照。
+
+    Args:
+        compact: 是否先执行 compact_store_master (只保留计算用到的列并压缩类型)。
+
+    Returns:
+        str: 快照目录。
+    """
+    dt = _normalize_dt(dt)
+    df = compact_store_master(store_master_df)[0] if compact else store_master_df
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = os.path.join(root, f".tmp-{dt}-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        kind, values, extra = _encode_column(df[col])
+        np.save(os.path.join(tmp_dir, f"col_{i}.npy"), values, allow_pickle=False)
+        columns.append({"name": col, "kind": kind, "extra": extra})
+    with open(os.path.join(tmp_dir, "columns.pkl"), "wb") as f:
+        pickle.dump(columns, f, protocol=pickle.HIGHEST_PROTOCOL)
+    manifest = {
+        "dt": dt,
+        "n_stores": len(df),
+        "columns": [c["name"] for c in columns],
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    target = os.path.join(root, dt)
+    if os.path.exists(target):
+        # 先移走旧目录再整体改名，读取方要么看到旧快照，要么看到完整的新快照
+        stale = os.path.join(root, f".old-{dt}-{os.getpid()}")
+        os.rename(target, stale)
+        os.rename(tmp_dir, target)
+        shutil.rmtree(stale, ignore_errors=True)
+    else:
+        os.rename(tmp_dir, target)
+    _prune_snapshots(root, keep)
+    return target
+
+
+def list_snapshot_dates(root) -> list:
+    """已保留的快照日期，从旧到新。"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(".") and os.path.exists(os.path.join(root, name, MANIFEST_FILE))
+    )
+
+
+def _prune_snapshots(root, keep):
+    for dt in list_snapshot_dates(root)[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(root, dt), ignore_errors=True)
+
+
+def load_store_snapshot(root, dt) -> pd.DataFrame:
+    """读取 dt 的历史门店表 (列类型与保存时一致)。"""
+    snapshot_dir = os.path.join(root, _normalize_dt(dt))
+    if not os.path.exists(os.path.join(snapshot_dir, MANIFEST_FILE)):
+        raise KeyError(f"没有 {dt} 的门店快照")
+    with open(os.path.join(snapshot_dir, "columns.pkl"), "rb") as f:
+        columns = pickle.load(f)
+    data = {}
+    for i, column in enumerate(columns):
+        values = np.load(os.path.join(snapshot_dir, f"col_{i}.npy"), allow_pickle=False)
+        data[column["name"]] = _decode_column(column["kind"], values, column["extra"])
+    return pd.DataFrame(data)
+
+
+class StoreHistory:
+    """
+    按日期访问历史门店快照：门店表与 StoreIndex 在首次使用时加载，按 LRU 保留 max_loaded 个。
+    """
+
+    def __init__(self, root, max_loaded=DEFAULT_MAX_LOADED):
+        self.root = root
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dates(self) -> list:
+        return list_snapshot_dates(self.root)
+
+    def resolve(self, as_of) -> str | None:
+        """as_of 当天或之前最近的快照日期；没有时返回 None。"""
+        as_of = _normalize_dt(as_of)
+        candidates = [dt for dt in self.dates() if dt <= as_of]
+        return candidates[-1] if candidates else None
+
+    def _get(self, dt):
+        dt = _normalize_dt(dt)
+        with self._lock:
+            if dt in self._loaded:
+                self._loaded.move_to_end(dt)
+                return self._loaded[dt]
+        df = load_store_snapshot(self.root, dt)
+        entry = (df, StoreIndex(df))
+        with self._lock:
+            self._loaded[dt] = entry
+            self._loaded.move_to_end(dt)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return entry
+
+    def store_master(self, dt) -> pd.DataFrame:
+        return self._get(dt)[0]
+
+    def store_index(self, dt) -> StoreIndex:
+        return self._get(dt)[1]
+
+    def calc_auto_counts(self, dt, channel, **kwargs) -> dict:
+        """在 dt 的门店快照上统计门店数，参数与结果同 calc_auto_counts。"""
+        return self.store_index(dt).calc_counts(channel, **kwargs)
+
+    def calculate_fee(self, dt, row_data, config, **count_kwargs) -> dict:
+        """
+        按 dt 的门店快照报价：row_data 中的 channel 决定通道 (手动输入的自定义门店数不依赖快照)，
+        count_kwargs 同 calc_auto_counts (restricted_xp_code / war_zone / filters / 黑名单参数)。
+        """
+        counts = self.calc_auto_counts(dt, row_data.get("channel"), **count_kwargs)
+        result = calculate_fee(row_data, counts, config)
+        result["snapshot_dt"] = _normalize_dt(dt)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = list(self._loaded)
+        return {"snapshots": len(self.dates()), "loaded": loaded, "max_loaded": self.max_loaded}
+
+
+_HISTORIES = {}
+_HISTORIES_LOCK = threading.Lock()
+
+
+def get_store_history(root) -> StoreHistory:
+    """返回进程级共享的历史快照访问对象 (每个目录一个实例)。"""
+    with _HISTORIES_LOCK:
+        if root not in _HISTORIES:
+            _HISTORIES[root] = StoreHistory(
+                root, max_loaded=int(os.environ.get("XP_FEE_HISTORY_MAX_LOADED", DEFAULT_MAX_LOADED))
+            )
+        return _HISTORIES[root]
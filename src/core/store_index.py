@@ -0,0 +1,516 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from src.core.store_manager import _get_blacklisted_sapids, resolve_channel_types
+
+REGION_LEVELS = ["省公司", "省份", "城市"]
+
+# StoreIndex 中缓存的维度掩码个数上限 (10 万门店时每个约 100KB)
+DEFAULT_MASK_CACHE_SIZE = 128
+
+# 逗号分隔的多值列 → 拆分后是否去除空白 (与 filter_stores 中的匹配规则一致)
+TOKEN_COLUMNS = {"客流商圈": False, "受限批文分类编码": True}
+
+
+class RegionHierarchy:
+    """
+    省公司 → 省份 → 城市 区域层级索引，每个门店表快照构建一次。
+
+    以去重后的 (省公司, 省份, 城市) 组合为最小单元：每个层级的取值对应一组组合编号，
+    级联选项只需对这些小集合做并/交运算，不必每次在整张表上构建布尔掩码。
+    结果与逐行 isin 过滤后取 unique 完全一致 (含跨层级的组合约束)。
+    """
+
+    def __init__(self, region_df: pd.DataFrame):
+        missing = [col for col in REGION_LEVELS if col not in region_df.columns]
+        if missing:
+            raise ValueError(f"区域表缺少列: {missing}")
+
+        frame = region_df[REGION_LEVELS].drop_duplicates()
+        frame = frame.astype(object).where(frame.notna(), None)
+        self.triples = list(frame.itertuples(index=False, name=None))
+
+        # 各层级取值 (排序后) 及 取值 → 组合编号集合
+        self.values = {}
+        self._triple_ids = {}
+        for level_idx, level in enumerate(REGION_LEVELS):
+            ids = {}
+            for triple_id, triple in enumerate(self.triples):
+                value = triple[level_idx]
+                if value is not None:
+                    ids.setdefault(value, set()).add(triple_id)
+            self.values[level] = sorted(ids)
+            self._triple_ids[level] = {value: frozenset(s) for value, s in ids.items()}
+
+        # 邻接表与反向映射
+        self.company_provinces = {}
+        self.province_cities = {}
+        self.province_companies = {}
+        self.city_provinces = {}
+        for company, province, city in self.triples:
+            if company is not None and province is not None:
+                self.company_provinces.setdefault(company, set()).add(province)
+                self.province_companies.setdefault(province, set()).add(company)
+            if province is not None and city is not None:
+                self.province_cities.setdefault(province, set()).add(city)
+                self.city_provinces.setdefault(city, set()).add(province)
+
+    def _matching_ids(self, selections, exclude_level=None):
+        """满足除 exclude_level 外所有层级选择的组合编号；没有任何选择时返回 None (表示全部)。"""
+        matched = None
+        for level in REGION_LEVELS:
+            selected = selections.get(level)
+            if level == exclude_level or not selected:
+                continue
+            ids = set()
+            for value in selected:
+                ids |= self._triple_ids[level].get(value, frozenset())
+            matched = ids if matched is None else matched & ids
+        return matched
+
+    def options(self, selections) -> dict:
+        """
+        级联选项：每个层级的可选值由其他层级的选择决定 (与原 get_mask 逻辑一致)。
+
+        Args:
+            selections: {层级: 已选列表}，空列表或缺失表示全部。
+
+        Returns:
+            dict: {层级: 排序后的可选值列表}
+        """
+        result = {}
+        for level_idx, level in enumerate(REGION_LEVELS):
+            matched = self._matching_ids(selections, exclude_level=level)
+            if matched is None:
+                result[level] = self.values[level]
+            else:
+                result[level] = sorted({
+                    self.triples[i][level_idx] for i in matched if self.triples[i][level_idx] is not None
+                })
+        return result
+
+    def encode(self, store_master_df) -> dict:
+        """
+        将门店表的区域列编码为各层级取值的序号 (不在索引中的取值和空值为 -1)，供 store_mask 使用。
+        """
+        codes = {}
+        for level in REGION_LEVELS:
+            if level in store_master_df.columns:
+                codes[level] = pd.Categorical(store_master_df[level], categories=self.values[level]).codes
+        return codes
+
+    def store_mask(self, codes, selections):
+        """
+        把区域选择直接转换为门店布尔掩码：每个层级用长度为取值数的查找表按序号取值。
+
+        Args:
+            codes: encode() 的结果。
+            selections: {层级: 已选列表}
+
+        Returns:
+            np.ndarray[bool] 或 None (没有任何区域选择)。
+        """
+        mask = None
+        for level in REGION_LEVELS:
+            selected = selections.get(level)
+            if not selected or level not in codes:
+                continue
+            # 末尾多一格 False，对应序号 -1 (未知取值/空值)
+            lookup = np.zeros(len(self.values[level]) + 1, dtype=bool)
+            lookup[pd.Index(self.values[level]).get_indexer(selected)] = True
+            lookup[-1] = False
+            level_mask = lookup[codes[level]]
+            mask = level_mask if mask is None else mask & level_mask
+        return mask
+
+
+def _freeze(value):
+    """将维度取值转换为可哈希、可比较的形式，用于判断维度是否变化和作为缓存键。"""
+    if isinstance(value, (list, tuple)):
+        return ("list", tuple(value))
+    if isinstance(value, (set, frozenset)):
+        return ("set", frozenset(value))
+    return ("scalar", value)
+
+
+class StoreIndex:
+    """
+    门店主数据索引，每个门店表快照构建一次，可在多个会话间共享 (只读 + 加锁的掩码缓存)。
+
+    各筛选维度 (标签列、战区、受限批文编码、黑名单) 先对列做 factorize，再按“去重取值”计算命中表，
+    最后按编号取值得到门店布尔掩码；同一维度同一取值的掩码会被缓存。
+    统计结果与 calc_auto_counts 完全一致。
+    """
+
+    def __init__(self, store_master_df: pd.DataFrame | None = None, mask_cache_size=DEFAULT_MASK_CACHE_SIZE,
+                 prebuilt=None):
+        """
+        Args:
+            store_master_df: 门店主数据；从快照构建时可为 None。
+            prebuilt: (可选) export() 格式的预计算编码，如共享快照中零拷贝映射的数组。
+        """
+        self._df = store_master_df
+        if prebuilt is not None:
+            self.n_stores = prebuilt["n_stores"]
+            self.columns = set(prebuilt["columns"])
+            self.scale_codes = prebuilt["scale_codes"]
+            scale_values = prebuilt["scale_values"]
+            self._encodings = dict(prebuilt["encodings"])
+            self._tokens = dict(prebuilt["tokens"])
+            self._count_cube = prebuilt.get("count_cube")
+        else:
+            self.n_stores = len(store_master_df)
+            self.columns = set(store_master_df.columns)
+            self.scale_codes, scale_values = pd.factorize(store_master_df["销售规模"])
+            self._encodings = {}
+            self._tokens = {}
+            self._count_cube = None
+        self._region_groups = None
+        self.scale_values = list(scale_values)
+        self._scale_position = {value: i for i, value in enumerate(self.scale_values)}
+
+        self._mask_cache = OrderedDict()
+        self._mask_cache_size = mask_cache_size
+        self._lock = threading.Lock()
+
+    # --- 编码 ---
+
+    def _encoding(self, kind, col):
+        """
+        按需计算并缓存某一列的编码，返回 (codes, 去重取值)，空值编号为 -1。
+
+        kind: "raw" 原值；"flag" 去空白后的 是/否 文本 (兼容压缩后的布尔列)；"stripped" 去空白后的文本。
+        """
+        key = f"{kind}:{col}"
+        with self._lock:
+            cached = self._encodings.get(key)
+        if cached is not None:
+            return cached
+        if self._df is None:
+            raise KeyError(f"索引快照中没有编码: {key}")
+
+        series = self._df[col]
+        if kind == "flag" and pd.api.types.is_bool_dtype(series):
+            codes, uniques = pd.factorize(series)
+            uniques = pd.Index(["是" if u else "否" for u in uniques], dtype=object)
+        elif kind in ("flag", "stripped"):
+            codes, uniques = pd.factorize(series.astype(str).str.strip())
+        else:
+            codes, uniques = pd.factorize(series)
+        with self._lock:
+            self._encodings[key] = (codes, uniques)
+        return codes, uniques
+
+    def _token_index(self, col):
+        """
+        多值列 (逗号分隔，见 TOKEN_COLUMNS) 的倒排索引：{拆分后的取值: 包含它的去重取值编号数组}。
+        """
+        with self._lock:
+            cached = self._tokens.get(col)
+        if cached is not None:
+            return cached
+
+        strip = TOKEN_COLUMNS[col]
+        _, uniques = self._encoding("raw", col)
+        index = {}
+        for i, cell in enumerate(uniques):
+            text = str(cell)
+            if strip and text.strip() == "":
+                continue
+            for token in text.replace("，", ",").split(","):
+                index.setdefault(token.strip() if strip else token, []).append(i)
+        index = {token: np.array(ids, dtype=np.int32) for token, ids in index.items()}
+        with self._lock:
+            self._tokens[col] = index
+        return index
+
+    @staticmethod
+    def _gather(codes, hits):
+        """由去重取值的命中表得到门店掩码；编号 -1 (空值) 取末尾的 False。"""
+        lookup = np.append(np.asarray(hits, dtype=bool), False)
+        return lookup[codes]
+
+    def _token_hits(self, col, tokens):
+        """包含任一 token 的去重取值命中表。"""
+        _, uniques = self._encoding("raw", col)
+        index = self._token_index(col)
+        hits = np.zeros(len(uniques), dtype=bool)
+        for token in tokens:
+            ids = index.get(token)
+            if ids is not None:
+                hits[ids] = True
+        return hits
+
+    def export(self) -> dict:
+        """
+        计算全部编码并以 prebuilt 格式导出 (发布共享快照用)。
+        """
+        for col in self.columns:
+            if col == "门店sapid":
+                self._encoding("stripped", col)
+                continue
+            self._encoding("raw", col)
+            # 任意标签列都可能按 是/否 筛选
+            self._encoding("flag", col)
+            if col in TOKEN_COLUMNS:
+                self._token_index(col)
+        return {
+            "n_stores": self.n_stores,
+            "columns": sorted(self.columns),
+            "scale_codes": self.scale_codes,
+            "scale_values": self.scale_values,
+            "encodings": dict(self._encodings),
+            "tokens": dict(self._tokens),
+            "count_cube": self.count_cube(),
+        }
+
+    def count_cube(self):
+        """
+        全部门店的 提报战区 × 销售规模 数量矩阵 (不含任何筛选)。
+
+        Returns:
+            (list, list, np.ndarray): 战区列表、销售规模列表、数量矩阵；没有 提报战区 列时为 None。
+        """
+        if self._count_cube is not None or "提报战区" not in self.columns:
+            return self._count_cube
+        zone_codes, zones = self._encoding("raw", "提报战区")
+        valid = (zone_codes >= 0) & (self.scale_codes >= 0)
+        n_scales = len(self.scale_values)
+        flat = zone_codes[valid].astype(np.int64) * n_scales + self.scale_codes[valid]
+        matrix = np.bincount(flat, minlength=len(zones) * n_scales).reshape(len(zones), n_scales)
+        self._count_cube = (list(zones), self.scale_values, matrix)
+        return self._count_cube
+
+    def region_groups(self):
+        """
+        门店所属的 (省公司, 省份, 城市) 组合编号，按需计算并缓存。
+
+        Returns:
+            (np.ndarray, list): 每个门店的组合编号，以及组合列表 (缺列或空值的层级为 None)。
+        """
+        with self._lock:
+            if self._region_groups is not None:
+                return self._region_groups
+        level_codes, level_values = [], []
+        for level in REGION_LEVELS:
+            if level in self.columns:
+                codes, uniques = self._encoding("raw", level)
+                level_codes.append(np.asarray(codes, dtype=np.int64) + 1)
+                level_values.append([None] + list(uniques))
+            else:
+                level_codes.append(np.zeros(self.n_stores, dtype=np.int64))
+                level_values.append([None])
+        # 各层级编号 (空值为 0) 按混合进制合并为一个整数键
+        key = np.zeros(self.n_stores, dtype=np.int64)
+        for codes, values in zip(level_codes, level_values):
+            key = key * len(values) + codes
+        unique_keys, group_codes = np.unique(key, return_inverse=True)
+        groups = []
+        for k in unique_keys.tolist():
+            parts = []
+            for values in reversed(level_values):
+                k, code = divmod(k, len(values))
+                parts.append(values[code])
+            groups.append(tuple(reversed(parts)))
+        with self._lock:
+            self._region_groups = (group_codes.reshape(-1), groups)
+        return self._region_groups
+
+    def region_counts(self, mask=None):
+        """
+        掩码内各 (省公司, 省份, 城市) 组合 × 销售规模 的门店数 (一次 bincount)。
+
+        Returns:
+            (list, np.ndarray): 组合列表，以及 组合 × scale_values 的数量矩阵。
+        """
+        group_codes, groups = self.region_groups()
+        scale_codes = self.scale_codes
+        if mask is not None:
+            group_codes, scale_codes = group_codes[mask], scale_codes[mask]
+        valid = scale_codes >= 0
+        n_scales = len(self.scale_values)
+        flat = group_codes[valid] * n_scales + scale_codes[valid]
+        matrix = np.bincount(flat, minlength=len(groups) * n_scales).reshape(len(groups), n_scales)
+        return groups, matrix
+
+    # --- 各维度掩码 (None 表示该维度不过滤) ---
+
+    def _isin_mask(self, col, values):
+        codes, uniques = self._encoding("raw", col)
+        return self._gather(codes, uniques.isin(values))
+
+    def _stripped_equals_mask(self, col, value):
+        codes, uniques = self._encoding("flag", col)
+        return self._gather(codes, np.asarray(uniques, dtype=object) == value)
+
+    def _district_mask(self, values):
+        codes, _ = self._encoding("raw", "客流商圈")
+        return self._gather(codes, self._token_hits("客流商圈", set(values)))
+
+    def _filter_mask(self, col, val):
+        # 规则与 filter_stores 的通用过滤器逻辑一致
+        if not val or val == "全部" or col == "销售规模" or col not in self.columns:
+            return None
+        if col == "客流商圈":
+            return self._district_mask(val) if isinstance(val, list) else None
+        if isinstance(val, str) and val in ["是", "否"]:
+            return self._stripped_equals_mask(col, val)
+        if isinstance(val, list):
+            return self._isin_mask(col, val)
+        return None
+
+    def _war_zone_mask(self, war_zone):
+        if not war_zone or war_zone == "全集团" or "提报战区" not in self.columns:
+            return None
+        return self._isin_mask("提报战区", war_zone if isinstance(war_zone, list) else [war_zone])
+
+    def _restricted_mask(self, restricted_xp_code):
+        if restricted_xp_code is None or "受限批文分类编码" not in self.columns:
+            return None
+        target_code = str(restricted_xp_code).strip()
+        if not target_code or target_code.lower() == "nan":
+            return None
+        codes, _ = self._encoding("raw", "受限批文分类编码")
+        excluded = self._gather(codes, self._token_hits("受限批文分类编码", [target_code]))
+        # 空值 (编号 -1) 不剔除
+        return ~excluded
+
+    def _blacklist_mask(self, sapids):
+        if not sapids or "门店sapid" not in self.columns:
+            return None
+        codes, uniques = self._encoding("stripped", "门店sapid")
+        return ~self._gather(codes, uniques.isin(sapids))
+
+    def dimension_mask(self, dimension, value):
+        """
+        计算单个维度的门店掩码 (带缓存)。
+
+        Args:
+            dimension: "战区" / "受限" / "黑名单" 或 "筛选:<列名>"。
+            value: 该维度的取值；黑名单为需剔除的 sapid 集合。
+        """
+        key = (dimension, _freeze(value))
+        with self._lock:
+            if key in self._mask_cache:
+                self._mask_cache.move_to_end(key)
+                return self._mask_cache[key]
+
+        if dimension == "战区":
+            mask = self._war_zone_mask(value)
+        elif dimension == "受限":
+            mask = self._restricted_mask(value)
+        elif dimension == "黑名单":
+            mask = self._blacklist_mask(value)
+        elif dimension.startswith("筛选:"):
+            mask = self._filter_mask(dimension[len("筛选:"):], value)
+        else:
+            raise ValueError(f"未知的筛选维度: {dimension}")
+
+        with self._lock:
+            self._mask_cache[key] = mask
+            if len(self._mask_cache) > self._mask_cache_size:
+                self._mask_cache.popitem(last=False)
+        return mask
+
+    @staticmethod
+    def dimension_values(
+        filters=None,
+        war_zone=None,
+        restricted_xp_code=None,
+        blacklist_df: pd.DataFrame | None = None,
+        selected_xp_category: str | None = None,
+        category: str | None = None,
+    ) -> dict:
+        """把 calc_auto_counts 的参数拆成 {维度: 取值}。"""
+        dims = {f"筛选:{col}": val for col, val in (filters or {}).items()}
+        dims["战区"] = war_zone
+        dims["受限"] = restricted_xp_code
+        dims["黑名单"] = frozenset(_get_blacklisted_sapids(blacklist_df, selected_xp_category, category))
+        return dims
+
+    def count_types(self, mask, valid_types) -> dict:
+        """统计掩码内各门店类型的数量，按 valid_types 的顺序返回。"""
+        codes = self.scale_codes if mask is None else self.scale_codes[mask]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self._scale_position))
+        return {t: int(counts[self._scale_position[t]]) if t in self._scale_position else 0 for t in valid_types}
+
+    def _cube_counts(self, dims, valid_types):
+        """只按战区过滤时直接从 count_cube 汇总，不构建门店掩码；其他维度有过滤时返回 None。"""
+        if any(self.dimension_mask(dim, value) is not None for dim, value in dims.items() if dim != "战区"):
+            return None
+        cube = self.count_cube()
+        if cube is None:
+            return None
+        zones, scale_values, matrix = cube
+        war_zone = dims.get("战区")
+        if not war_zone or war_zone == "全集团":
+            totals = matrix.sum(axis=0)
+            # 战区为空的门店不在矩阵中，全集团时需补上
+            if totals.sum() != int(np.count_nonzero(self.scale_codes >= 0)):
+                return None
+        else:
+            selected = set(war_zone if isinstance(war_zone, list) else [war_zone])
+            rows = [i for i, zone in enumerate(zones) if zone in selected]
+            totals = matrix[rows].sum(axis=0)
+        position = {value: i for i, value in enumerate(scale_values)}
+        return {t: int(totals[position[t]]) if t in position else 0 for t in valid_types}
+
+    def calc_counts(self, channel, restricted_xp_code=None, war_zone=None, filters=None,
+                    blacklist_df: pd.DataFrame | None = None, selected_xp_category: str | None = None,
+                    category: str | None = None, state=None) -> dict:
+        """
+        与 calc_auto_counts 参数和结果一致的索引版本。传入 state (FilterMaskState) 时增量更新。
+        """
+        valid_types = resolve_channel_types(channel, filters)
+        if not valid_types:
+            return {}
+        dims = self.dimension_values(filters, war_zone, restricted_xp_code, blacklist_df, selected_xp_category, category)
+        if state is None:
+            counts = self._cube_counts(dims, valid_types)
+            if counts is not None:
+                return counts
+        state = state or FilterMaskState(self)
+        state.update(dims)
+        return self.count_types(state.mask, valid_types)
+
+
+class FilterMaskState:
+    """
+    单个会话的增量筛选状态：记住每个维度上次的取值和掩码，只重算取值变化的维度，
+    再把各维度掩码按位与得到最终掩码。
+    """
+
+    def __init__(self, store_index: StoreIndex):
+        self.index = store_index
+        self._values = {}
+        self._masks = {}
+        self.mask = None
+        self.last_changed = []
+
+    def update(self, dims) -> list:
+        """
+        Args:
+            dims: 完整的 {维度: 取值}，未出现的维度视为不过滤。
+
+        Returns:
+            list: 本次重算的维度。
+        """
+        changed = [dim for dim in self._values if dim not in dims]
+        for dim in changed:
+            del self._values[dim]
+            del self._masks[dim]
+        for dim, value in dims.items():
+            frozen = _freeze(value)
+            if self._values.get(dim) != frozen:
+                self._values[dim] = frozen
+                self._masks[dim] = self.index.dimension_mask(dim, value)
+                changed.append(dim)
+
+        if changed or self.mask is None:
+            masks = [m for m in self._masks.values() if m is not None]
+            self.mask = np.logical_and.reduce(masks) if masks else None
+        self.last_changed = changed
+        return changed
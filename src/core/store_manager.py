@@ -1,12 +1,94 @@
+import numpy as np
 import pandas as pd
 import os
 from src.core.file_utils import read_excel_safe
+from src.core.timing import span, timed
 
 
+# 计算与界面实际读取的门店主数据列，其余列 (DHR战区、受限批文分类名称) 在压缩时丢弃
+STORE_MASTER_COLUMNS = [
+    "门店sapid", "提报战区", "销售规模", "受限批文分类编码", "门店表更新时间",
+    "省公司", "城市", "省份", "店龄店型", "客流商圈", "行政区划等级", "公域O2O店型",
+    "是否O2O门店", "是否医保店", "是否统筹店",
+]
+
+FLAG_COLUMNS = ["是否O2O门店", "是否医保店", "是否统筹店"]
+
+# 去重值占比不超过该比例的文本列转为 category
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+@timed()
 def load_store_master(path="data/store_master.xlsx"):
     return pd.read_excel(path)
 
 
+def _memory_mb(df) -> float:
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+def compact_store_master(store_master_df: pd.DataFrame):
+    """
+    将门店主数据转换为省内存的表示，筛选与统计结果与原表完全一致。
+
+    - 丢弃计算不读取的列 (见 STORE_MASTER_COLUMNS)
+    - 门店sapid：全部为无前导零的纯数字时转为整数 (按 astype(str) 比对黑名单时结果不变)
+    - 是/否 标签列：转为可空布尔 (空值为 NA)
+    - 低基数文本列：转为 category
+
+    Returns:
+        (DataFrame, dict): 压缩后的表，以及 {before_mb, after_mb, columns} 内存报告。
+    """
+    before_mb = _memory_mb(store_master_df)
+    df = store_master_df[[c for c in STORE_MASTER_COLUMNS if c in store_master_df.columns]].copy()
+    converted = {}
+
+    if "门店sapid" in df.columns and df["门店sapid"].notna().all():
+        as_text = df["门店sapid"].astype(str).str.strip()
+        as_int = pd.to_numeric(as_text, errors="coerce", downcast="integer")
+        if as_int.notna().all() and (as_int.astype(str) == as_text).all():
+            df["门店sapid"] = as_int
+            converted["门店sapid"] = str(as_int.dtype)
+
+    for col in FLAG_COLUMNS:
+        if col not in df.columns:
+            continue
+        stripped = df[col].where(df[col].isna(), df[col].astype(str).str.strip())
+        if stripped.dropna().isin(["是", "否"]).all():
+            df[col] = stripped.map({"是": True, "否": False}).astype("boolean")
+            converted[col] = "boolean"
+
+    for col in df.columns:
+        if col in converted or not (pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col])):
+            continue
+        if df[col].nunique(dropna=True) <= max(1, len(df) * CATEGORY_MAX_UNIQUE_RATIO):
+            df[col] = df[col].astype("category")
+            converted[col] = "category"
+
+    report = {"before_mb": round(float(before_mb), 2), "after_mb": round(float(_memory_mb(df)), 2), "columns": converted}
+    return df, report
+
+
+@timed()
+def load_store_master_compact(path="data/store_master.xlsx"):
+    """
+    加载门店主数据并压缩内存 (见 compact_store_master)，打印压缩前后的内存占用。
+    """
+    df, report = compact_store_master(load_store_master(path))
+    print(f"门店主数据内存: {report['before_mb']:.1f}MB -> {report['after_mb']:.1f}MB ({len(df)} 行)")
+    return df
+
+
+def flag_equals(series, val):
+    """
+    是/否 标签列与 val 比较 (去除首尾空白)；兼容压缩后的布尔列，空值视为不匹配。
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return series.eq(val == "是").fillna(False).astype(bool)
+    return series.astype(str).str.strip() == val
+
+
+@timed()
 def load_xp_mapping(path="data/处方类别与批文分类表.xlsx"):
     """
     加载处方类别与批文分类的映射表。
@@ -29,20 +111,19 @@ def load_xp_mapping(path="data/处方类别与批文分类表.xlsx"):
         df = df.dropna(subset=['批文分类编码'])
         
         mapping = {}
-        for _, row in df.iterrows():
-            target_code = str(row['批文分类编码']).strip()
-            
+        for category, code in zip(df['处方类别'].tolist(), df['批文分类编码'].tolist()):
             # 处理 '处方类别' (如: 10-处方药)
-            val_a = str(row['处方类别']).strip()
+            val_a = str(category).strip()
             if val_a and val_a.lower() != 'nan':
-                mapping[val_a] = target_code
-            
+                mapping[val_a] = str(code).strip()
+
         return mapping
     except Exception as e:
         print(f"Error loading xp mapping: {e}")
         return {}
 
 
+@timed()
 def load_store_blacklist(path: str = "data/新品费剔除门店黑名单.xlsx") -> pd.DataFrame | None:
     """
     加载门店黑名单文件。
@@ -124,36 +205,20 @@ def _get_blacklisted_sapids(
     )
 
 
-def calc_auto_counts(
-    store_master_df,
-    channel,
-    restricted_xp_code=None,
-    war_zone=None,
-    filters=None,
-    blacklist_df: pd.DataFrame | None = None,
-    selected_xp_category: str | None = None,
-    category: str | None = None,
-):
+ALL_STORE_TYPES = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+
+
+def resolve_channel_types(channel, filters=None):
     """
-    根据选择的通道、处方限制、战区和额外过滤器计算门店数量。
-    
+    将通道参数解析为需要统计的门店类型 (销售规模) 列表。
+
     Args:
-        store_master_df: 门店主数据 DataFrame。
-        channel: 
-            - 字符串: "超级旗舰店", "旗舰店及以上", "全量门店", "自定义" 等。
-            - 列表: 门店类型列表，例如 ["小店", "成长店"]。
-        restricted_xp_code: (可选) 用于检查门店限制的 xp_code 字符串。
-        war_zone: (可选) 战区名称。
-        filters: (可选) 额外过滤器的字典。
-        blacklist_df: (可选) 门店黑名单 DataFrame。
-        selected_xp_category: (可选) 前端选择的处方类别，用于黑名单匹配。
-        category: (可选) 前端选择的新品大类，用于黑名单匹配。
-    
+        channel: 通道名称字符串或门店类型列表，含义同 calc_auto_counts。
+        filters: (可选) 额外过滤器的字典，自定义通道时读取其中的 '销售规模'。
+
     Returns:
-        dict: {门店类型: 数量} 的字典。
+        list: 门店类型列表；无法解析时返回空列表。
     """
-    
-    # --- 1. 解析需要筛选的门店类型 (valid_types) ---
     valid_types = []
     
     if isinstance(channel, list):
@@ -164,7 +229,7 @@ def calc_auto_counts(
             if filters and '销售规模' in filters and filters['销售规模']:
                 valid_types = filters['销售规模']
             else:
-                valid_types = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+                valid_types = list(ALL_STORE_TYPES)
         elif channel == "超级旗舰店":
             valid_types = ["超级旗舰店"]
         elif channel == "旗舰店及以上":
@@ -176,76 +241,142 @@ def calc_auto_counts(
         elif channel == "小店及以上":
             valid_types = ["超级旗舰店", "旗舰店", "大店", "中店", "小店"]
         elif channel == "全量门店":
-            valid_types = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+            valid_types = list(ALL_STORE_TYPES)
         else:
             parts = channel.replace("，", ",").split(",")
             valid_types = [p.strip() for p in parts if p.strip()]
-    
-    if not valid_types:
-        return {}
 
-    # --- 2. 筛选逻辑开始 ---
+    return valid_types
+
+
+def filter_stores(
+    store_master_df,
+    restricted_xp_code=None,
+    war_zone=None,
+    filters=None,
+    blacklist_df: pd.DataFrame | None = None,
+    selected_xp_category: str | None = None,
+    category: str | None = None,
+):
+    """
+    按过滤器、战区、处方限制和黑名单筛选门店，返回筛选后的门店 DataFrame。
+    不按销售规模过滤，参数含义同 calc_auto_counts。
+    """
     current_df = store_master_df.copy()
 
     # 通用过滤器逻辑
-    if filters:
-        for col, val in filters.items():
-            if not val or val == "全部" or col == "销售规模": # 销售规模已在 valid_types 处理
-                continue
+    with span("calc_auto_counts.filters"):
+        if filters:
+            for col, val in filters.items():
+                if not val or val == "全部" or col == "销售规模": # 销售规模已在 valid_types 处理
+                    continue
             
-            if col not in current_df.columns:
-                continue
-
-            # 特殊处理：客流商圈 (逗号分隔的字符串包含逻辑)
-            if col == "客流商圈":
-                if isinstance(val, list) and val:
-                    def has_intersection(cell_val):
-                        if pd.isna(cell_val): return False
-                        store_districts = set(str(cell_val).replace("，", ",").split(","))
-                        return not set(val).isdisjoint(store_districts)
+                if col not in current_df.columns:
+                    continue
+
+                # 特殊处理：客流商圈 (逗号分隔的字符串包含逻辑)
+                if col == "客流商圈":
+                    if isinstance(val, list) and val:
+                        def has_intersection(cell_val):
+                            if pd.isna(cell_val): return False
+                            store_districts = set(str(cell_val).replace("，", ",").split(","))
+                            return not set(val).isdisjoint(store_districts)
                     
-                    current_df = current_df[current_df[col].apply(has_intersection)]
+                        current_df = current_df[current_df[col].apply(has_intersection)]
             
-            # 处理布尔/枚举值 (是/否)
-            elif isinstance(val, str) and val in ["是", "否"]:
-                current_df = current_df[current_df[col].astype(str).str.strip() == val]
+                # 处理布尔/枚举值 (是/否)
+                elif isinstance(val, str) and val in ["是", "否"]:
+                    current_df = current_df[flag_equals(current_df[col], val)]
             
-            # 处理列表多选 (isin)
-            elif isinstance(val, list):
-                current_df = current_df[current_df[col].isin(val)]
+                # 处理列表多选 (isin)
+                elif isinstance(val, list):
+                    current_df = current_df[current_df[col].isin(val)]
 
     # 战区过滤逻辑
-    if war_zone and war_zone != "全集团":
-        if "提报战区" in current_df.columns:
-            if isinstance(war_zone, list):
-                current_df = current_df[current_df["提报战区"].isin(war_zone)]
-            else:
-                current_df = current_df[current_df["提报战区"] == war_zone]
-
-    # --- 3. 受限门店过滤逻辑 ---
-    if restricted_xp_code is not None and "受限批文分类编码" in current_df.columns:
-        target_code = str(restricted_xp_code).strip()
-        if target_code and target_code.lower() != 'nan':
-            def is_store_excluded(cell_value):
-                if pd.isna(cell_value) or str(cell_value).strip() == "":
-                    return False
-                val_str = str(cell_value).replace("，", ",")
-                codes = [c.strip() for c in val_str.split(',')]
-                return target_code in codes
-
-            exclude_mask = current_df["受限批文分类编码"].apply(is_store_excluded)
-            current_df = current_df[~exclude_mask]
-
-    # --- 3.5 门店黑名单过滤逻辑 ---
-    blacklisted_sapids = _get_blacklisted_sapids(
-        blacklist_df, selected_xp_category, category
+    with span("calc_auto_counts.war_zone"):
+        if war_zone and war_zone != "全集团":
+            if "提报战区" in current_df.columns:
+                if isinstance(war_zone, list):
+                    current_df = current_df[current_df["提报战区"].isin(war_zone)]
+                else:
+                    current_df = current_df[current_df["提报战区"] == war_zone]
+
+    # --- 受限门店过滤逻辑 ---
+    with span("calc_auto_counts.restricted"):
+        if restricted_xp_code is not None and "受限批文分类编码" in current_df.columns:
+            target_code = str(restricted_xp_code).strip()
+            if target_code and target_code.lower() != 'nan':
+                def is_store_excluded(cell_value):
+                    if pd.isna(cell_value) or str(cell_value).strip() == "":
+                        return False
+                    val_str = str(cell_value).replace("，", ",")
+                    codes = [c.strip() for c in val_str.split(',')]
+                    return target_code in codes
+
+                exclude_mask = current_df["受限批文分类编码"].apply(is_store_excluded)
+                current_df = current_df[~exclude_mask]
+
+    # --- 门店黑名单过滤逻辑 ---
+    with span("calc_auto_counts.blacklist"):
+        blacklisted_sapids = _get_blacklisted_sapids(
+            blacklist_df, selected_xp_category, category
+        )
+        if blacklisted_sapids and "门店sapid" in current_df.columns:
+            current_df = current_df[
+                ~current_df["门店sapid"].astype(str).str.strip().isin(blacklisted_sapids)
+            ]
+
+    return current_df
+
+
+@timed()
+def calc_auto_counts(
+    store_master_df,
+    channel,
+    restricted_xp_code=None,
+    war_zone=None,
+    filters=None,
+    blacklist_df: pd.DataFrame | None = None,
+    selected_xp_category: str | None = None,
+    category: str | None = None,
+):
+    """
+    根据选择的通道、处方限制、战区和额外过滤器计算门店数量。
+    
+    Args:
+        store_master_df: 门店主数据 DataFrame。
+        channel: 
+            - 字符串: "超级旗舰店", "旗舰店及以上", "全量门店", "自定义" 等。
+            - 列表: 门店类型列表，例如 ["小店", "成长店"]。
+        restricted_xp_code: (可选) 用于检查门店限制的 xp_code 字符串。
+        war_zone: (可选) 战区名称。
+        filters: (可选) 额外过滤器的字典。
+        blacklist_df: (可选) 门店黑名单 DataFrame。
+        selected_xp_category: (可选) 前端选择的处方类别，用于黑名单匹配。
+        category: (可选) 前端选择的新品大类，用于黑名单匹配。
+    
+    Returns:
+        dict: {门店类型: 数量} 的字典。
+    """
+    
+    # --- 1. 解析需要筛选的门店类型 (valid_types) ---
+    valid_types = resolve_channel_types(channel, filters)
+    
+    if not valid_types:
+        return {}
+
+    # --- 2. 筛选逻辑 (过滤器 / 战区 / 受限 / 黑名单) ---
+    current_df = filter_stores(
+        store_master_df,
+        restricted_xp_code=restricted_xp_code,
+        war_zone=war_zone,
+        filters=filters,
+        blacklist_df=blacklist_df,
+        selected_xp_category=selected_xp_category,
+        category=category,
     )
-    if blacklisted_sapids and "门店sapid" in current_df.columns:
-        current_df = current_df[
-            ~current_df["门店sapid"].astype(str).str.strip().isin(blacklisted_sapids)
-        ]
 
-    # --- 4. 统计指定类型的门店数量 ---
+    # --- 3. 统计指定类型的门店数量 ---
     filtered_df = current_df[current_df["销售规模"].isin(valid_types)]
     counts = filtered_df["销售规模"].value_counts().to_dict()
     
@@ -255,6 +386,66 @@ def calc_auto_counts(
             
     return final_counts
 
+
+@timed()
+def calc_war_zone_counts(
+    store_master_df,
+    channel,
+    war_zones,
+    restricted_xp_code=None,
+    filters=None,
+    blacklist_df: pd.DataFrame | None = None,
+    selected_xp_category: str | None = None,
+    category: str | None = None,
+) -> pd.DataFrame:
+    """
+    一次性统计所有战区 × 销售规模的门店数量 (战区费用矩阵的输入)。
+
+    门店只筛选一次 (不按战区过滤)，再对 (提报战区, 销售规模) 做一次 bincount，
+    代价与单次 calc_auto_counts 相当。war_zones 中的 "全集团" 行统计全部筛选后门店。
+
+    Args:
+        war_zones: 战区列表，通常为 config['war_zones']。
+        其余参数同 calc_auto_counts。
+
+    Returns:
+        DataFrame: index 为战区，columns 为门店类型，值为门店数量。
+    """
+    valid_types = resolve_channel_types(channel, filters)
+    zones = list(war_zones)
+    if not valid_types:
+        return pd.DataFrame(index=pd.Index(zones, name="提报战区"))
+
+    current_df = filter_stores(
+        store_master_df,
+        restricted_xp_code=restricted_xp_code,
+        filters=filters,
+        blacklist_df=blacklist_df,
+        selected_xp_category=selected_xp_category,
+        category=category,
+    )
+
+    n_types = len(valid_types)
+    type_codes = pd.Categorical(current_df["销售规模"], categories=valid_types).codes
+    if "提报战区" in current_df.columns:
+        zone_codes = pd.Categorical(current_df["提报战区"], categories=zones).codes
+    else:
+        zone_codes = np.full(len(current_df), -1, dtype=np.int8)
+
+    # 全集团：只按销售规模计数
+    total = np.bincount(type_codes[type_codes >= 0], minlength=n_types)
+
+    valid = (type_codes >= 0) & (zone_codes >= 0)
+    flat = zone_codes[valid].astype(np.int64) * n_types + type_codes[valid]
+    matrix = np.bincount(flat, minlength=len(zones) * n_types).reshape(len(zones), n_types)
+
+    for i, zone in enumerate(zones):
+        if zone == "全集团":
+            matrix[i] = total
+
+    return pd.DataFrame(matrix, index=pd.Index(zones, name="提报战区"), columns=valid_types)
+
+
 def extract_manual_counts(row_data):
     """
     从数据行中提取手动输入的门店数量。
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+from src.core.fee_engine import (
+    compile_config,
+    lookup_range_coeffs,
+    return_coeff_matrix,
+    round_discount,
+    get_min_floor,
+    finalize_fees,
+)
+
+# 可模拟的条款字段 (与 calculate_fee 的 row_data 键一致)，顺序即结果表的列顺序
+SWEEP_FIELDS = [
+    "同一供应商单次引进SKU数",
+    "预估毛利率(%)",
+    "付款方式",
+    "底价",
+    "退货条件",
+    "退货比例(%)",
+    "供应商类型",
+]
+
+NUMERIC_SWEEP_FIELDS = ["同一供应商单次引进SKU数", "预估毛利率(%)", "底价", "退货比例(%)"]
+
+_FIELD_DEFAULTS = {
+    "同一供应商单次引进SKU数": 1,
+    "预估毛利率(%)": 0,
+    "底价": 0,
+    "退货比例(%)": 0.0,
+}
+
+
+def expand_sweep_values(spec):
+    """
+    将单个维度的模拟取值展开为列表。
+
+    Args:
+        spec: 取值列表，或 {'start', 'stop', 'step'} 区间 (含 stop)。
+    """
+    if isinstance(spec, dict):
+        start, stop, step = float(spec["start"]), float(spec["stop"]), float(spec.get("step", 1))
+        if step <= 0:
+            raise ValueError(f"步长必须大于0: {step}")
+        n = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 10) for i in range(max(n, 0))]
+    if isinstance(spec, (list, tuple, np.ndarray, pd.Series)):
+        return list(spec)
+    return [spec]
+
+
+def parse_sweep_text(text):
+    """
+    解析界面输入的数值取值：'30,35,40' 为列表，'30:60:5' 为区间 (含终点)。
+    """
+    text = str(text).strip().replace("，", ",").replace("：", ":")
+    if not text:
+        return []
+    if ":" in text:
+        parts = [p.strip() for p in text.split(":")]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"区间格式应为 起始:结束[:步长]，实际为 '{text}'")
+        spec = {"start": parts[0], "stop": parts[1], "step": parts[2] if len(parts) == 3 else 1}
+        return expand_sweep_values(spec)
+    return [float(p) for p in text.split(",") if p.strip()]
+
+
+def sweep_fees(row_data, store_counts, config, sweep_spec, compiled=None):
+    """
+    在固定门店数量下，对多个条款维度的笛卡尔积一次性向量化计算最终费用。
+
+    每个维度只对自身的取值查一次系数，再按 calculate_fee 的连乘顺序广播到整个网格，
+    因此 10^5 个网格点也只需若干次数组运算。
+
+    Args:
+        row_data: 基准条款 (同 calculate_fee)，未模拟的维度取其中的值。
+        store_counts: dict of {store_type: count}
+        config: loaded configuration dict
+        sweep_spec: {字段名: 取值列表或区间}，字段见 SWEEP_FIELDS。
+        compiled: (可选) compile_config 的结果，批量调用时可复用。
+
+    Returns:
+        DataFrame: 每个网格点一行，包含各维度取值、折扣、折后费用、是否触发兜底。
+    """
+    unknown = set(sweep_spec) - set(SWEEP_FIELDS)
+    if unknown:
+        raise ValueError(f"不支持模拟的字段: {sorted(unknown)}")
+
+    if compiled is None:
+        compiled = compile_config(config)
+
+    category = row_data.get("新品大类")
+    procurement_type = row_data.get("统采or地采", "统采")
+
+    # 1. 各维度取值 (未模拟的维度只有一个取值)
+    axes = {}
+    for field in SWEEP_FIELDS:
+        if field in sweep_spec:
+            values = expand_sweep_values(sweep_spec[field])
+            if not values:
+                raise ValueError(f"字段 '{field}' 没有可模拟的取值")
+        else:
+            values = [row_data.get(field, _FIELD_DEFAULTS.get(field))]
+        axes[field] = values
+
+    shape = tuple(len(axes[f]) for f in SWEEP_FIELDS)
+    ndim = len(shape)
+
+    def along(field, arr):
+        # 将某一维度的系数数组 reshape 为可在网格上广播的形状
+        axis = SWEEP_FIELDS.index(field)
+        view_shape = [1] * ndim
+        view_shape[axis] = len(arr)
+        return np.asarray(arr, dtype=float).reshape(view_shape)
+
+    # 2. 基础费用只与门店数有关，对整个网格是常数
+    base_fees_config = compiled["base_fees"].get(category, {})
+    theoretical_fee = 0
+    for store_type, count in store_counts.items():
+        if count > 0:
+            theoretical_fee += base_fees_config.get(store_type, 0) * count
+
+    # 3. 逐维度查系数
+    sku_table = compiled["sku"].get(category)
+    sku_values = np.asarray(axes["同一供应商单次引进SKU数"], dtype=float)
+    sku_coeffs = lookup_range_coeffs(sku_values, sku_table) if sku_table else np.ones(len(sku_values))
+    margin_values = np.asarray(axes["预估毛利率(%)"], dtype=float)
+    margin_coeffs = lookup_range_coeffs(margin_values, compiled["margin"])
+    payment_coeffs = [compiled["payment"].get(p, 1.0) for p in axes["付款方式"]]
+    cost_coeffs = lookup_range_coeffs(axes["底价"], compiled["cost"])
+    supplier_coeffs = [compiled["supplier"].get(s, 1.0) for s in axes["供应商类型"]]
+
+    ret_matrix = return_coeff_matrix(axes["退货条件"], axes["退货比例(%)"], compiled)
+    ret_shape = [1] * ndim
+    ret_shape[SWEEP_FIELDS.index("退货条件")] = len(axes["退货条件"])
+    ret_shape[SWEEP_FIELDS.index("退货比例(%)")] = len(axes["退货比例(%)"])
+
+    # 4. 按 calculate_fee 的顺序连乘
+    discount = np.full(shape, 1.0)
+    discount = discount * along("同一供应商单次引进SKU数", sku_coeffs)
+    discount = discount * along("预估毛利率(%)", margin_coeffs)
+    discount = discount * along("付款方式", payment_coeffs)
+    discount = discount * along("底价", cost_coeffs)
+    discount = discount * ret_matrix.reshape(ret_shape)
+    discount = discount * along("供应商类型", supplier_coeffs)
+
+    # 特殊免单：养生中药 & 毛利率>=65%，折扣置0且免保底
+    min_floor = np.full(shape, float(get_min_floor(category, procurement_type, compiled)))
+    if category == "养生中药":
+        exempt = np.broadcast_to(along("预估毛利率(%)", margin_values >= 65) > 0, shape)
+        discount = np.where(exempt, 0.0, discount)
+        min_floor = np.where(exempt, 0.0, min_floor)
+
+    discount = round_discount(discount)
+    final_fee, is_floor_triggered = finalize_fees(theoretical_fee, discount, min_floor)
+
+    # 5. 展开为结果表
+    grid_index = np.indices(shape).reshape(ndim, -1)
+    result = pd.DataFrame({
+        field: np.asarray(axes[field], dtype=float if field in NUMERIC_SWEEP_FIELDS else object)[grid_index[i]]
+        for i, field in enumerate(SWEEP_FIELDS)
+    })
+    result["理论总新品铺货费 (元)"] = theoretical_fee
+    result["折扣"] = discount.reshape(-1)
+    result["折后总新品铺货费 (元)"] = final_fee.reshape(-1)
+    result["是否触发兜底"] = is_floor_triggered.reshape(-1)
+    return result
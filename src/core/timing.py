@@ -0,0 +1,208 @@
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# 通过环境变量 XP_FEE_TIMING=1 开启全局计时 (结构化日志 + 指标文件)。
+# 未开启且当前线程没有采集中的 run 时，span() 直接返回共享的空对象，开销接近于零。
+_ENABLED = os.environ.get("XP_FEE_TIMING", "").strip().lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("xp_fee.timing")
+
+
+class _ThreadState(threading.local):
+    # 类属性作为默认值，避免 getattr(..., default) 在属性缺失时走异常路径
+    run = None
+    depth = 0
+
+
+_local = _ThreadState()
+_stats_lock = threading.Lock()
+_stage_stats = {}  # {stage: [count, sum_seconds, max_seconds]}
+_last_flush = 0.0
+
+
+def set_timing_enabled(enabled: bool):
+    """开启或关闭全局计时。"""
+    global _ENABLED
+    _ENABLED = bool(enabled)
+
+
+def is_timing_enabled() -> bool:
+    return _ENABLED
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "labels", "start", "run", "slot", "depth")
+
+    def __init__(self, name, labels, run):
+        self.name = name
+        self.labels = labels
+        self.run = run
+
+    def __enter__(self):
+        if self.run is not None:
+            # 进入时占位，保证明细按开始顺序排列；嵌套深度用于界面缩进
+            self.depth = _local.depth
+            _local.depth = self.depth + 1
+            self.slot = len(self.run)
+            self.run.append(None)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.run is not None:
+            _local.depth = self.depth
+            self.run[self.slot] = {"stage": self.name, "depth": self.depth, "ms": elapsed * 1000, **self.labels}
+        if _ENABLED:
+            _record(self.name, elapsed, self.labels)
+        return False
+
+
+def _record(stage, seconds, labels):
+    with _stats_lock:
+        stats = _stage_stats.setdefault(stage, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+    logger.info(json.dumps({"event": "stage_timing", "stage": stage, "ms": round(seconds * 1000, 3), **labels}, ensure_ascii=False, default=str))
+
+
+def span(name, **labels):
+    """
+    计时上下文管理器：with span("calc_auto_counts.filters"): ...
+    labels 会写入结构化日志和当前 run 的明细。
+    """
+    run = _local.run
+    if not _ENABLED and run is None:
+        return _NULL_SPAN
+    return _Span(name, labels, run)
+
+
+def timed(name=None):
+    """
+    计时装饰器，默认以函数名作为阶段名。
+    """
+    def decorator(func):
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED and _local.run is None:
+                return func(*args, **kwargs)
+            with _Span(stage, {}, _local.run):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_run(collect=False):
+    """
+    开始采集当前线程的一次运行 (如一次 Streamlit rerun) 的阶段明细。
+    全局计时未开启且 collect=False 时不采集。
+    """
+    _local.depth = 0
+    _local.run = [] if (collect or _ENABLED) else None
+
+
+def is_run_active() -> bool:
+    """当前线程是否有采集中的 run。"""
+    return _local.run is not None
+
+
+def finish_run():
+    """
+    结束当前线程的采集，返回阶段明细列表 [{stage, depth, ms, ...}]。
+    """
+    run = _local.run
+    _local.run = None
+    _local.depth = 0
+    return [item for item in (run or []) if item is not None]
+
+
+def get_stage_stats() -> dict:
+    """返回进程内各阶段的累计统计 {stage: {count, sum_seconds, max_seconds}}。"""
+    with _stats_lock:
+        return {
+            stage: {"count": c, "sum_seconds": s, "max_seconds": m}
+            for stage, (c, s, m) in _stage_stats.items()
+        }
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_prometheus(extra_counters=None) -> str:
+    """
+    以 Prometheus 文本格式输出各阶段耗时统计。
+
+    Args:
+        extra_counters: (可选) {指标名: 数值}，如结果缓存命中数，原样追加为 gauge。
+    """
+    lines = [
+        "# HELP xp_fee_stage_seconds Stage latency in seconds.",
+        "# TYPE xp_fee_stage_seconds summary",
+    ]
+    stats = get_stage_stats()
+    for stage, item in sorted(stats.items()):
+        label = f'{{stage="{_escape_label(stage)}"}}'
+        lines.append(f"xp_fee_stage_seconds_sum{label} {item['sum_seconds']:.6f}")
+        lines.append(f"xp_fee_stage_seconds_count{label} {item['count']}")
+    lines.append("# HELP xp_fee_stage_seconds_max Maximum stage latency in seconds.")
+    lines.append("# TYPE xp_fee_stage_seconds_max gauge")
+    for stage, item in sorted(stats.items()):
+        lines.append(f'xp_fee_stage_seconds_max{{stage="{_escape_label(stage)}"}} {item["max_seconds"]:.6f}')
+    for metric, value in (extra_counters or {}).items():
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path, extra_counters=None, min_interval=5.0):
+    """
+    将指标写入本地文本文件 (原子替换)，供 node_exporter textfile collector 等采集。
+    两次写入间隔小于 min_interval 秒时跳过；全局计时未开启时不写。
+    临时文件在同一目录下以唯一文件名创建，多个线程或进程同时写入时互不覆盖。
+    """
+    global _last_flush
+    if not _ENABLED:
+        return False
+    with _stats_lock:
+        now = time.monotonic()
+        if now - _last_flush < min_interval:
+            return False
+        _last_flush = now
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(render_prometheus(extra_counters))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
@@ -0,0 +1,178 @@
+"""
+服务启动预热。
+
+Streamlit 的缓存加载函数 (get_config / get_store_master / ...) 只在第一个用户访问时才解析 Excel、构建索引，
+重启后的第一个用户要等待全部加载完成。main.py 在启动 Streamlit 服务之前调用 warm_up：
+加载配置、门店主数据、门店索引 (含全部列编码) 和参考数据包 (处方映射、黑名单、区域表、维度元数据)，
+检查标准价目表 / 共享索引快照，并完成一次标准通道报价，记录各阶段耗时和 "启动 → 首次计算" 耗时。
+
+结果按 (名称, 路径, mtime) 登记在进程级的预热表中；app.py 的缓存加载函数未命中时通过 warm_or_load 取用
+(取用后即从预热表移除，不额外占用内存)，文件在预热后发生变化时 mtime 不同，照常重新加载。
+"""
+import os
+import threading
+import time
+
+# 预热的数据文件 (相对项目根目录)，与 app.py 中的路径一致
+DATA_FILES = {
+    "config": os.path.join("config", "coefficients.xlsx"),
+    "store_master": os.path.join("data", "store_master.xlsx"),
+    "xp_mapping": os.path.join("data", "处方类别与批文分类表.xlsx"),
+    "blacklist": os.path.join("data", "新品费剔除门店黑名单.xlsx"),
+}
+
+_WARM = {}
+_WARM_LOCK = threading.Lock()
+
+
+def _key(name, path, mtime):
+    return name, os.path.abspath(path), mtime
+
+
+def _mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else 0
+
+
+def put_warm(name, path, mtime, value):
+    with _WARM_LOCK:
+        _WARM[_key(name, path, mtime)] = value
+
+
+def warm_or_load(name, path, mtime, loader):
+    """取用预热结果 (路径和 mtime 都一致时)，否则调用 loader() 加载。"""
+    key = _key(name, path, mtime)
+    with _WARM_LOCK:
+        if key in _WARM:
+            return _WARM.pop(key)
+    return loader()
+
+
+def warm_up(project_root, started_at=None) -> dict:
+    """
+    预热全部数据并完成一次报价。任一阶段失败只打印 Warning，不阻止服务启动。
+
+    Args:
+        started_at: (可选) 进程启动时的 time.perf_counter()，用于计算 "启动 → 首次计算" 耗时。
+
+    Returns:
+        dict: {"stages": {阶段: 毫秒}, "first_calculation_seconds": 秒 (首次计算失败时为 None)}
+    """
+    started_at = time.perf_counter() if started_at is None else started_at
+    paths = {name: os.path.join(project_root, rel) for name, rel in DATA_FILES.items()}
+    stages = {}
+    loaded = {}
+
+    def stage(name, func):
+        t0 = time.perf_counter()
+        try:
+            loaded[name] = func()
+        except Exception as e:
+            print(f"Warning: 预热 {name} 失败: {e}")
+            loaded[name] = None
+        stages[name] = round((time.perf_counter() - t0) * 1000, 1)
+        return loaded[name]
+
+    def load_file(name, loader, required=False):
+        path = paths[name]
+        if not os.path.exists(path):
+            if required:
+                print(f"Warning: 预热跳过 {name}，文件不存在: {path}")
+            return None
+        value = stage(name, lambda: loader(path))
+        if value is not None:
+            put_warm(name, path, _mtime(path), value)
+        return value
+
+    # 核心模块在这里才导入 (pandas / openpyxl)，main.py 本身保持轻量
+    t0 = time.perf_counter()
+    from src.core.calculator import calculate_fee
+    from src.core.channel_rules import DEFAULT_CHANNEL_OPTIONS
+    from src.core.config_loader import load_config
+    from src.core.file_utils import get_file_version
+    from src.core.price_list import ensure_price_list, price_list_version
+    from src.core.store_index import StoreIndex
+    from src.core.reference_bundle import DEFAULT_BUNDLE, load_reference_bundle, reference_version, source_paths
+    from src.core.store_manager import load_store_master_compact
+    stages["imports"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    config = load_file("config", load_config, required=True)
+    store_master_df = load_file("store_master", load_store_master_compact, required=True)
+
+    # 处方映射、黑名单、区域表和维度词表：一个参考数据包 (过期的部分在这里重新编译并写回)
+    reference_sources = source_paths(project_root)
+    bundle_path = os.environ.get("XP_FEE_REFERENCE_BUNDLE", os.path.join(project_root, DEFAULT_BUNDLE))
+    reference_ver = reference_version(reference_sources)
+    bundle = stage("reference_bundle", lambda: load_reference_bundle(reference_sources, bundle_path))
+    if bundle is not None:
+        put_warm("reference_bundle", bundle_path, reference_ver, bundle)
+    reference = bundle["data"] if bundle is not None else {}
+    xp_map = reference.get("xp_mapping") or {}
+    blacklist_df = reference.get("blacklist")
+
+    store_index = None
+    if store_master_df is not None:
+        def build_index():
+            index = StoreIndex(store_master_df)
+            # 计算全部列编码 (与发布共享快照相同)，筛选和实时预览首次使用时不再逐列编码
+            index.export()
+            return index
+
+        store_index = stage("store_index", build_index)
+
+        snapshot_root = os.environ.get("XP_FEE_SNAPSHOT_DIR")
+        snapshot = None
+        if snapshot_root and store_index is not None:
+            from src.core.snapshot import ensure_store_snapshot
+            snapshot = stage("store_snapshot", lambda: ensure_store_snapshot(
+                snapshot_root, get_file_version(paths["store_master"]), lambda: store_master_df
+            ))
+        # 快照可用时 app.py 使用快照索引，不会取用进程内索引；只在不使用快照时登记，避免常驻两份索引
+        if store_index is not None and snapshot is None:
+            put_warm("store_index", paths["store_master"], _mtime(paths["store_master"]), store_index)
+
+    if config is not None and store_index is not None:
+        price_list_path = os.environ.get(
+            "XP_FEE_PRICE_LIST", os.path.join(project_root, "data", "standard_price_list.sqlite")
+        )
+        version = price_list_version({name: paths[name] for name in ("config", "store_master", "xp_mapping", "blacklist")})
+        stage("price_list", lambda: ensure_price_list(
+            price_list_path, version, lambda: (store_index, config, xp_map, blacklist_df)
+        ))
+
+    first_calculation_seconds = None
+    if config is not None and store_index is not None and config.get("base_fees"):
+        def first_calculation():
+            category = next(iter(config["base_fees"]))
+            xp_category = sorted(xp_map)[0] if xp_map else None
+            channel = DEFAULT_CHANNEL_OPTIONS[0]
+            counts = store_index.calc_counts(
+                channel,
+                restricted_xp_code=xp_map.get(xp_category),
+                war_zone=config.get("war_zones", ["全集团"])[0],
+                blacklist_df=blacklist_df,
+                selected_xp_category=xp_category,
+                category=category,
+            )
+            row_data = {
+                "新品大类": category,
+                "统采or地采": "统采",
+                "处方类别": xp_category,
+                "同一供应商单次引进SKU数": 1,
+                "channel": channel,
+                "预估毛利率(%)": 40.0,
+                "付款方式": next(iter(config.get("payment_coeffs", {})), None),
+                "供应商类型": next(iter(config.get("supplier_type_coeffs", {})), None),
+                "底价": 10.0,
+                "退货条件": next(iter(config.get("return_policy_coeffs", {})), None),
+                "退货比例(%)": 0.0,
+            }
+            return calculate_fee(row_data, counts, config)
+
+        if stage("first_calculation", first_calculation) is not None:
+            first_calculation_seconds = round(time.perf_counter() - started_at, 3)
+
+    detail = ", ".join(f"{name} {ms:.0f}ms" for name, ms in stages.items())
+    print(f"🔥 预热完成: {detail}")
+    if first_calculation_seconds is not None:
+        print(f"⏱️ 启动 → 首次计算: {first_calculation_seconds:.2f}s")
+    return {"stages": stages, "first_calculation_seconds": first_calculation_seconds}
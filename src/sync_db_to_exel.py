@@ -1,10 +1,12 @@
-import pandas as pd
-import pymysql
 import os
-from sqlalchemy import create_engine
 import json
+import sys
+import argparse
 from urllib.parse import quote_plus  # 新增：用于处理密码中的特殊字符
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pandas / sqlalchemy / 核心模块在 sync_data 中才导入，--help 和参数错误时不必等待
+
 # 异步操作脚本，不在main.py内，
 # 门店基础表，取上月最后一天的门店表来做门店基础表，
 # 从数据库加载到本地excel，提高前端响应速度
@@ -49,14 +51,28 @@ SELECT  shop_code                    AS `门店sapid`
        ,is_med_insu_shop             AS `是否医保店`
        ,is_op_coor_shop              AS `是否统筹店`
 FROM xp_dist_fee_shop_tag_dfp
-WHERE dt = LAST_DAY(DATE_SUB(CURDATE(), INTERVAL 1 MONTH)) 
+WHERE dt = {dt}
 """
 
-def sync_data():
+# 默认同步上月最后一天的门店表
+DEFAULT_DT_EXPR = "LAST_DAY(DATE_SUB(CURDATE(), INTERVAL 1 MONTH))"
+
+def sync_data(dt=None, history_only=False):
     """
     Connects to MySQL, executes the query, and saves the result to an Excel file.
+
+    Args:
+        dt: (可选) 指定门店表日期 YYYY-MM-DD，默认上月最后一天。
+        history_only: 只保存该日期的历史快照 (补录历史月份)，不覆盖当前门店表。
     """
     print("🚀 Starting database sync...")
+    import pandas as pd
+    import pymysql  # noqa: F401  (SQLAlchemy 的 mysql+pymysql 驱动)
+    from sqlalchemy import create_engine, text
+    from src.core.price_list import refresh_price_list
+    from src.core.reference_bundle import refresh_reference_bundle
+    from src.core.store_history import previous_month_end, save_store_snapshot
+    from src.core.store_diff import write_snapshot_diff
     
     # 1. 对密码进行转义处理，防止密码中的 '@' 等特殊字符导致解析错误
     safe_password = quote_plus(DB_CONFIG['password'])
@@ -70,7 +86,10 @@ def sync_data():
         
         # 3. Execute Query & Load into DataFrame
         print("📥 Fetching data from MySQL...")
-        df = pd.read_sql(SQL_QUERY, engine)
+        if dt:
+            df = pd.read_sql(text(SQL_QUERY.format(dt=":dt")), engine, params={"dt": dt})
+        else:
+            df = pd.read_sql(text(SQL_QUERY.format(dt=DEFAULT_DT_EXPR)), engine)
         
         # 4. Data Transformation (Optional)
         row_count = len(df)
@@ -80,11 +99,29 @@ def sync_data():
             print("⚠️ Warning: No data found for the specified period.")
             return
 
-        # 5. Save to Excel
         # Ensure the data directory exists
         current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         data_dir = os.path.join(current_dir, "data")
         os.makedirs(data_dir, exist_ok=True)
+
+        # 5. 按 dt 保留压缩后的历史快照 (用于按日期回溯报价)
+        history_root = os.environ.get("XP_FEE_HISTORY_DIR", os.path.join(data_dir, "store_history"))
+        snapshot_dt = dt or previous_month_end()
+        print(f"💾 Saving store snapshot {snapshot_dt} to {history_root}...")
+        # 快照目录名为规整后的日期 (--dt 可为 YYYYMMDD)
+        snapshot_dt = os.path.basename(save_store_snapshot(df, history_root, snapshot_dt))
+        try:
+            diff = write_snapshot_diff(history_root, snapshot_dt)
+            if diff is None:
+                print("ℹ️ No previous snapshot, diff report skipped.")
+            else:
+                print(f"📊 Diff vs {diff['上期日期']}: 新增 {diff['新增']}, 移除 {diff['移除']}, "
+                      f"销售规模变化 {diff['销售规模变化']}, 新增受限编码 {diff['新增受限编码']} ({diff['耗时秒']}s)")
+        except Exception as e:
+            print(f"⚠️ Warning: diff report failed: {e}")
+        if history_only:
+            print("🎉 History snapshot saved (current store master unchanged).")
+            return
         
         # 表1：门店信息表
         output_path = os.path.join(data_dir, "store_master.xlsx")
@@ -122,6 +159,22 @@ def sync_data():
         
         with open(metadata_path, "w", encoding="utf-8") as f:
             json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+        # 参考数据包：region_map 和 dim_metadata 已更新，重新编译这两部分 (其余部分沿用)
+        print("💾 Refreshing reference bundle...")
+        try:
+            bundle = refresh_reference_bundle(os.path.dirname(data_dir))
+            print(f"✅ Reference bundle: rebuilt {', '.join(bundle['rebuilt']) or 'nothing'}")
+        except Exception as e:
+            print(f"⚠️ Warning: reference bundle not refreshed (will be rebuilt on first use): {e}")
+
+        # 8. 标准通道价目表：门店表已更新，重建预计算的 (新品大类, 处方类别, 通道, 战区, 统采/地采) 报价表
+        print("💾 Rebuilding standard price list...")
+        try:
+            price_list = refresh_price_list()
+            print(f"✅ Price list: {price_list.meta.get('n_rows')} rows -> {price_list.path}")
+        except Exception as e:
+            print(f"⚠️ Warning: price list not rebuilt (will be rebuilt on first use): {e}")
         
         print("🎉 Sync completed successfully!")
         
@@ -129,4 +182,8 @@ def sync_data():
         print(f"❌ Error during sync: {e}")
 
 if __name__ == "__main__":
-    sync_data()
+    parser = argparse.ArgumentParser(description="同步门店表")
+    parser.add_argument("--dt", default=None, help="门店表日期 YYYY-MM-DD，默认上月最后一天")
+    parser.add_argument("--history-only", action="store_true", help="只保存历史快照，不覆盖当前门店表")
+    args = parser.parse_args()
+    sync_data(dt=args.dt, history_only=args.history_only)
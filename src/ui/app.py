@@ -1,10 +1,13 @@
 import streamlit as st
 import pandas as pd
+import altair as alt
 import base64
 import os
 import sys
 import json
-from io import BytesIO
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 
 # --- Path Setup ---
@@ -15,9 +18,25 @@ if project_root not in sys.path:
     sys.path.append(project_root)
 
 from src.core.config_loader import load_config
-from src.core.store_manager import load_store_master, calc_auto_counts, extract_manual_counts, load_xp_mapping, load_store_blacklist
-from src.core.calculator import calculate_fee
-from src.core.file_utils import read_excel_safe
+from src.core.store_manager import load_store_master_compact, calc_war_zone_counts, extract_manual_counts
+from src.core.calculator import calculate_fee, calculate_fee_matrix
+from src.core.batch_calculator import calculate_batch
+from src.core.batch_validation import validate_batch
+from src.core.channel_rules import get_default_channel, DEFAULT_CHANNEL_OPTIONS
+from src.core.file_utils import read_excel_safe, get_file_version
+from src.core.result_cache import cached_calc_auto_counts, get_result_cache
+from src.core.result_store import get_batch_result_store
+from src.core.quote_audit import get_quote_audit_log
+from src.core.timing import span, start_run, finish_run, is_run_active, write_metrics_file
+from src.core.sweep import sweep_fees, parse_sweep_text, SWEEP_FIELDS
+from src.core.solver import solve_threshold, describe_ranges, SOLVABLE_FIELDS
+from src.core.store_index import RegionHierarchy, StoreIndex, FilterMaskState
+from src.core.snapshot import ensure_store_snapshot
+from src.core.price_list import ensure_price_list, price_list_version
+from src.core.store_history import get_store_history
+from src.core.region_breakdown import quote_region_breakdown, rollup_breakdown, SHARE_COLUMN
+from src.core.warmup import warm_or_load
+from src.core.reference_bundle import DEFAULT_BUNDLE, load_reference_bundle, reference_version, source_paths
 
 # --- Feature Toggle ---
 # 设置为 False 临时禁用批量计算器（tab2），解决文件加密问题后可恢复为 True
@@ -29,32 +48,75 @@ st.set_page_config(page_title="新品铺货费计算器", page_icon="💰", layo
 # Load Config with Cache
 @st.cache_data(show_spinner=False)
 def get_config(path, mtime):
-    return load_config(path)
+    return warm_or_load("config", path, mtime, lambda: load_config(path))
 
-@st.cache_data(show_spinner=False)
+@st.cache_resource(show_spinner=False)
 def get_store_master(path, mtime):
-    return load_store_master(path)
+    """压缩后的门店主数据，每个快照 (路径 + mtime) 加载一次，所有会话共享同一份 (只读，不得原地修改)。"""
+    return warm_or_load("store_master", path, mtime, lambda: load_store_master_compact(path))
 
-@st.cache_data(show_spinner=False)
-def get_xp_mapping(path, mtime):
-    return load_xp_mapping(path)
+@st.cache_resource(show_spinner=False)
+def get_reference_data(version):
+    """
+    参考数据包 (处方映射、黑名单、区域层级、维度词表)，一次读取；version 为各源文件版本的组合，
+    任一源文件变化时重新加载，load_reference_bundle 只重新编译变化的部分。只读共享。
+    """
+    bundle_path = os.environ.get("XP_FEE_REFERENCE_BUNDLE", os.path.join(project_root, DEFAULT_BUNDLE))
+    bundle = warm_or_load(
+        "reference_bundle", bundle_path, version,
+        lambda: load_reference_bundle(source_paths(project_root), bundle_path),
+    )
+    if bundle["rebuilt"]:
+        print(f"参考数据包已更新: {', '.join(bundle['rebuilt'])}")
+    return bundle["data"]
 
-@st.cache_data(show_spinner=False)
-def get_store_blacklist(path, mtime):
-    return load_store_blacklist(path)
+@st.cache_resource(show_spinner=False)
+def get_region_hierarchy(path, mtime):
+    """
+    没有 region_map 时从门店主数据构建区域层级索引，每个快照 (路径 + mtime) 构建一次，只读共享。
+    """
+    return RegionHierarchy(get_store_master(path, mtime))
 
-@st.cache_data(show_spinner=False)
-def get_region_map(path, mtime):
-    if os.path.exists(path):
-        return pd.read_excel(path, engine='openpyxl')
-    return None
+@st.cache_resource(show_spinner=False)
+def get_local_store_index(path, mtime):
+    """门店主数据索引 (实时预览用)，每个快照构建一次，只读共享。"""
+    return warm_or_load("store_index", path, mtime, lambda: StoreIndex(get_store_master(path, mtime)))
 
-@st.cache_data(show_spinner=False)
-def get_dim_metadata(path, mtime):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return None
+def get_store_index(path, mtime):
+    """
+    设置了 XP_FEE_SNAPSHOT_DIR 时，多个 worker 进程共享同一份内存映射的索引快照
+    (按门店文件版本发布一次，其余进程只读挂载；挂载的是本进程门店文件对应的版本，进程内按版本缓存)；
+    否则使用进程内索引。
+    """
+    snapshot_root = os.environ.get("XP_FEE_SNAPSHOT_DIR")
+    if snapshot_root:
+        try:
+            index = ensure_store_snapshot(snapshot_root, get_file_version(path), lambda: get_store_master(path, mtime))
+            if index is not None:
+                return index
+        except Exception as e:
+            print(f"Warning: 门店索引快照不可用，使用进程内索引: {e}")
+    return get_local_store_index(path, mtime)
+
+@st.cache_resource(show_spinner=False)
+def get_price_list(version, store_master_path, reference_version):
+    """
+    标准通道价目表 (每个数据版本一份)。门店主数据、系数配置、处方映射或黑名单变化时 version 随之变化，
+    ensure_price_list 发现文件中的版本不一致即重建；不可用时返回 None，单品计算退回实时统计。
+    """
+    path = os.environ.get("XP_FEE_PRICE_LIST", os.path.join(project_root, "data", "standard_price_list.sqlite"))
+
+    def loader():
+        sm_mtime = os.path.getmtime(store_master_path)
+        reference = get_reference_data(reference_version)
+        return (get_store_index(store_master_path, sm_mtime), config,
+                reference["xp_mapping"], reference["blacklist"])
+
+    try:
+        return ensure_price_list(path, version, loader)
+    except Exception as e:
+        print(f"Warning: 标准通道价目表不可用，使用实时统计: {e}")
+        return None
 
 try:
     config_path = os.path.join(project_root, "config", "coefficients.xlsx")
@@ -65,137 +127,785 @@ except Exception as e:
     st.stop()
 
 # ============================================================
-# 标准通道智能联动辅助函数
+# 条款模拟 (What-if) 面板
 # ============================================================
 
-def is_payment_term_gte_60(payment_method: str) -> bool:
+def render_sweep_heatmap(heat_df, x_field, y_field):
     """
-    判断付款方式的账期是否>=60天
-    
-    Args:
-        payment_method: 付款方式字符串
-    
-    Returns:
-        True if 账期>=60天 or 实销月结, else False
+    折后费用热力图 (颜色深浅表示费用高低，格内标注费用)。坐标轴按模拟取值的顺序排列。
     """
-    if pd.isna(payment_method):
-        return False
-    
-    payment_str = str(payment_method).strip()
-    
-    # 实销月结等同于>=60天
-    if '实销月结' in payment_str:
-        return True
-    
-    # 提取票到天数
-    import re
-    match = re.search(r'票到(\d+)天', payment_str)
-    if match:
-        days = int(match.group(1))
-        return days >= 60
-    
-    # 特殊处理"票到90天以上"
-    if '票到90天以上' in payment_str or '账期天数>=60天' in payment_str:
-        return True
-    
-    return False
+    fee_col = "折后总新品铺货费 (元)"
+    heat = heat_df.drop_duplicates([x_field, y_field])
+
+    def axis_label(value):
+        # 整数取值 (模拟结果中为浮点) 显示为 5 而不是 5.0
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    # 列名可能含括号、百分号等，统一换成简单字段名，标题仍显示原列名
+    chart_df = pd.DataFrame({
+        "x": heat[x_field].map(axis_label).to_numpy(),
+        "y": heat[y_field].map(axis_label).to_numpy(),
+        "fee": heat[fee_col].round(0).to_numpy(),
+    })
+    x_order = list(dict.fromkeys(chart_df["x"]))
+    y_order = list(dict.fromkeys(chart_df["y"]))
+    base = alt.Chart(chart_df).encode(
+        x=alt.X("x:O", sort=x_order, title=x_field),
+        y=alt.Y("y:O", sort=y_order, title=y_field),
+    )
+    cells = base.mark_rect().encode(
+        color=alt.Color("fee:Q", title="折后费用 (元)", scale=alt.Scale(scheme="orangered")),
+        tooltip=[alt.Tooltip("x:O", title=x_field), alt.Tooltip("y:O", title=y_field),
+                 alt.Tooltip("fee:Q", title=fee_col, format=",.0f")],
+    )
+    labels = base.mark_text(fontSize=11).encode(text=alt.Text("fee:Q", format=",.0f"))
+    return (cells + labels).properties(height=max(160, 32 * len(y_order)))
 
 
-def classify_return_policy(return_policy: str, return_ratio: float) -> str:
+@st.fragment
+def render_sweep_panel(config):
     """
-    对退货条件进行分类
-    
-    Args:
-        return_policy: 退货条件
-        return_ratio: 退货比例（纯数字 0-100）
-    
-    Returns:
-        'full_return_100' | 'partial_return' | 'other'
+    基于最近一次计算的门店数，对多个条款维度做笛卡尔积模拟，并展示热力图和明细表。
     """
-    if pd.isna(return_policy):
-        return 'other'
-    
-    policy_str = str(return_policy).strip()
-    
-    # 效期可退相关
-    is_expiry_return = '效期可退' in policy_str
-    
-    if is_expiry_return:
-        if return_ratio == 100:
-            return 'full_return_100'  # 效期可退100%
+    last_calc = st.session_state.get("last_calc")
+    with st.expander("🔁 条款模拟 (What-if)", expanded=False):
+        if not last_calc:
+            st.caption("请先点击【开始计算】，模拟将基于该次计算的门店数量进行。")
+            return
+
+        row_data = last_calc["row_data"]
+        store_counts = last_calc["store_counts"]
+        st.caption(f"门店数量固定为最近一次计算结果 (共 {sum(store_counts.values()):,} 家)；留空的维度取当前输入值。")
+
+        c1, c2 = st.columns(2)
+        with c1:
+            margin_text = st.text_input("预估毛利率(%)", placeholder="如 30:60:1 或 35,40,45", key="sweep_margin")
+            sku_text = st.text_input("同一供应商单次引进SKU数", placeholder="如 1:20", key="sweep_sku")
+            ratio_text = st.text_input("退货比例(%)", placeholder="如 0:100:10", key="sweep_ratio")
+        with c2:
+            cost_text = st.text_input("底价", placeholder="如 5,20,50,100", key="sweep_cost")
+            payments = st.multiselect("付款方式", list(config.get("payment_coeffs", {}).keys()), key="sweep_payment")
+            all_policies = sorted(set(config.get("return_policy_coeffs", {})) | set(config.get("return_ratio_rules", {})))
+            policies = st.multiselect("退货条件", all_policies, key="sweep_policy")
+        suppliers = st.multiselect("供应商类型", list(config.get("supplier_type_coeffs", {}).keys()), key="sweep_supplier")
+
+        try:
+            sweep_spec = {}
+            for field, text in [
+                ("预估毛利率(%)", margin_text),
+                ("同一供应商单次引进SKU数", sku_text),
+                ("底价", cost_text),
+                ("退货比例(%)", ratio_text),
+            ]:
+                values = parse_sweep_text(text)
+                if values:
+                    sweep_spec[field] = values
+            for field, values in [("付款方式", payments), ("退货条件", policies), ("供应商类型", suppliers)]:
+                if values:
+                    sweep_spec[field] = values
+        except ValueError as e:
+            st.error(f"取值格式有误: {e}")
+            return
+
+        if not sweep_spec:
+            st.caption("请至少填写一个需要模拟的维度。")
+            return
+
+        swept_fields = [f for f in SWEEP_FIELDS if f in sweep_spec]
+        if len(swept_fields) >= 2:
+            h1, h2 = st.columns(2)
+            with h1: x_field = st.selectbox("热力图横轴", swept_fields, index=0, key="sweep_x")
+            with h2: y_field = st.selectbox("热力图纵轴", [f for f in swept_fields if f != x_field], index=0, key="sweep_y")
         else:
-            return 'partial_return'    # 效期可退[0%,100)
-    
-    # 其他退货条件
-    return 'other'
+            x_field, y_field = swept_fields[0], None
+
+        if st.button("开始模拟", use_container_width=True):
+            try:
+                sweep_df = sweep_fees(row_data, store_counts, config, sweep_spec)
+            except Exception as e:
+                st.error(f"模拟出错: {e}")
+                return
+
+            st.caption(f"共 {len(sweep_df):,} 个组合")
+            if y_field:
+                # 热力图只展示两个维度，其余被模拟的维度取第一个取值
+                heat_df = sweep_df
+                for field in swept_fields:
+                    if field not in (x_field, y_field):
+                        heat_df = heat_df[heat_df[field] == heat_df[field].iloc[0]]
+                if len(swept_fields) > 2:
+                    st.caption("热力图中其余维度取第一个取值")
+                st.altair_chart(render_sweep_heatmap(heat_df, x_field, y_field), use_container_width=True)
+            display_cols = swept_fields + ["折扣", "折后总新品铺货费 (元)", "是否触发兜底"]
+            st.dataframe(sweep_df[display_cols], use_container_width=True, hide_index=True)
 
 
-def is_medicine_category(category: str) -> bool:
+@st.fragment
+def render_solver_panel(config):
     """
-    判断是否为中西成药
-    
-    Args:
-        category: 新品大类
-    
+    目标费用反推：其他条款不变，求某个数值条款在哪些取值区间内费用不超过目标。
+    """
+    last_calc = st.session_state.get("last_calc")
+    with st.expander("🎯 目标费用反推", expanded=False):
+        if not last_calc:
+            st.caption("请先点击【开始计算】，反推将基于该次计算的门店数量和条款进行。")
+            return
+
+        c1, c2 = st.columns(2)
+        with c1:
+            solve_field = st.selectbox("反推条款", list(SOLVABLE_FIELDS.keys()), key="solver_field")
+        with c2:
+            target_fee = st.number_input("目标费用上限 (元)", min_value=0, value=10000, step=100, key="solver_target")
+
+        if st.button("开始反推", use_container_width=True):
+            try:
+                solved = solve_threshold(last_calc["row_data"], last_calc["store_counts"], config, solve_field, target_fee)
+            except Exception as e:
+                st.error(f"反推出错: {e}")
+                return
+
+            if solved["feasible"]:
+                low = int(min(r["min_fee"] for r in solved["ranges"]))
+                high = int(max(r["max_fee"] for r in solved["ranges"]))
+                fee_text = f"{low:,}" if low == high else f"{low:,} ~ {high:,}"
+                st.success(
+                    f"{solve_field} 取 {describe_ranges(solved['ranges'])} 时，费用为 {fee_text} 元，不超过目标 {target_fee:,} 元"
+                )
+            else:
+                st.warning(f"{solve_field} 在任何取值下费用均高于目标 {target_fee:,} 元")
+            st.dataframe(solved["segments"], use_container_width=True, hide_index=True)
+
+
+# ============================================================
+# 单品计算器 (fragment)
+# ============================================================
+
+def render_region_filter(region_hierarchy):
+    """
+    省公司/省份/城市 级联筛选，选项由预构建的 RegionHierarchy 通过集合运算得到。
+
     Returns:
-        True if 中西成药, else False
+        dict: {省公司, 省份, 城市: 已选列表}
     """
-    if pd.isna(category):
-        return False
-    
-    category_str = str(category).strip()
-    return '中西成药' in category_str
+    selected_filters = {}
+    with st.expander("选择省公司/省份/城市", expanded=True):
+        col_reg1, col_reg2, col_reg3 = st.columns(3)
+        if "filter_company" not in st.session_state: st.session_state["filter_company"] = []
+        if "filter_province" not in st.session_state: st.session_state["filter_province"] = []
+        if "filter_city" not in st.session_state: st.session_state["filter_city"] = []
+        options = region_hierarchy.options({
+            "省公司": st.session_state["filter_company"],
+            "省份": st.session_state["filter_province"],
+            "城市": st.session_state["filter_city"],
+        })
+        opts_company, opts_province, opts_city = options["省公司"], options["省份"], options["城市"]
+        def sanitize(current, valid):
+            valid = set(valid)
+            return [x for x in current if x in valid]
+        st.session_state["filter_company"] = sanitize(st.session_state["filter_company"], opts_company)
+        st.session_state["filter_province"] = sanitize(st.session_state["filter_province"], opts_province)
+        st.session_state["filter_city"] = sanitize(st.session_state["filter_city"], opts_city)
+        with col_reg1: selected_filters["省公司"] = st.multiselect("省公司", options=opts_company, key="filter_company", placeholder="全部 (默认)")
+        with col_reg2: selected_filters["省份"] = st.multiselect("省份", options=opts_province, key="filter_province", placeholder="全部 (默认)")
+        with col_reg3: selected_filters["城市"] = st.multiselect("城市", options=opts_city, key="filter_city", placeholder="全部 (默认)")
 
+    return selected_filters
 
-def get_default_channel(return_policy: str, 
-                       return_ratio: float,
-                       payment_method: str, 
-                       category: str) -> str:
+
+def render_filter_preview(store_index, selected_filters, preview):
     """
-    根据业务规则获取默认标准通道
-    
-    Args:
-        return_policy: 退货条件
-        return_ratio: 退货比例（纯数字 0-100）
-        payment_method: 付款方式
-        category: 新品大类
-    
+    实时预览当前筛选条件下各销售规模的门店数及折后费用。
+
+    会话内保存一个 FilterMaskState，只重算取值发生变化的筛选维度；
+    筛选条件与上次完全相同时 (如面板因其他控件重跑) 直接复用上次结果。
+    """
+    state = st.session_state.get("filter_mask_state")
+    if state is None or state.index is not store_index:
+        state = FilterMaskState(store_index)
+        st.session_state["filter_mask_state"] = state
+
+    war_zone = st.session_state.get("selected_war_zone", preview["default_war_zone"])
+    signature = repr((sorted(selected_filters.items()), war_zone, preview["row_data"], preview["restricted_xp_code"],
+                      preview["selected_xp_category"]))
+    cached = st.session_state.get("filter_preview")
+    if cached and cached["signature"] == signature and cached["index_id"] == id(store_index):
+        counts, result, elapsed_ms = cached["counts"], cached["result"], cached["elapsed_ms"]
+    else:
+        started = time.perf_counter()
+        with span("app.filter_preview"):
+            counts = store_index.calc_counts(
+                "自定义",
+                restricted_xp_code=preview["restricted_xp_code"],
+                war_zone=war_zone,
+                filters=selected_filters,
+                blacklist_df=preview["blacklist_df"],
+                selected_xp_category=preview["selected_xp_category"],
+                category=preview["row_data"]["新品大类"],
+                state=state,
+            )
+            result = calculate_fee(preview["row_data"], counts, preview["config"])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        st.session_state["filter_preview"] = {
+            "signature": signature, "index_id": id(store_index),
+            "counts": counts, "result": result, "elapsed_ms": elapsed_ms,
+        }
+
+    st.caption(
+        f"📊 实时预览 ({war_zone})：{sum(counts.values()):,} 家门店 | "
+        f"预估折后费用 {int(result['final_fee']):,} 元 | {elapsed_ms:.0f} ms"
+    )
+    st.dataframe(pd.DataFrame([counts]), use_container_width=True, hide_index=True)
+
+
+@st.fragment
+def render_tag_filter_panel(region_hierarchy, dim_metadata, store_index, preview):
+    """
+    自定义通道的标签筛选面板 (区域级联 + 门店属性) 及实时门店数预览。
+    作为独立 fragment，修改筛选条件只重跑本面板。
+
     Returns:
-        标准通道选项: 全量门店 | 小店及以上 | 中店及以上 | 大店及以上 | 旗舰店及以上 | 超级旗舰店
+        dict: 选中的筛选条件，结构同 calc_auto_counts 的 filters。
     """
-    policy_type = classify_return_policy(return_policy, return_ratio)
-    is_long_term = is_payment_term_gte_60(payment_method)
-    is_medicine = is_medicine_category(category)
-    is_prepaid = '预付款' in str(payment_method) if not pd.isna(payment_method) else False
-    
-    # 规则1: 效期可退100%
-    if policy_type == 'full_return_100':
-        if is_long_term:
-            return "全量门店"
+    selected_filters = render_region_filter(region_hierarchy)
+
+    with st.expander("门店属性筛选", expanded=True):
+        sales_scale_opts = dim_metadata["销售规模"] if dim_metadata else ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+        selected_filters["销售规模"] = st.multiselect("销售规模", sales_scale_opts, default=[], placeholder="全部 (默认)")
+        col_attr1, col_attr2 = st.columns(2)
+        with col_attr1:
+            opts = dim_metadata["店龄店型"] if dim_metadata else []
+            selected_filters["店龄店型"] = st.multiselect("店龄店型", opts, placeholder="全部 (默认)")
+        with col_attr2:
+            opts = dim_metadata["客流商圈"] if dim_metadata else []
+            selected_filters["客流商圈"] = st.multiselect("客流商圈", opts, placeholder="全部 (默认)")
+        col_attr3, col_attr4 = st.columns(2)
+        with col_attr3:
+            opts = dim_metadata["行政区划等级"] if dim_metadata else []
+            selected_filters["行政区划等级"] = st.multiselect("行政区划等级", opts, placeholder="全部 (默认)")
+        with col_attr4:
+            opts = dim_metadata["公域O2O店型"] if dim_metadata else []
+            selected_filters["公域O2O店型"] = st.multiselect("公域O2O店型", opts, placeholder="全部 (默认)")
+        st.markdown("---")
+        col_bool1, col_bool2, col_bool3 = st.columns(3)
+        insurance_opts = ["全部"] + (dim_metadata.get("是否医保店", ["是", "否"]) if dim_metadata else ["是", "否"])
+        o2o_opts = ["全部"] + (dim_metadata.get("是否O2O门店", ["是", "否"]) if dim_metadata else ["是", "否"])
+        coor_opts = ["全部"] + (dim_metadata.get("是否统筹店", ["是", "否"]) if dim_metadata else ["是", "否"])
+        with col_bool1: selected_filters["是否医保店"] = st.selectbox("是否医保店", insurance_opts)
+        with col_bool2: selected_filters["是否O2O门店"] = st.selectbox("是否O2O门店", o2o_opts)
+        with col_bool3: selected_filters["是否统筹店"] = st.selectbox("是否统筹店", coor_opts)
+
+    if store_index is not None and st.toggle("实时预览门店数", value=True, key="filter_preview_enabled"):
+        with fragment_timing():
+            render_filter_preview(store_index, selected_filters, preview)
+    return selected_filters
+
+
+def get_quote_user():
+    """报价用户 (审计日志和批量结果的归属)：启用了登录时为登录邮箱，否则为本会话的随机标识。"""
+    try:
+        email = st.user.get("email")
+    except Exception:
+        email = None
+    if email:
+        return email
+    if "quote_audit_user" not in st.session_state:
+        st.session_state.quote_audit_user = f"session:{uuid.uuid4().hex}"
+    return st.session_state.quote_audit_user
+
+
+def render_recent_quotes():
+    """本用户最近的报价 (来自审计日志)。"""
+    with st.expander("🕘 最近报价"):
+        try:
+            recent_df = get_quote_audit_log().recent_quotes(get_quote_user(), limit=20)
+        except Exception as e:
+            print(f"Warning: 无法读取报价审计日志: {e}")
+            recent_df = None
+        if recent_df is None or recent_df.empty:
+            st.caption("暂无报价记录")
+            return
+        recent_df = recent_df.rename(columns={
+            "created_at": "时间", "category": "新品大类", "supplier_type": "供应商类型",
+            "procurement_type": "统采or地采", "channel": "铺货通道", "war_zone": "提报战区",
+            "xp_category": "处方类别", "store_count": "门店数", "final_fee": "折后总新品铺货费 (元)",
+        })
+        recent_df["时间"] = recent_df["时间"].dt.strftime("%Y-%m-%d %H:%M:%S")
+        st.dataframe(
+            recent_df[["时间", "新品大类", "统采or地采", "处方类别", "铺货通道", "提报战区", "供应商类型", "门店数", "折后总新品铺货费 (元)"]],
+            use_container_width=True, hide_index=True,
+        )
+
+
+@st.fragment
+def render_single_item_calculator(config, store_master_df, store_index, region_hierarchy, dim_metadata, xp_map,
+                                   store_blacklist_df, config_version, store_version, price_list=None):
+    """
+    单品计算器：输入条款、通道选择、计算结果，以及条款模拟/反推面板。
+
+    作为独立 fragment 运行，修改条款只重跑本函数 (含结果卡片)，不再重跑整页的样式、
+    文件检查和数据加载；标签筛选面板、条款模拟和反推是嵌套的 fragment，各自只重跑自身。
+    单独重跑时 main() 不执行，阶段耗时由 fragment_timing 在这里采集。
+    """
+    with fragment_timing():
+        _render_single_item_calculator(config, store_master_df, store_index, region_hierarchy, dim_metadata, xp_map,
+                                       store_blacklist_df, config_version, store_version, price_list)
+
+
+def _render_single_item_calculator(config, store_master_df, store_index, region_hierarchy, dim_metadata, xp_map,
+                                   store_blacklist_df, config_version, store_version, price_list=None):
+    with st.container(border=True):
+        st.markdown("<div style='font-size: 18px; font-weight: bold; margin-bottom: 10px;'>📝 通道计算器 -- 输入信息</div>", unsafe_allow_html=True)
+
+        procurement_type = st.selectbox(
+            "统采or地采", 
+            ["统采", "地采"],
+            index=0,
+        )
+
+        c1, c2 = st.columns(2)
+        with c1:
+            category = st.selectbox("新品大类", list(config["base_fees"].keys()))       
+        with c2:
+            supplier_type = st.selectbox("供应商类型", list(config["supplier_type_coeffs"].keys()))
+
+        # --- 动态布局逻辑开始 ---
+        # 1. 准备选项
+        all_return_policies = list(config["return_policy_coeffs"].keys()) 
+        complex_policies = list(config.get("return_ratio_rules", {}).keys())
+        all_return_policies = sorted(list(set(all_return_policies + complex_policies)))
+
+        # 2. 预判布局：检查 session_state 或使用默认值
+        # 如果这是第一次渲染，st.session_state 还没有这个 key，我们取列表第一个作为默认
+        current_policy_val = st.session_state.get("widget_return_policy", all_return_policies[0])
+        is_complex_policy = current_policy_val in complex_policies
+
+        # 3. 动态定义列：如果是复杂条件，这行分3列；否则分2列
+        if is_complex_policy:
+            # 比例调整：SKU(1) : 退货条件(1.2) : 退货比例(0.8)
+            c3, c4, c4_extra = st.columns([1, 1.2, 0.8])
         else:
-            return "小店及以上"
-    
-    # 规则2: 效期可退[0%,100)
-    elif policy_type == 'partial_return':
-        if is_prepaid:
-            return "大店及以上"
-        elif is_long_term:
-            return "全量门店" if is_medicine else "小店及以上"
-        else:  # 账期<60天
-            return "小店及以上" if is_medicine else "大店及以上"
-    
-    # 规则3: 其他退货条件
-    else:
-        if is_long_term:
-            return "小店及以上" if is_medicine else "大店及以上"
+            c3, c4 = st.columns(2)
+            c4_extra = None
+
+        with c3:
+            sku_count = st.number_input("同一供应商单次引进SKU数", min_value=1, value=1)
+
+        with c4:
+            # 注意：必须设置 key，以便在 rerun 时能通过 session_state 获取最新值
+            return_policy = st.selectbox("退货条件", all_return_policies, key="widget_return_policy")
+
+        return_ratio_val = 0.0
+        if c4_extra:
+            with c4_extra:
+                # 更加简洁的 Label，不需要 st.info 干扰
+                return_ratio_val = st.number_input(
+                    "退货比例 (%)", 
+                    min_value=0.0, 
+                    max_value=100.0, 
+                    value=100.0,
+                    step=0.1,
+                    # 使用 help 替代 info
+                    help="请输入比例以匹配折扣档位"
+                )
+        # --- 动态布局逻辑结束 ---
+
+        c5, c6 = st.columns(2)
+        with c5:
+            cost_price = st.number_input("底价 (元)", min_value=0.0, value=10.0)
+        with c6:
+            gross_margin = st.number_input("预估成交综合毛利率 (%)", min_value=0.0, max_value=100.0, value=40.0)               
+        c7, c8 = st.columns(2)
+        with c7:
+            payment = st.selectbox("付款方式", list(config["payment_coeffs"].keys()))
+        with c8:
+            if xp_map:
+                xp_options = sorted(list(xp_map.keys()))
+            else:
+                xp_options = ["无 (未找到映射表)"]
+            selected_xp_category = st.selectbox("处方类别", xp_options)
+
+        target_xp_code = xp_map.get(selected_xp_category) if xp_map else None
+
+        st.markdown("""
+                    <div style="
+                        font-size: 16px; 
+                        font-weight: 600; 
+                        margin-bottom: 0px; 
+                        color: #31333F;
+                    ">
+                        通道选择
+                    </div>
+                """, unsafe_allow_html=True)
+        channel_mode = st.radio(
+            "通道模式",
+            ["标准通道", "自定义通道"],
+            label_visibility="collapsed",
+            horizontal=True
+        )
+
+        channel = "自定义"
+        custom_sub_mode = "手动输入"
+        manual_counts = {}
+        selected_filters = {}
+
+        if "标准通道" in channel_mode:
+            # 💡 智能推荐：根据三因素计算默认通道
+            recommended_channel = get_default_channel(
+                return_policy=return_policy,
+                return_ratio=return_ratio_val,
+                payment_method=payment,
+                category=category
+            )
+
+            # 获取默认选项的索引
+            channel_options = DEFAULT_CHANNEL_OPTIONS
+            try:
+                default_index = channel_options.index(recommended_channel)
+            except ValueError:
+                default_index = 0  # 兜底：默认全量门店
+
+            color_selection = st.selectbox(
+                "选择标准通道范围",
+                channel_options,
+                index=default_index,
+                label_visibility="collapsed",
+                help=f"💡 智能推荐: {recommended_channel}"
+            )
+            channel = color_selection.split()[-1] 
         else:
-            return "大店及以上"
+            channel = "自定义"
+            try:
+                custom_sub_mode = st.segmented_control(
+                    "自定义输入方式",
+                    ["标签筛选", "手动输入"],
+                    default="标签筛选",
+                    label_visibility="collapsed"
+                )
+            except AttributeError:
+                custom_sub_mode = st.radio(
+                    "自定义输入方式:",
+                    ["标签筛选", "手动输入"],
+                    horizontal=True,
+                    label_visibility="collapsed"
+                )
+
+            if custom_sub_mode == "手动输入":
+                st.caption("请输入各销售规模门店数量:")
+                col_inputs = st.columns(6)
+                with col_inputs[0]: manual_counts["超级旗舰店"] = st.number_input("超级旗舰店", min_value=0, key="custom_super")
+                with col_inputs[1]: manual_counts["旗舰店"] = st.number_input("旗舰店", min_value=0, key="custom_flag")
+                with col_inputs[2]: manual_counts["大店"] = st.number_input("大店", min_value=0, key="custom_big")
+                with col_inputs[3]: manual_counts["中店"] = st.number_input("中店", min_value=0, key="custom_mid")
+                with col_inputs[4]: manual_counts["小店"] = st.number_input("小店", min_value=0, key="custom_small")
+                with col_inputs[5]: manual_counts["成长店"] = st.number_input("成长店", min_value=0, key="custom_grow")
+            else:
+                st.caption("请选择筛选条件 (为空表示全选)")
+                if region_hierarchy is not None:
+                    selected_filters.update(render_tag_filter_panel(
+                        region_hierarchy,
+                        dim_metadata,
+                        store_index,
+                        preview={
+                            "config": config,
+                            "row_data": {
+                                "新品大类": category,
+                                "统采or地采": procurement_type,
+                                "同一供应商单次引进SKU数": sku_count,
+                                "预估毛利率(%)": gross_margin,
+                                "付款方式": payment,
+                                "供应商类型": supplier_type,
+                                "底价": cost_price,
+                                "退货条件": return_policy,
+                                "退货比例(%)": return_ratio_val,
+                            },
+                            "restricted_xp_code": target_xp_code,
+                            "blacklist_df": store_blacklist_df,
+                            "selected_xp_category": selected_xp_category,
+                            "default_war_zone": config.get("war_zones", ["全集团"])[0],
+                        },
+                    ))
+
+        st.markdown("""
+                    <div style="
+                        font-size: 16px; 
+                        font-weight: 400; 
+                        margin-bottom: 5px; 
+                        margin-top: 10px;
+                        color: #31333F;
+                    ">
+                        战区选择(如果选中一个战区，只会计算该战区中的门店)
+                    </div>
+                """, unsafe_allow_html=True)
+
+        war_zone_options = config.get("war_zones", ["全集团"])
+        selected_war_zone = st.selectbox("选择战区", war_zone_options, label_visibility="collapsed", key="selected_war_zone")
+        show_war_zone_matrix = st.checkbox(
+            "按战区查看",
+            help="一次计算所有战区的门店数与费用 (手动输入门店数时不适用)"
+        )
+
+    if st.button("开始计算", type="primary", use_container_width=True):
+        needs_master_data = (channel != "自定义") or (custom_sub_mode == "标签筛选")
+
+        if needs_master_data and store_master_df is None:
+            st.error("❌ 未找到门店主数据，无法进行自动计算！")
+        else:
+            row_data = {
+                "新品大类": category,
+                "统采or地采": procurement_type,
+                "处方类别": selected_xp_category,
+                "同一供应商单次引进SKU数": sku_count,
+                "channel": channel,
+                "预估毛利率(%)": gross_margin,
+                "付款方式": payment,
+                "供应商类型": supplier_type,
+                "底价": cost_price,
+                "退货条件": return_policy,
+                "退货比例(%)": return_ratio_val # [新增] 传入比例
+            }
+            if channel == "自定义" and custom_sub_mode == "手动输入":
+                for k, v in manual_counts.items():
+                    row_data[f"(自定义){k}数"] = v
+
+            try:
+                with span("app.calculate"):
+                    store_counts = {}
+                    excluded_count = 0
+                    is_auto_calc_mode = False
+                    war_zone_fee_df = None
+
+                    if channel == "自定义" and custom_sub_mode == "手动输入":
+                        store_counts = extract_manual_counts(row_data)
+                    elif channel == "自定义" and custom_sub_mode == "标签筛选":
+                        is_auto_calc_mode = True
+                        store_counts = cached_calc_auto_counts(
+                            store_master_df,
+                            channel,
+                            config_version,
+                            store_version,
+                            restricted_xp_code=target_xp_code,
+                            war_zone=selected_war_zone,
+                            filters=selected_filters,
+                            blacklist_df=store_blacklist_df,
+                            selected_xp_category=selected_xp_category,
+                            category=category,
+                        )
+                        # 计算剔除数：用无任何限制的原始数 - 最终数
+                        raw_counts = cached_calc_auto_counts(
+                            store_master_df,
+                            channel,
+                            config_version,
+                            store_version,
+                            restricted_xp_code=None,
+                            war_zone=selected_war_zone,
+                            filters=selected_filters,
+                        )
+                        excluded_count = sum(raw_counts.values()) - sum(store_counts.values())
+                    else:
+                        is_auto_calc_mode = True
+                        # 标准通道优先查预计算的价目表，查不到 (如战区不在配置中) 时实时统计
+                        price_entry = price_list.lookup(
+                            category, selected_xp_category, channel, selected_war_zone, procurement_type
+                        ) if price_list is not None else None
+                        if price_entry is not None:
+                            store_counts = price_entry["counts"]
+                            excluded_count = price_entry["excluded_count"]
+                        else:
+                            store_counts = cached_calc_auto_counts(
+                                store_master_df,
+                                channel,
+                                config_version,
+                                store_version,
+                                restricted_xp_code=target_xp_code,
+                                war_zone=selected_war_zone,
+                                blacklist_df=store_blacklist_df,
+                                selected_xp_category=selected_xp_category,
+                                category=category,
+                            )
+                            # 计算剔除数：用无任何限制的原始数 - 最终数
+                            raw_counts = cached_calc_auto_counts(
+                                store_master_df,
+                                channel,
+                                config_version,
+                                store_version,
+                                restricted_xp_code=None,
+                                war_zone=selected_war_zone,
+                            )
+                            excluded_count = sum(raw_counts.values()) - sum(store_counts.values())
+
+                    if show_war_zone_matrix and is_auto_calc_mode:
+                        zone_counts_df = None
+                        if channel != "自定义" and price_list is not None:
+                            zone_counts_df = price_list.zone_counts(
+                                category, selected_xp_category, channel, war_zone_options, procurement_type
+                            )
+                        if zone_counts_df is None:
+                            zone_counts_df = calc_war_zone_counts(
+                                store_master_df,
+                                channel,
+                                war_zone_options,
+                                restricted_xp_code=target_xp_code,
+                                filters=selected_filters if channel == "自定义" else None,
+                                blacklist_df=store_blacklist_df,
+                                selected_xp_category=selected_xp_category,
+                                category=category,
+                            )
+                        war_zone_fee_df = calculate_fee_matrix(row_data, zone_counts_df, config)
+
+                    result = calculate_fee(row_data, store_counts, config)
+                    st.session_state["last_calc"] = {"row_data": row_data, "store_counts": store_counts}
+                    # 审计日志只入队，由后台线程批量写入
+                    try:
+                        get_quote_audit_log().record(
+                            get_quote_user(), row_data, store_counts, result, config_version, store_version,
+                            war_zone=selected_war_zone,
+                        )
+                    except Exception as e:
+                        print(f"Warning: 报价审计记录失败: {e}")
+
+                    # 按 省公司/省份/城市 拆分折后费用 (手动输入门店数时没有门店明细)
+                    region_breakdown_df = None
+                    if is_auto_calc_mode and store_index is not None:
+                        try:
+                            with span("app.region_breakdown"):
+                                region_breakdown_df = quote_region_breakdown(
+                                    store_index,
+                                    result,
+                                    config,
+                                    category,
+                                    channel,
+                                    restricted_xp_code=target_xp_code,
+                                    war_zone=selected_war_zone,
+                                    filters=selected_filters if channel == "自定义" else None,
+                                    blacklist_df=store_blacklist_df,
+                                    selected_xp_category=selected_xp_category,
+                                )
+                        except Exception as e:
+                            print(f"Warning: 区域费用拆分失败: {e}")
+
+                with span("app.render_result"):
+                    with st.container(border=True):
+                        st.markdown("<div style='font-size: 18px; font-weight: bold; margin-bottom: 10px;'>🧾 通道计算器 -- 输出信息</div>", unsafe_allow_html=True)
+                        css_style = """
+                        <style>
+                            .metric-box { display: flex; flex-direction: column; align-items: center; justify-content: center; padding: 10px; }
+                            .metric-label { font-size: 0.9rem; color: #666; margin-bottom: 5px; }
+                            .metric-value { font-size: 1.8rem; font-weight: 700; }
+                        </style>
+                        """
+                        st.markdown(css_style, unsafe_allow_html=True)
+                        col_res1, col_res2, col_res3 = st.columns([1, 1, 1.2]) 
+                        with col_res1:
+                            st.markdown(f"""<div class="metric-box"><div class="metric-label">理论总新品铺货费(元)</div><div class="metric-value" style="color: #333;">{int(result['theoretical_fee']):,}</div></div>""", unsafe_allow_html=True)
+                        with col_res2:
+                            st.markdown(f"""<div class="metric-box"><div class="metric-label">折扣</div><div class="metric-value" style="color: #333;">{result['discount_factor']:.2f}</div></div>""", unsafe_allow_html=True)
+                        with col_res3:
+                            st.markdown(f"""<div class="metric-box"><div class="metric-label">折后总新品铺货费(元)</div><div class="metric-value" style="color: #D32F2F; ">{int(result['final_fee']):,}</div></div>""", unsafe_allow_html=True)
+                        if result.get('is_floor_triggered'):
+                            procurement = result.get('procurement_type', '未知标准')
+                            st.caption(f"⚠️ 已触发最低兜底费用 ({procurement}): {result['min_floor']}元")
+                        st.divider()
+                        st.markdown("🏬 门店分布")
+                        store_order = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
+                        store_data = {"销售规模": store_order, "门店数": [result['store_details'].get(t, 0) for t in store_order]}
+                        st.dataframe(pd.DataFrame(store_data), use_container_width=True, hide_index=True)
+                        total_stores = sum(result['store_details'].values())
+                        footer_text = f"计算池中的门店数量: {total_stores:,}"
+                        if is_auto_calc_mode and excluded_count > 0:
+                            footer_text += f" | 剔除门店数(受限): {excluded_count}"
+                        st.caption(footer_text)
+                        if war_zone_fee_df is not None:
+                            st.divider()
+                            st.markdown("🗺️ 按战区查看")
+                            zone_view_df = war_zone_fee_df[["门店数合计", "理论总新品铺货费 (元)", "折扣", "折后总新品铺货费 (元)"]].copy()
+                            zone_view_df["理论总新品铺货费 (元)"] = zone_view_df["理论总新品铺货费 (元)"].astype(int)
+                            zone_view_df["折后总新品铺货费 (元)"] = zone_view_df["折后总新品铺货费 (元)"].astype(int)
+                            st.dataframe(zone_view_df.reset_index(), use_container_width=True, hide_index=True)
+                        if region_breakdown_df is not None and len(region_breakdown_df) > 0:
+                            st.divider()
+                            st.markdown("🏙️ 按区域查看 (折后费用按门店理论费用分摊)")
+                            region_tabs = st.tabs(["省公司", "省份", "城市"])
+                            for region_tab, level in zip(region_tabs, ["省公司", "省份", "城市"]):
+                                with region_tab:
+                                    region_view_df = rollup_breakdown(region_breakdown_df, level).copy()
+                                    region_view_df[SHARE_COLUMN] = (region_view_df[SHARE_COLUMN] * 100).round(2).astype(str) + "%"
+                                    st.dataframe(region_view_df, use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"计算出错: {e}")
+
+    render_recent_quotes()
+    render_sweep_panel(config)
+    render_solver_panel(config)
+
 
 # ============================================================
 # 主应用入口
 # ============================================================
 
+def is_debug_mode() -> bool:
+    return st.query_params.get("debug") == "1"
+
+
+def render_debug_panel(timing_records=None, label="🛠️ 性能调试"):
+    """
+    隐藏的性能调试面板 (URL 加 ?debug=1 显示)：展示最近一次运行 (整页或 fragment 重跑) 各阶段耗时
+    和结果缓存命中情况。timing_records 为空时读取 st.session_state["last_timing"]。
+    """
+    if timing_records is None:
+        timing_records = st.session_state.get("last_timing", [])
+    with st.expander(label, expanded=False):
+        if timing_records:
+            timing_df = pd.DataFrame(timing_records)
+            timing_df["stage"] = timing_df.apply(lambda r: "　" * int(r["depth"]) + r["stage"], axis=1)
+            timing_df["ms"] = timing_df["ms"].round(2)
+            st.dataframe(timing_df[["stage", "ms"]], use_container_width=True, hide_index=True)
+        else:
+            st.caption("本次运行没有采集到阶段耗时。")
+        st.json(get_result_cache().stats())
+
+
+def write_timing_metrics():
+    """将阶段耗时和结果缓存指标写入本地 Prometheus 文本文件 (仅在 XP_FEE_TIMING=1 时生效)。"""
+    metrics_path = os.environ.get("XP_FEE_METRICS_FILE", os.path.join(project_root, "logs", "xp_fee_metrics.prom"))
+    cache_stats = get_result_cache().stats()
+    try:
+        write_metrics_file(metrics_path, extra_counters={
+            "xp_fee_result_cache_hits": cache_stats["hits"],
+            "xp_fee_result_cache_misses": cache_stats["misses"],
+            "xp_fee_result_cache_entries": cache_stats["entries"],
+            "xp_fee_result_cache_evictions": cache_stats["evictions"],
+        })
+    except OSError as e:
+        print(f"Warning: 写入指标文件失败: {e}")
+
+
+@contextmanager
+def fragment_timing():
+    """
+    fragment 单独重跑时 main() 不执行，其中的 start_run / finish_run、调试面板和指标写入都不会发生。
+    整页运行时 (main 已开始采集) 直接沿用 main 的 run；单独重跑时在这里开始和结束采集，
+    把明细存入 st.session_state["last_timing"]，在 fragment 内展示调试面板并写入指标文件。
+    """
+    if is_run_active():
+        yield
+        return
+    debug_mode = is_debug_mode()
+    start_run(collect=debug_mode)
+    try:
+        yield
+    finally:
+        st.session_state["last_timing"] = finish_run()
+    if debug_mode:
+        render_debug_panel(label="🛠️ 性能调试 (本次局部重跑)")
+    write_timing_metrics()
+
+
 def main():
+    debug_mode = is_debug_mode()
+    start_run(collect=debug_mode)
+
     # --- 优化后的混合布局 CSS ---
     st.markdown("""
         <style>
@@ -284,41 +994,58 @@ def main():
     st.markdown("<h2 style='text-align: center;'>新品铺货费计算器</h2>", unsafe_allow_html=True)
 
     # --- Data Loading (Auto) ---
-    store_master_path = os.path.join(project_root, "data", "store_master.xlsx")
-    region_map_path = os.path.join(project_root, "data", "region_map.xlsx")
-    metadata_path = os.path.join(project_root, "data", "dim_metadata.json")
+    with span("app.load_data"):
+        store_master_path = os.path.join(project_root, "data", "store_master.xlsx")
     
-    store_master_df = None
-    region_map_df = None
-    dim_metadata = None
-    update_time = "未知"
+        store_master_df = None
+        store_index = None
+        update_time = "未知"
 
-    if os.path.exists(store_master_path):
-        try:
-            sm_mtime = os.path.getmtime(store_master_path)
-            store_master_df = get_store_master(store_master_path, sm_mtime)
-            if "门店表更新时间" in store_master_df.columns:
-                update_time = str(store_master_df["门店表更新时间"].iloc[0])
-        except Exception as e:
-            st.error(f"加载门店数据失败: {e}")
+        if os.path.exists(store_master_path):
+            try:
+                sm_mtime = os.path.getmtime(store_master_path)
+                store_master_df = get_store_master(store_master_path, sm_mtime)
+                store_index = get_store_index(store_master_path, sm_mtime)
+                if "门店表更新时间" in store_master_df.columns:
+                    update_time = str(store_master_df["门店表更新时间"].iloc[0])
+            except Exception as e:
+                st.error(f"加载门店数据失败: {e}")
             
-    if os.path.exists(region_map_path):
-        rm_mtime = os.path.getmtime(region_map_path)
-        region_map_df = get_region_map(region_map_path, rm_mtime)
-        
-    if os.path.exists(metadata_path):
-        meta_mtime = os.path.getmtime(metadata_path)
-        dim_metadata = get_dim_metadata(metadata_path, meta_mtime)
+        # 处方映射、黑名单、区域表和维度词表来自同一个参考数据包 (src/core/reference_bundle.py)
+        reference_sources = source_paths(project_root)
+        reference_ver = reference_version(reference_sources)
+        reference = get_reference_data(reference_ver)
+        xp_map = reference["xp_mapping"]
+        store_blacklist_df = reference["blacklist"]
+        blacklist_path = reference_sources["blacklist"]
+
+        # 区域级联选项优先使用 region_map，不存在时从门店主数据构建
+        region_hierarchy = reference.get("region_hierarchy")
+        if region_hierarchy is None and store_master_df is not None:
+            try:
+                region_hierarchy = get_region_hierarchy(store_master_path, sm_mtime)
+            except ValueError as e:
+                print(f"Warning: 无法构建区域层级索引: {e}")
+
+        dim_metadata = reference.get("dim_metadata")
         if dim_metadata and "更新时间" in dim_metadata:
             update_time = dim_metadata["更新时间"]
-    
-    xp_mapping_path = os.path.join(project_root, "data", "处方类别与批文分类表.xlsx")
-    xp_map_mtime = os.path.getmtime(xp_mapping_path) if os.path.exists(xp_mapping_path) else 0
-    xp_map = get_xp_mapping(xp_mapping_path, xp_map_mtime)
 
-    blacklist_path = os.path.join(project_root, "data", "新品费剔除门店黑名单.xlsx")
-    bl_mtime = os.path.getmtime(blacklist_path) if os.path.exists(blacklist_path) else 0
-    store_blacklist_df = get_store_blacklist(blacklist_path, bl_mtime)
+        # 共享结果缓存的数据版本：配置变化或门店主数据/黑名单变化时缓存自动失效
+        config_version = get_file_version(config_path)
+        store_version = f"{get_file_version(store_master_path)}|{get_file_version(blacklist_path)}"
+
+        store_history = get_store_history(
+            os.environ.get("XP_FEE_HISTORY_DIR", os.path.join(project_root, "data", "store_history"))
+        )
+
+        price_list = None
+        if store_master_df is not None:
+            price_list = get_price_list(
+                price_list_version({"config": config_path, "store_master": store_master_path,
+                                    "xp_mapping": reference_sources["xp_mapping"], "blacklist": blacklist_path}),
+                store_master_path, reference_ver,
+            )
 
     # 显示隐藏式更新时间
     st.markdown(
@@ -349,328 +1076,27 @@ def main():
     # --- Tab 1: 单品计算器 ---
     with tab1:
         spacer_left, col_center, spacer_right = st.columns([1.5, 7, 1.5])
-        
+
         with col_center:
-            with st.container(border=True):
-                st.markdown("<div style='font-size: 18px; font-weight: bold; margin-bottom: 10px;'>📝 通道计算器 -- 输入信息</div>", unsafe_allow_html=True)
-                
-                procurement_type = st.selectbox(
-                    "统采or地采", 
-                    ["统采", "地采"],
-                    index=0,
+            # 选择历史日期时按当时的门店表统计 (核对费用变化)，不使用当前门店表的价目表
+            calc_store_master_df, calc_store_index, calc_store_version, calc_price_list = (
+                store_master_df, store_index, store_version, price_list
+            )
+            history_dates = store_history.dates()
+            if history_dates:
+                as_of = st.selectbox(
+                    "门店快照日期", ["最新"] + history_dates[::-1], key="store_snapshot_dt",
+                    help="选择历史日期时按当时的门店表计算门店数，用于核对费用为何变化",
                 )
-
-                c1, c2 = st.columns(2)
-                with c1:
-                    category = st.selectbox("新品大类", list(config["base_fees"].keys()))       
-                with c2:
-                    supplier_type = st.selectbox("供应商类型", list(config["supplier_type_coeffs"].keys()))
-
-                # --- 动态布局逻辑开始 ---
-                # 1. 准备选项
-                all_return_policies = list(config["return_policy_coeffs"].keys()) 
-                complex_policies = list(config.get("return_ratio_rules", {}).keys())
-                all_return_policies = sorted(list(set(all_return_policies + complex_policies)))
-                
-                # 2. 预判布局：检查 session_state 或使用默认值
-                # 如果这是第一次渲染，st.session_state 还没有这个 key，我们取列表第一个作为默认
-                current_policy_val = st.session_state.get("widget_return_policy", all_return_policies[0])
-                is_complex_policy = current_policy_val in complex_policies
-
-                # 3. 动态定义列：如果是复杂条件，这行分3列；否则分2列
-                if is_complex_policy:
-                    # 比例调整：SKU(1) : 退货条件(1.2) : 退货比例(0.8)
-                    c3, c4, c4_extra = st.columns([1, 1.2, 0.8])
-                else:
-                    c3, c4 = st.columns(2)
-                    c4_extra = None
-
-                with c3:
-                    sku_count = st.number_input("同一供应商单次引进SKU数", min_value=1, value=1)
-                
-                with c4:
-                    # 注意：必须设置 key，以便在 rerun 时能通过 session_state 获取最新值
-                    return_policy = st.selectbox("退货条件", all_return_policies, key="widget_return_policy")
-
-                return_ratio_val = 0.0
-                if c4_extra:
-                    with c4_extra:
-                        # 更加简洁的 Label，不需要 st.info 干扰
-                        return_ratio_val = st.number_input(
-                            "退货比例 (%)", 
-                            min_value=0.0, 
-                            max_value=100.0, 
-                            value=100.0,
-                            step=0.1,
-                            # 使用 help 替代 info
-                            help="请输入比例以匹配折扣档位"
-                        )
-                # --- 动态布局逻辑结束 ---
-
-                c5, c6 = st.columns(2)
-                with c5:
-                    cost_price = st.number_input("底价 (元)", min_value=0.0, value=10.0)
-                with c6:
-                    gross_margin = st.number_input("预估成交综合毛利率 (%)", min_value=0.0, max_value=100.0, value=40.0)               
-                c7, c8 = st.columns(2)
-                with c7:
-                    payment = st.selectbox("付款方式", list(config["payment_coeffs"].keys()))
-                with c8:
-                    if xp_map:
-                        xp_options = sorted(list(xp_map.keys()))
-                    else:
-                        xp_options = ["无 (未找到映射表)"]
-                    selected_xp_category = st.selectbox("处方类别", xp_options)
-
-                target_xp_code = xp_map.get(selected_xp_category) if xp_map else None
-                
-                st.markdown("""
-                            <div style="
-                                font-size: 16px; 
-                                font-weight: 600; 
-                                margin-bottom: 0px; 
-                                color: #31333F;
-                            ">
-                                通道选择
-                            </div>
-                        """, unsafe_allow_html=True)
-                channel_mode = st.radio(
-                    "通道模式",
-                    ["标准通道", "自定义通道"],
-                    label_visibility="collapsed",
-                    horizontal=True
-                )
-                
-                channel = "自定义"
-                custom_sub_mode = "手动输入"
-                manual_counts = {}
-                selected_filters = {}
-                
-                if "标准通道" in channel_mode:
-                    # 💡 智能推荐：根据三因素计算默认通道
-                    recommended_channel = get_default_channel(
-                        return_policy=return_policy,
-                        return_ratio=return_ratio_val,
-                        payment_method=payment,
-                        category=category
-                    )
-                    
-                    # 获取默认选项的索引
-                    channel_options = ["全量门店", "小店及以上", "中店及以上", "大店及以上", "旗舰店及以上", "超级旗舰店"]
-                    try:
-                        default_index = channel_options.index(recommended_channel)
-                    except ValueError:
-                        default_index = 0  # 兜底：默认全量门店
-                    
-                    color_selection = st.selectbox(
-                        "选择标准通道范围",
-                        channel_options,
-                        index=default_index,
-                        label_visibility="collapsed",
-                        help=f"💡 智能推荐: {recommended_channel}"
-                    )
-                    channel = color_selection.split()[-1] 
-                else:
-                    channel = "自定义"
-                    try:
-                        custom_sub_mode = st.segmented_control(
-                            "自定义输入方式",
-                            ["标签筛选", "手动输入"],
-                            default="标签筛选",
-                            label_visibility="collapsed"
-                        )
-                    except AttributeError:
-                        custom_sub_mode = st.radio(
-                            "自定义输入方式:",
-                            ["标签筛选", "手动输入"],
-                            horizontal=True,
-                            label_visibility="collapsed"
-                        )
-                    
-                    if custom_sub_mode == "手动输入":
-                        st.caption("请输入各销售规模门店数量:")
-                        col_inputs = st.columns(6)
-                        with col_inputs[0]: manual_counts["超级旗舰店"] = st.number_input("超级旗舰店", min_value=0, key="custom_super")
-                        with col_inputs[1]: manual_counts["旗舰店"] = st.number_input("旗舰店", min_value=0, key="custom_flag")
-                        with col_inputs[2]: manual_counts["大店"] = st.number_input("大店", min_value=0, key="custom_big")
-                        with col_inputs[3]: manual_counts["中店"] = st.number_input("中店", min_value=0, key="custom_mid")
-                        with col_inputs[4]: manual_counts["小店"] = st.number_input("小店", min_value=0, key="custom_small")
-                        with col_inputs[5]: manual_counts["成长店"] = st.number_input("成长店", min_value=0, key="custom_grow")
-                    else:
-                        st.caption("请选择筛选条件 (为空表示全选)")
-                        filter_df = region_map_df if region_map_df is not None else store_master_df
-                        if filter_df is not None:
-                            with st.expander("选择省公司/省份/城市", expanded=True):
-                                col_reg1, col_reg2, col_reg3 = st.columns(3)
-                                if "filter_company" not in st.session_state: st.session_state["filter_company"] = []
-                                if "filter_province" not in st.session_state: st.session_state["filter_province"] = []
-                                if "filter_city" not in st.session_state: st.session_state["filter_city"] = []
-                                sel_company = st.session_state["filter_company"]
-                                sel_province = st.session_state["filter_province"]
-                                sel_city = st.session_state["filter_city"]
-                                def get_mask(col_name, selected_values):
-                                    if not selected_values: return pd.Series(True, index=filter_df.index)
-                                    return filter_df[col_name].isin(selected_values)
-                                mask_company_cond = get_mask("省公司", sel_company)
-                                mask_province_cond = get_mask("省份", sel_province)
-                                mask_city_cond = get_mask("城市", sel_city)
-                                opts_company = sorted(filter_df[mask_province_cond & mask_city_cond]["省公司"].dropna().unique())
-                                opts_province = sorted(filter_df[mask_company_cond & mask_city_cond]["省份"].dropna().unique())
-                                opts_city = sorted(filter_df[mask_company_cond & mask_province_cond]["城市"].dropna().unique())
-                                def sanitize(current, valid): return [x for x in current if x in valid]
-                                st.session_state["filter_company"] = sanitize(st.session_state["filter_company"], opts_company)
-                                st.session_state["filter_province"] = sanitize(st.session_state["filter_province"], opts_province)
-                                st.session_state["filter_city"] = sanitize(st.session_state["filter_city"], opts_city)
-                                with col_reg1: selected_filters["省公司"] = st.multiselect("省公司", options=opts_company, key="filter_company", placeholder="全部 (默认)")
-                                with col_reg2: selected_filters["省份"] = st.multiselect("省份", options=opts_province, key="filter_province", placeholder="全部 (默认)")
-                                with col_reg3: selected_filters["城市"] = st.multiselect("城市", options=opts_city, key="filter_city", placeholder="全部 (默认)")
-                            
-                            with st.expander("门店属性筛选", expanded=True):
-                                sales_scale_opts = dim_metadata["销售规模"] if dim_metadata else ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
-                                selected_filters["销售规模"] = st.multiselect("销售规模", sales_scale_opts, default=[], placeholder="全部 (默认)")
-                                col_attr1, col_attr2 = st.columns(2)
-                                with col_attr1:
-                                    opts = dim_metadata["店龄店型"] if dim_metadata else []
-                                    selected_filters["店龄店型"] = st.multiselect("店龄店型", opts, placeholder="全部 (默认)")
-                                with col_attr2:
-                                    opts = dim_metadata["客流商圈"] if dim_metadata else []
-                                    selected_filters["客流商圈"] = st.multiselect("客流商圈", opts, placeholder="全部 (默认)")
-                                col_attr3, col_attr4 = st.columns(2)
-                                with col_attr3:
-                                    opts = dim_metadata["行政区划等级"] if dim_metadata else []
-                                    selected_filters["行政区划等级"] = st.multiselect("行政区划等级", opts, placeholder="全部 (默认)")
-                                with col_attr4:
-                                    opts = dim_metadata["公域O2O店型"] if dim_metadata else []
-                                    selected_filters["公域O2O店型"] = st.multiselect("公域O2O店型", opts, placeholder="全部 (默认)")
-                                st.markdown("---")
-                                col_bool1, col_bool2, col_bool3 = st.columns(3)
-                                insurance_opts = ["全部"] + (dim_metadata.get("是否医保店", ["是", "否"]) if dim_metadata else ["是", "否"])
-                                o2o_opts = ["全部"] + (dim_metadata.get("是否O2O门店", ["是", "否"]) if dim_metadata else ["是", "否"])
-                                coor_opts = ["全部"] + (dim_metadata.get("是否统筹店", ["是", "否"]) if dim_metadata else ["是", "否"])
-                                with col_bool1: selected_filters["是否医保店"] = st.selectbox("是否医保店", insurance_opts)
-                                with col_bool2: selected_filters["是否O2O门店"] = st.selectbox("是否O2O门店", o2o_opts)
-                                with col_bool3: selected_filters["是否统筹店"] = st.selectbox("是否统筹店", coor_opts)
-
-                st.markdown("""
-                            <div style="
-                                font-size: 16px; 
-                                font-weight: 400; 
-                                margin-bottom: 5px; 
-                                margin-top: 10px;
-                                color: #31333F;
-                            ">
-                                战区选择(如果选中一个战区，只会计算该战区中的门店)
-                            </div>
-                        """, unsafe_allow_html=True)
-                
-                war_zone_options = config.get("war_zones", ["全集团"])
-                selected_war_zone = st.selectbox("选择战区", war_zone_options, label_visibility="collapsed")
-
-            if st.button("开始计算", type="primary", use_container_width=True):
-                needs_master_data = (channel != "自定义") or (custom_sub_mode == "标签筛选")
-                
-                if needs_master_data and store_master_df is None:
-                    st.error("❌ 未找到门店主数据，无法进行自动计算！")
-                else:
-                    row_data = {
-                        "新品大类": category,
-                        "统采or地采": procurement_type,
-                        "处方类别": selected_xp_category,
-                        "同一供应商单次引进SKU数": sku_count,
-                        "channel": channel,
-                        "预估毛利率(%)": gross_margin,
-                        "付款方式": payment,
-                        "供应商类型": supplier_type,
-                        "底价": cost_price,
-                        "退货条件": return_policy,
-                        "退货比例(%)": return_ratio_val # [新增] 传入比例
-                    }
-                    if channel == "自定义" and custom_sub_mode == "手动输入":
-                        for k, v in manual_counts.items():
-                            row_data[f"(自定义){k}数"] = v
-
-                    try:
-                        store_counts = {}
-                        excluded_count = 0
-                        is_auto_calc_mode = False
-
-                        if channel == "自定义" and custom_sub_mode == "手动输入":
-                            store_counts = extract_manual_counts(row_data)
-                        elif channel == "自定义" and custom_sub_mode == "标签筛选":
-                            is_auto_calc_mode = True
-                            store_counts = calc_auto_counts(
-                                store_master_df, 
-                                channel, 
-                                restricted_xp_code=target_xp_code,
-                                war_zone=selected_war_zone,
-                                filters=selected_filters,
-                                blacklist_df=store_blacklist_df,
-                                selected_xp_category=selected_xp_category,
-                                category=category,
-                            )
-                            # 计算剔除数：用无任何限制的原始数 - 最终数
-                            raw_counts = calc_auto_counts(
-                                store_master_df,
-                                channel,
-                                restricted_xp_code=None,
-                                war_zone=selected_war_zone,
-                                filters=selected_filters,
-                            )
-                            excluded_count = sum(raw_counts.values()) - sum(store_counts.values())
-                        else:
-                            is_auto_calc_mode = True
-                            store_counts = calc_auto_counts(
-                                store_master_df, 
-                                channel, 
-                                restricted_xp_code=target_xp_code,
-                                war_zone=selected_war_zone,
-                                blacklist_df=store_blacklist_df,
-                                selected_xp_category=selected_xp_category,
-                                category=category,
-                            )
-                            # 计算剔除数：用无任何限制的原始数 - 最终数
-                            raw_counts = calc_auto_counts(
-                                store_master_df,
-                                channel,
-                                restricted_xp_code=None,
-                                war_zone=selected_war_zone,
-                            )
-                            excluded_count = sum(raw_counts.values()) - sum(store_counts.values())
-                        
-                        result = calculate_fee(row_data, store_counts, config)
-
-                        with st.container(border=True):
-                            st.markdown("<div style='font-size: 18px; font-weight: bold; margin-bottom: 10px;'>🧾 通道计算器 -- 输出信息</div>", unsafe_allow_html=True)
-                            css_style = """
-                            <style>
-                                .metric-box { display: flex; flex-direction: column; align-items: center; justify-content: center; padding: 10px; }
-                                .metric-label { font-size: 0.9rem; color: #666; margin-bottom: 5px; }
-                                .metric-value { font-size: 1.8rem; font-weight: 700; }
-                            </style>
-                            """
-                            st.markdown(css_style, unsafe_allow_html=True)
-                            col_res1, col_res2, col_res3 = st.columns([1, 1, 1.2]) 
-                            with col_res1:
-                                st.markdown(f"""<div class="metric-box"><div class="metric-label">理论总新品铺货费(元)</div><div class="metric-value" style="color: #333;">{int(result['theoretical_fee']):,}</div></div>""", unsafe_allow_html=True)
-                            with col_res2:
-                                st.markdown(f"""<div class="metric-box"><div class="metric-label">折扣</div><div class="metric-value" style="color: #333;">{result['discount_factor']:.2f}</div></div>""", unsafe_allow_html=True)
-                            with col_res3:
-                                st.markdown(f"""<div class="metric-box"><div class="metric-label">折后总新品铺货费(元)</div><div class="metric-value" style="color: #D32F2F; ">{int(result['final_fee']):,}</div></div>""", unsafe_allow_html=True)
-                            if result.get('is_floor_triggered'):
-                                procurement = result.get('procurement_type', '未知标准')
-                                st.caption(f"⚠️ 已触发最低兜底费用 ({procurement}): {result['min_floor']}元")
-                            st.divider()
-                            st.markdown("🏬 门店分布")
-                            store_order = ["超级旗舰店", "旗舰店", "大店", "中店", "小店", "成长店"]
-                            store_data = {"销售规模": store_order, "门店数": [result['store_details'].get(t, 0) for t in store_order]}
-                            st.dataframe(pd.DataFrame(store_data), use_container_width=True, hide_index=True)
-                            total_stores = sum(result['store_details'].values())
-                            footer_text = f"计算池中的门店数量: {total_stores:,}"
-                            if is_auto_calc_mode and excluded_count > 0:
-                                footer_text += f" | 剔除门店数(受限): {excluded_count}"
-                            st.caption(footer_text)
-                    except Exception as e:
-                        st.error(f"计算出错: {e}")
+                if as_of != "最新":
+                    calc_store_master_df = store_history.store_master(as_of)
+                    calc_store_index = store_history.store_index(as_of)
+                    calc_store_version = f"history:{as_of}|{get_file_version(blacklist_path)}"
+                    calc_price_list = None
+            render_single_item_calculator(
+                config, calc_store_master_df, calc_store_index, region_hierarchy, dim_metadata, xp_map,
+                store_blacklist_df, config_version, calc_store_version, calc_price_list,
+            )
 
     # --- Tab 2: 批量计算器 ---
     # 仅在功能开关启用时显示批量计算器
@@ -687,12 +1113,17 @@ def main():
             st.markdown("---")
             uploaded_batch = st.file_uploader("上传批量Excel文件", type=["xlsx"])
             if "batch_last_file_id" not in st.session_state: st.session_state.batch_last_file_id = None
-            if "batch_results_df" not in st.session_state: st.session_state.batch_results_df = None
+            # 结果保存在磁盘结果存储中，会话只保留句柄
+            if "batch_result_handle" not in st.session_state: st.session_state.batch_result_handle = None
+            result_store = get_batch_result_store(
+                os.environ.get("XP_FEE_RESULT_DIR", os.path.join(project_root, ".cache", "batch_results"))
+            )
+            batch_by_war_zone = st.checkbox("按战区展开", help="为每行追加各战区的折后费用列 (自定义通道行不适用)")
 
             if uploaded_batch:
                 current_file_id = uploaded_batch.file_id
                 if current_file_id != st.session_state.batch_last_file_id:
-                    st.session_state.batch_results_df = None
+                    st.session_state.batch_result_handle = None
                     st.session_state.batch_last_file_id = current_file_id
 
                 if st.button("开始批量计算", type="primary", use_container_width=True):
@@ -704,92 +1135,58 @@ def main():
                             # [新增] 检查是否存在 '退货比例(%)' 列，如果不存在则警告或默认0
                             if '退货比例(%)' not in df.columns:
                                 st.warning("⚠️ 提示：上传的Excel中缺少【退货比例(%)】列。如果是效期可退类商品，将默认按 100% 处理。建议下载最新模板。")
-                            
-                            with st.spinner("正在批量计算..."):
-                                results = []
-                                progress_bar = st.progress(0)
-                                
-                                for index, row in df.iterrows():
-                                    row_dict = row.to_dict()
-                                    try:
-                                        p_type = row_dict.get('统采or地采')
-                                        if pd.isna(p_type) or str(p_type).strip() == "":
-                                            row_dict['统采or地采'] = "统采"
-                                        else:
-                                            row_dict['统采or地采'] = str(p_type).strip()
-
-                                        channel_name = row_dict.get('铺货通道')
-                                        batch_xp_cat = row_dict.get('处方类别')
-                                        batch_target_code = xp_map.get(str(batch_xp_cat).strip()) if (batch_xp_cat and xp_map) else None
-                                        
-                                        batch_war_zone = row_dict.get('提报战区')
-                                        if pd.isna(batch_war_zone) or str(batch_war_zone).strip() == "" or str(batch_war_zone).strip() == "全集团":
-                                            batch_war_zone = "全集团"
-                                        else:
-                                            batch_war_zone = str(batch_war_zone).strip()
-
-                                        # [新增] 清洗退货比例
-                                        ratio_val = row_dict.get('退货比例(%)', 100)
-                                        if pd.isna(ratio_val): ratio_val = 100
-                                        row_dict['退货比例(%)'] = float(ratio_val)
-
-                                        excluded_count = 0
-                                        batch_category = row_dict.get('新品大类')
-                                        if channel_name == "自定义":
-                                            store_counts = extract_manual_counts(row_dict)
-                                        else:
-                                            store_counts = calc_auto_counts(
-                                                store_master_df, 
-                                                channel_name, 
-                                                restricted_xp_code=batch_target_code,
-                                                war_zone=batch_war_zone,
-                                                blacklist_df=store_blacklist_df,
-                                                selected_xp_category=str(batch_xp_cat).strip() if batch_xp_cat else None,
-                                                category=str(batch_category).strip() if batch_category else None,
-                                            )
-                                            raw_counts = calc_auto_counts(
-                                                store_master_df,
-                                                channel_name,
-                                                restricted_xp_code=None,
-                                                war_zone=batch_war_zone,
-                                            )
-                                            excluded_count = sum(raw_counts.values()) - sum(store_counts.values())
-                                        
-                                        result = calculate_fee(row_dict, store_counts, config)
-                                        
-                                        row_dict['理论总新品铺货费 (元)'] = int(result['theoretical_fee'])
-                                        row_dict['折扣'] = result['discount_factor']
-                                        row_dict['折后总新品铺货费 (元)'] = int(result['final_fee'])
-                                        active_stores = {k: v for k, v in result['store_details'].items() if v > 0}
-                                        row_dict['[详情]门店分布'] = str(active_stores)
-                                        if excluded_count > 0:
-                                            row_dict['备注'] = f"已剔除门店数(受限)：{excluded_count}"
-                                        else:
-                                            row_dict['备注'] = ""
-                                        results.append(row_dict)
-                                    except Exception as e:
-                                        row_dict['备注'] = f"Error: {e}"
-                                        results.append(row_dict)
-                                    progress_bar.progress((index + 1) / len(df))
-                                
-                                result_df = pd.DataFrame(results)
-                                st.success("批量计算完成！")
-                                st.session_state.batch_results_df = result_df
+
+                            # 计算前先按列校验，文件级错误 (缺少必需列) 时不计算
+                            clean_df, issues = validate_batch(df, config, xp_map)
+                            if not issues.empty:
+                                n_errors = int((issues["级别"] == "错误").sum())
+                                with st.expander(f"🔍 校验发现 {n_errors} 个错误、{len(issues) - n_errors} 个警告 (错误行不参与计算)", expanded=n_errors > 0):
+                                    st.dataframe(issues, hide_index=True)
+                            if (issues["级别"] == "错误").any() and issues["行号"].isna().any():
+                                st.error("❌ 批量文件缺少必需列，请下载最新模板。")
+                            else:
+                                with st.spinner("正在批量计算..."), span("app.batch_calculate"):
+                                    progress_bar = st.progress(0)
+                                    result_df = calculate_batch(
+                                        df,
+                                        store_master_df,
+                                        config,
+                                        xp_map=xp_map,
+                                        blacklist_df=store_blacklist_df,
+                                        by_war_zone=batch_by_war_zone,
+                                        progress_callback=lambda done, total: progress_bar.progress(done / total),
+                                        store_index=store_index,
+                                        validated=(clean_df, issues),
+                                    )
+                                    st.session_state.batch_result_handle = result_store.put(
+                                        get_quote_user(), result_df, name=uploaded_batch.name
+                                    )
+                                    del result_df
+                                    st.success("批量计算完成！")
                         except Exception as e:
                             st.error(f"处理文件失败: {e}")
                 
-                if st.session_state.batch_results_df is not None:
-                    st.dataframe(st.session_state.batch_results_df.head())
-                    output = BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        st.session_state.batch_results_df.to_excel(writer, index=False)
-                    st.download_button(
-                        "导出结果", 
-                        output.getvalue(), 
-                        file_name="新品费批量计算结果.xlsx", 
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                handle = st.session_state.batch_result_handle
+                if handle is not None:
+                    preview_df = result_store.read(handle, limit=5)
+                    if preview_df is None:
+                        st.session_state.batch_result_handle = None
+                        st.info("批量结果已过期被清理，请重新计算。")
+                    else:
+                        st.caption(f"共 {handle['n_rows']} 行，以下为前 5 行")
+                        st.dataframe(preview_df)
+                        st.download_button(
+                            "导出结果",
+                            lambda: result_store.excel_bytes(handle) or b"",
+                            file_name="新品费批量计算结果.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
         # 批量计算器模块结束（条件判断结束）
 
+    st.session_state["last_timing"] = finish_run()
+    if debug_mode:
+        render_debug_panel()
+    write_timing_metrics()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file